@@ -1,11 +1,14 @@
 import os
 import logging
 from functools import wraps
-from werkzeug.utils import secure_filename
-from flask import render_template, request, redirect, url_for, flash, session, abort
+from flask import render_template, request, redirect, url_for, flash, session, abort, jsonify
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from app import app, db
-from models import Admin, Artist, Song, create_default_admin, create_default_artists, init_db
+from models import Admin, Artist, Song, ArtistDeletion, artists_with_song_counts, bump_catalog_version
+from storage import store_stream, song_row, insert_songs, release, remove_file, discard_uncommitted
+from search_cache import search_cache
+import artist_images
+import deletion_jobs
 
 logger = logging.getLogger(__name__)
 
@@ -26,9 +29,6 @@ def admin_required(f):
     return decorated_function
 
 def register_admin_routes(app):
-    with app.app_context():
-        init_db()
-
     @app.route('/admin/login', methods=['GET', 'POST'])
     def admin_login():
         if request.method == 'POST':
@@ -56,9 +56,14 @@ def register_admin_routes(app):
     @app.route('/admin')
     @admin_required
     def admin_dashboard():
-        artists = Artist.query.order_by(Artist.name).all()
-        songs_count = Song.query.count()
-        return render_template('admin/dashboard.html', artists=artists, songs_count=songs_count)
+        artists = artists_with_song_counts()
+        songs_count = sum(song_count for _, song_count in artists)
+        deletions = (ArtistDeletion.query.filter(ArtistDeletion.status.in_(ArtistDeletion.ACTIVE))
+                     .order_by(ArtistDeletion.id).all())
+        # Once a job is removing files its artist row is already gone
+        deleting = {job.artist_id: job for job in deletions if job.status != ArtistDeletion.REMOVING_FILES}
+        return render_template('admin/dashboard.html', artists=artists, songs_count=songs_count,
+                               deletions=deletions, deleting=deleting)
 
     @app.route('/admin/artist/add', methods=['POST'])
     @admin_required
@@ -77,8 +82,12 @@ def register_admin_routes(app):
 
         new_artist = Artist(name=name, description=description)
         db.session.add(new_artist)
+        bump_catalog_version()
         db.session.commit()
 
+        # Look for the artist's picture without holding up the response
+        artist_images.schedule([new_artist.id])
+
         flash(f'Artist {name} added successfully', 'success')
         return redirect(url_for('admin_dashboard'))
 
@@ -100,10 +109,20 @@ def register_admin_routes(app):
             flash('Another artist with this name already exists', 'danger')
             return redirect(url_for('admin_dashboard'))
 
+        renamed = artist.name != name
         artist.name = name
         artist.description = description
+        if renamed:
+            # The image file is named after the artist; look it up again
+            artist.mbid = None
+            artist.image_url = None
+            artist.image_checked_at = None
+        bump_catalog_version()
         db.session.commit()
 
+        if renamed:
+            artist_images.schedule([artist.id])
+
         flash(f'Artist {name} updated successfully', 'success')
         return redirect(url_for('admin_dashboard'))
 
@@ -112,23 +131,23 @@ def register_admin_routes(app):
     def delete_artist(artist_id):
         artist = Artist.query.get_or_404(artist_id)
 
-        # Delete all songs for this artist
-        songs = Song.query.filter_by(artist_id=artist_id).all()
-        for song in songs:
-            try:
-                if os.path.exists(song.file_path):
-                    os.remove(song.file_path)
-            except Exception as e:
-                logger.error(f"Error deleting song file {song.file_path}: {str(e)}")
+        # Songs, rows that refer to them and their files are deleted in the background
+        job, created = deletion_jobs.submit(artist)
+        if created:
+            flash(f'Deleting artist {artist.name} and all their songs', 'info')
+        return redirect(url_for('artist_deletion', deletion_id=job.id))
 
-            db.session.delete(song)
-
-        # Delete the artist
-        db.session.delete(artist)
-        db.session.commit()
+    @app.route('/admin/deletions/<int:deletion_id>')
+    @admin_required
+    def artist_deletion(deletion_id):
+        job = ArtistDeletion.query.get_or_404(deletion_id)
+        return render_template('admin/deletion.html', job=job)
 
-        flash(f'Artist {artist.name} and all their songs deleted successfully', 'success')
-        return redirect(url_for('admin_dashboard'))
+    @app.route('/admin/deletions/<int:deletion_id>/status')
+    @admin_required
+    def artist_deletion_status(deletion_id):
+        job = ArtistDeletion.query.get_or_404(deletion_id)
+        return jsonify(job.to_dict())
 
     @app.route('/admin/upload', methods=['GET', 'POST'])
     @admin_required
@@ -145,9 +164,9 @@ def register_admin_routes(app):
 
             artist = Artist.query.get(artist_id)
             if not artist:
-                # Placeholder function -  replace with actual image download logic
-                get_artist_image(artist.name)
-
+                flash('Artist not found', 'danger')
+                artists = Artist.query.order_by(Artist.name).all()
+                return render_template('admin/upload.html', artists=artists)
 
             # Check if song already exists for this artist
             existing_song = Song.query.filter_by(name=song_name, artist_id=artist_id).first()
@@ -161,25 +180,27 @@ def register_admin_routes(app):
                     artists = Artist.query.order_by(Artist.name).all()
                     return render_template('admin/upload.html', artists=artists)
 
-            # Save the file
-            filename = secure_filename(f"{artist.name}_{song_name}.mp3")
-            file_path = os.path.join(app.config['MUSIC_FOLDER'], filename)
-
+            # Files stored by this request, removed again if it fails before committing
+            stored = []
             try:
-                song_file.save(file_path)
-
-                # Create song record
-                new_song = Song(
-                    name=song_name,
-                    artist_id=artist_id,
-                    file_path=file_path,
-                    source='admin_upload'
-                )
-
-                db.session.add(new_song)
+                # Store the file by content hash (duplicates share one blob)
+                blob = store_stream(song_file.stream, song_file.filename)
+                stored.append(blob.file_path)
+
+                # The same song uploaded concurrently is skipped by the database
+                inserted, unused = insert_songs([
+                    song_row(blob, name=song_name, artist_id=artist.id, source='admin_upload')
+                ])
+                if inserted:
+                    bump_catalog_version()
                 db.session.commit()
+                for path in unused:
+                    remove_file(path)
 
-                flash(f'Song {song_name} uploaded successfully', 'success')
+                if inserted:
+                    flash(f'Song {song_name} uploaded successfully', 'success')
+                else:
+                    flash('Song already exists for this artist', 'danger')
 
                 # Redirect based on where the form was submitted from
                 if request.referrer and 'artist' in request.referrer:
@@ -190,6 +211,11 @@ def register_admin_routes(app):
                     return redirect(url_for('admin_dashboard'))
 
             except Exception as e:
+                db.session.rollback()
+                unused = discard_uncommitted(stored)
+                db.session.commit()
+                for path in unused:
+                    remove_file(path)
                 logger.error(f"Error uploading song: {str(e)}")
                 flash(f'Error uploading song: {str(e)}', 'danger')
 
@@ -205,22 +231,20 @@ def register_admin_routes(app):
     def delete_song(song_id):
         song = Song.query.get_or_404(song_id)
 
-        # Delete the file
-        try:
-            if os.path.exists(song.file_path):
-                os.remove(song.file_path)
-        except Exception as e:
-            logger.error(f"Error deleting song file {song.file_path}: {str(e)}")
-
-        # Delete the record
+        # Drop the song's reference to its file, then delete the record
+        unused_file = release(song)
         db.session.delete(song)
+        bump_catalog_version()
         db.session.commit()
 
+        # Only remove the file once no other song shares it
+        remove_file(unused_file)
+
         flash(f'Song {song.name} deleted successfully', 'success')
         return redirect(url_for('artist_page', artist_id=song.artist_id))
 
-def get_artist_image(artist_name):
-    """Placeholder function: Replace with actual image download logic."""
-    print(f"Attempting to download image for artist: {artist_name} -  This is a placeholder function.")
-    # Add your image download logic here using appropriate libraries and APIs.
-    pass
\ No newline at end of file
+    @app.route('/admin/search-cache')
+    @admin_required
+    def search_cache_stats():
+        """Hit/miss statistics of this worker's remote search cache"""
+        return jsonify(search_cache.stats())
@@ -33,21 +33,100 @@ app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 app.config["MUSIC_FOLDER"] = os.path.join("static", "music")
 os.makedirs(app.config["MUSIC_FOLDER"], exist_ok=True)
 
+# How /play and /download hand audio to the client: "stream" (from Python),
+# "x-accel" (nginx X-Accel-Redirect) or "x-sendfile" (lighttpd/Apache X-Sendfile)
+app.config["AUDIO_DELIVERY"] = os.environ.get("AUDIO_DELIVERY", "stream")
+app.config["AUDIO_ACCEL_PREFIX"] = os.environ.get("AUDIO_ACCEL_PREFIX", "/protected/music")
+app.config["AUDIO_STREAM_BUFFER"] = int(os.environ.get("AUDIO_STREAM_BUFFER", 64 * 1024))
+
+# Rendered public pages are cached per catalog version (see page_cache.py);
+# set PAGE_CACHE_DIR to share the cache between workers on one host
+app.config["PAGE_CACHE_SIZE"] = int(os.environ.get("PAGE_CACHE_SIZE", 256))
+app.config["PAGE_CACHE_DIR"] = os.environ.get("PAGE_CACHE_DIR")
+# Pages showing play/download counts are re-rendered this often, since
+# counter flushes do not bump the catalog version
+app.config["PAGE_CACHE_COUNTER_TTL"] = float(os.environ.get("PAGE_CACHE_COUNTER_TTL", 60))
+
+# Play/download counters are buffered in memory and written in batches
+app.config["COUNTER_FLUSH_INTERVAL"] = float(os.environ.get("COUNTER_FLUSH_INTERVAL", 5))
+app.config["COUNTER_FLUSH_THRESHOLD"] = int(os.environ.get("COUNTER_FLUSH_THRESHOLD", 500))
+
+# Remote search results are cached per provider (see search_cache.py)
+app.config["SEARCH_CACHE_SIZE"] = int(os.environ.get("SEARCH_CACHE_SIZE", 512))
+app.config["SEARCH_CACHE_TTL"] = float(os.environ.get("SEARCH_CACHE_TTL", 600))
+app.config["SEARCH_CACHE_STALE"] = float(os.environ.get("SEARCH_CACHE_STALE", 3600))
+
+# Outbound HTTP (see http_client.py): pooled keep-alive connections,
+# timeouts, retries with jittered backoff and a per-host concurrency limit
+app.config["HTTP_POOL_SIZE"] = int(os.environ.get("HTTP_POOL_SIZE", 10))
+app.config["HTTP_MAX_PER_HOST"] = int(os.environ.get("HTTP_MAX_PER_HOST", 4))
+app.config["HTTP_CONNECT_TIMEOUT"] = float(os.environ.get("HTTP_CONNECT_TIMEOUT", 3.05))
+app.config["HTTP_READ_TIMEOUT"] = float(os.environ.get("HTTP_READ_TIMEOUT", 15))
+app.config["HTTP_RETRIES"] = int(os.environ.get("HTTP_RETRIES", 3))
+app.config["HTTP_BACKOFF"] = float(os.environ.get("HTTP_BACKOFF", 0.5))
+
+# Remote song downloads run as background jobs (see download_jobs.py)
+app.config["DOWNLOAD_WORKERS"] = int(os.environ.get("DOWNLOAD_WORKERS", 2))
+app.config["DOWNLOAD_JOB_STALE"] = float(os.environ.get("DOWNLOAD_JOB_STALE", 120))
+# Large files from servers that support Range are fetched as parallel segments
+app.config["DOWNLOAD_SEGMENTS"] = int(os.environ.get("DOWNLOAD_SEGMENTS", 4))
+app.config["DOWNLOAD_SEGMENT_MIN"] = int(os.environ.get("DOWNLOAD_SEGMENT_MIN", 4 * 1024 * 1024))
+
+# Chunked, resumable song uploads (see upload_routes.py): largest file, size
+# of each PUT the browser sends (and the most a single PUT may carry), and
+# how long an idle upload session is kept before its partial file is removed
+app.config["UPLOAD_MAX_SIZE"] = int(os.environ.get("BODY_SIZE_LIMIT", 300 * 1024 * 1024))
+app.config["UPLOAD_CHUNK_SIZE"] = int(os.environ.get("UPLOAD_CHUNK_SIZE", 8 * 1024 * 1024))
+app.config["UPLOAD_CHUNK_MAX"] = int(os.environ.get("UPLOAD_CHUNK_MAX", 32 * 1024 * 1024))
+app.config["UPLOAD_SESSION_TTL"] = float(os.environ.get("UPLOAD_SESSION_TTL", 24 * 3600))
+
+# Artists are deleted in the background (see deletion_jobs.py): songs per
+# transaction, heartbeat age after which a job is picked up again, and how
+# often and how patiently a file that cannot be removed is retried
+app.config["ARTIST_DELETE_BATCH"] = int(os.environ.get("ARTIST_DELETE_BATCH", 500))
+app.config["ARTIST_DELETE_STALE"] = float(os.environ.get("ARTIST_DELETE_STALE", 120))
+app.config["FILE_DELETE_RETRIES"] = int(os.environ.get("FILE_DELETE_RETRIES", 5))
+app.config["FILE_DELETE_BACKOFF"] = float(os.environ.get("FILE_DELETE_BACKOFF", 2.0))
+
 # Initialize the app with the extension
 db.init_app(app)
 
-with app.app_context():
-    # Import the models
-    import models
+_routes_registered = False
+
 
-    # Create all tables
-    db.create_all()
+def create_app():
+    """Return the web application with all routes registered.
+
+    This only wires up views and is cheap: nothing here touches the database
+    or the network. Tables, schema upgrades, the search index and the default
+    data are created once per deploy with `python bootstrap.py`. CLI scripts
+    import `app` directly and never load the web modules.
+    There is one application per process, so calling this again is a no-op.
+    """
+    global _routes_registered
+    if _routes_registered:
+        return app
+    _routes_registered = True
 
     # Import and register routes
     from routes import register_routes
     from admin import register_admin_routes
     from playlist_routes import register_playlist_routes
-    
+    from upload_routes import register_upload_routes
+
     register_routes(app)
     register_admin_routes(app)
     register_playlist_routes(app)
+    register_upload_routes(app)
+
+    # srcset helper for templates and immutable caching of image variants
+    from image_variants import register_image_variants
+    register_image_variants(app)
+
+    # Pick up download jobs and artist deletions left unfinished by the previous run, off the boot path
+    import download_jobs
+    download_jobs.start_recovery()
+    import deletion_jobs
+    deletion_jobs.start_recovery()
+
+    return app
@@ -0,0 +1,217 @@
+"""
+Artist images for Country Music Paradise
+
+Looks artists up on MusicBrainz, follows their "image" URL relation and
+saves the picture as static/img/artists/<artist_name>.jpg, the file the
+home page shows. Images are fetched by update_artist_images.py or in the
+background after an admin adds or renames an artist, never while starting
+the app or serving a request.
+
+- Several artists are processed at once, but all MusicBrainz calls share
+  one rate limiter (one request per second, as their API terms require).
+  MusicBrainz answers too many requests with 503, so its calls go through
+  a session that never retries by itself; each retry waits for the
+  limiter again
+- The MusicBrainz id and image URL found for an artist are stored on the
+  Artist row, so later runs skip both lookups
+- Images are re-requested with If-None-Match / If-Modified-Since, so an
+  unchanged image costs a 304 instead of a download
+- Artists checked within REFRESH_AFTER are skipped unless forced
+- New or changed pictures get their resized variants (image_variants.py)
+"""
+
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+from sqlalchemy import update, or_
+from app import app, db
+from models import Artist, bump_catalog_version
+import http_client
+import image_variants
+
+logger = logging.getLogger(__name__)
+
+MUSICBRAINZ_API = "https://musicbrainz.org/ws/2"
+
+# MusicBrainz allows one request per second per client
+musicbrainz_limiter = http_client.RateLimiter(1.0)
+
+# Attempts after a 503/429 or a network error, each paced by the limiter
+MUSICBRAINZ_RETRIES = 3
+
+# Longest Retry-After we are willing to sleep for
+MAX_RETRY_AFTER = 30
+
+# How long a checked image is considered current
+REFRESH_AFTER = timedelta(days=7)
+
+# Width requested from Wikimedia Commons (the home page cards are ~300px)
+COMMONS_WIDTH = 600
+
+_lock = threading.Lock()
+_pool = None
+_pool_pid = None
+
+
+def _executor():
+    """The background image thread of this process (recreated after a fork)"""
+    global _pool, _pool_pid
+    with _lock:
+        if _pool_pid != os.getpid():
+            _pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='artist-images')
+            _pool_pid = os.getpid()
+    return _pool
+
+
+def image_path(artist_name):
+    """File the home page loads for an artist"""
+    filename = f"{artist_name.lower().replace(' ', '_')}.jpg"
+    return os.path.join(app.static_folder, 'img', 'artists', filename)
+
+
+def _retry_after(response):
+    value = response.headers.get('Retry-After', '')
+    return min(float(value), MAX_RETRY_AFTER) if value.isdigit() else 0
+
+
+def _musicbrainz(path, **params):
+    """GET a MusicBrainz resource; every attempt waits for the rate limiter"""
+    for attempt in range(MUSICBRAINZ_RETRIES + 1):
+        last = attempt == MUSICBRAINZ_RETRIES
+        musicbrainz_limiter.wait()
+        try:
+            response = http_client.get(f"{MUSICBRAINZ_API}/{path}", params={**params, 'fmt': 'json'},
+                                       retries=False)
+        except IOError as e:
+            if last:
+                raise
+            logger.info(f"MusicBrainz request failed, retrying: {str(e)}")
+            continue
+        if response.status_code not in (429, 503) or last:
+            break
+        logger.info(f"MusicBrainz answered {response.status_code}, retrying")
+        time.sleep(_retry_after(response))
+    response.raise_for_status()
+    return response.json()
+
+
+def _find_mbid(artist_name):
+    data = _musicbrainz('artist/', query=f'artist:"{artist_name}"', limit=1)
+    artists = data.get('artists') or []
+    return artists[0]['id'] if artists else None
+
+
+def _direct_image_url(url):
+    """Turn a Commons file page into a URL that serves the image itself"""
+    if 'commons.wikimedia.org/wiki/File:' in url:
+        name = url.split('File:', 1)[1]
+        return f"https://commons.wikimedia.org/wiki/Special:FilePath/{quote(name)}?width={COMMONS_WIDTH}"
+    return url
+
+
+def _find_image_url(mbid):
+    data = _musicbrainz(f'artist/{mbid}', inc='url-rels')
+    for relation in data.get('relations', []):
+        if relation.get('type') == 'image':
+            return _direct_image_url(relation['url']['resource'])
+    return None
+
+
+def _download(item, image_url, path):
+    """Fetch the image unless the copy on disk is still current"""
+    headers = {}
+    if os.path.exists(path) and image_url == item['image_url']:
+        if item['image_etag']:
+            headers['If-None-Match'] = item['image_etag']
+        if item['image_last_modified']:
+            headers['If-Modified-Since'] = item['image_last_modified']
+
+    with http_client.stream(image_url, headers=headers) as response:
+        if response.status_code == 304:
+            return 'unchanged', item['image_etag'], item['image_last_modified']
+        response.raise_for_status()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                f.write(chunk)
+        os.replace(tmp, path)
+        return 'updated', response.headers.get('ETag'), response.headers.get('Last-Modified')
+
+
+def _fetch_one(item, force):
+    """Worker: find and download one artist's image. Does not touch the database."""
+    row = {
+        'id': item['id'],
+        'mbid': item['mbid'],
+        'image_url': item['image_url'],
+        'image_etag': item['image_etag'],
+        'image_last_modified': item['image_last_modified'],
+        'image_checked_at': datetime.utcnow(),
+    }
+    try:
+        if not row['mbid']:
+            row['mbid'] = _find_mbid(item['name'])
+        if row['mbid'] and (force or not row['image_url']):
+            row['image_url'] = _find_image_url(row['mbid'])
+        if not row['image_url']:
+            return row, 'not_found'
+
+        result, row['image_etag'], row['image_last_modified'] = _download(item, row['image_url'], image_path(item['name']))
+        return row, result
+    except Exception as e:
+        logger.warning(f"Could not fetch image for {item['name']}: {str(e)}")
+        return row, 'error'
+
+
+def fetch_images(artist_ids=None, workers=4, force=False):
+    """Fetch images for the given artists (default: all that are due).
+
+    Returns a dict counting 'updated', 'unchanged', 'not_found' and 'error'.
+    """
+    query = db.session.query(
+        Artist.id, Artist.name, Artist.mbid, Artist.image_url,
+        Artist.image_etag, Artist.image_last_modified,
+    )
+    if artist_ids is not None:
+        query = query.filter(Artist.id.in_(artist_ids))
+    if not force:
+        cutoff = datetime.utcnow() - REFRESH_AFTER
+        query = query.filter(or_(Artist.image_checked_at.is_(None), Artist.image_checked_at < cutoff))
+    items = [row._asdict() for row in query.order_by(Artist.name)]
+
+    counts = dict.fromkeys(('updated', 'unchanged', 'not_found', 'error'), 0)
+    if not items:
+        return counts
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='artist-image') as pool:
+        outcomes = list(pool.map(lambda item: _fetch_one(item, force), items))
+
+    for _, result in outcomes:
+        counts[result] += 1
+    db.session.execute(update(Artist), [row for row, _ in outcomes])
+    if counts['updated'] and image_variants.generate():
+        # New variant files mean new srcset markup on the home page
+        bump_catalog_version()
+    db.session.commit()
+    logger.info(f"Artist images: {counts}")
+    return counts
+
+
+def _run_in_background(artist_ids):
+    with app.app_context():
+        try:
+            fetch_images(artist_ids)
+        except Exception as e:
+            logger.error(f"Background artist image fetch failed: {str(e)}")
+        finally:
+            db.session.remove()
+
+
+def schedule(artist_ids):
+    """Fetch images for these artists on a background thread"""
+    _executor().submit(_run_in_background, list(artist_ids))
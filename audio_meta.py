@@ -0,0 +1,404 @@
+"""
+Audio header parsing for Country Music Paradise
+
+Reads the technical details of a song (duration, bitrate, sample rate,
+codec, byte size) straight from the file headers, without decoding audio
+and without third-party libraries:
+- MP3: ID3v2/ID3v1 tags, the first MPEG frame header and the Xing/Info or
+  VBRI header written by VBR encoders
+- M4A/MP4: the moov atom (mvhd, mdhd, hdlr and stsd boxes)
+
+Only a few kilobytes are read for MP3 files; for M4A files the moov atom is
+read wherever it sits in the file.
+"""
+
+import os
+import struct
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Bitrates in kbps indexed by [version_key][layer][bitrate_index]
+# version_key is 1 for MPEG-1 and 2 for MPEG-2/2.5
+_BITRATES = {
+    1: {
+        1: [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+        2: [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+        3: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    },
+    2: {
+        1: [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+        2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+        3: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    },
+}
+
+# Sample rates in Hz indexed by version bits
+_SAMPLE_RATES = {
+    3: [44100, 48000, 32000],   # MPEG-1
+    2: [22050, 24000, 16000],   # MPEG-2
+    0: [11025, 12000, 8000],    # MPEG-2.5
+}
+
+# How far into an MP3 we look for the first frame after the ID3v2 tag
+_MAX_SYNC_SCAN = 64 * 1024
+
+# MP4 sample entry formats we know how to name
+_MP4_CODECS = {
+    b'mp4a': 'aac',
+    b'alac': 'alac',
+    b'ac-3': 'ac3',
+    b'ec-3': 'eac3',
+    b'.mp3': 'mp3',
+    b'Opus': 'opus',
+    b'fLaC': 'flac',
+}
+
+# ID3v2 text frames we keep, mapped to tag names (v2.3/2.4 and v2.2 ids)
+_ID3_FRAMES = {
+    'TIT2': 'title', 'TPE1': 'artist', 'TALB': 'album',
+    'TT2': 'title', 'TP1': 'artist', 'TAL': 'album',
+}
+
+
+def _syncsafe(data):
+    """Decode a 4-byte ID3v2 syncsafe integer"""
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+
+def _decode_id3_text(payload):
+    """Decode an ID3v2 text frame payload (first byte is the encoding)"""
+    if not payload:
+        return None
+    encoding, text = payload[0], payload[1:]
+    codec = {0: 'latin-1', 1: 'utf-16', 2: 'utf-16-be', 3: 'utf-8'}.get(encoding, 'latin-1')
+    try:
+        value = text.decode(codec)
+    except UnicodeDecodeError:
+        return None
+    return value.split('\x00')[0].strip() or None
+
+
+def _parse_id3v2(tag, major):
+    """Extract the text frames we care about from an ID3v2 tag body"""
+    tags = {}
+    pos = 0
+    id_len, header_len = (3, 6) if major == 2 else (4, 10)
+    while pos + header_len <= len(tag):
+        frame_id = tag[pos:pos + id_len]
+        if not frame_id.strip(b'\x00'):
+            break  # padding
+        if major == 2:
+            size = int.from_bytes(tag[pos + 3:pos + 6], 'big')
+        elif major == 4:
+            size = _syncsafe(tag[pos + 4:pos + 8])
+        else:
+            size = int.from_bytes(tag[pos + 4:pos + 8], 'big')
+        body = tag[pos + header_len:pos + header_len + size]
+        name = _ID3_FRAMES.get(frame_id.decode('latin-1', 'replace'))
+        if name and name not in tags:
+            value = _decode_id3_text(body)
+            if value:
+                tags[name] = value
+        pos += header_len + size
+    return tags
+
+
+def parse_frame_header(header):
+    """Decode a 4-byte MPEG audio frame header, or return None if invalid"""
+    if len(header) < 4 or header[0] != 0xFF or (header[1] & 0xE0) != 0xE0:
+        return None
+    version_bits = (header[1] >> 3) & 0x03
+    layer_bits = (header[1] >> 1) & 0x03
+    bitrate_index = (header[2] >> 4) & 0x0F
+    rate_index = (header[2] >> 2) & 0x03
+    padding = (header[2] >> 1) & 0x01
+    channel_mode = (header[3] >> 6) & 0x03
+
+    if version_bits == 1 or layer_bits == 0 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+
+    layer = 4 - layer_bits
+    version_key = 1 if version_bits == 3 else 2
+    bitrate = _BITRATES[version_key][layer][bitrate_index]
+    sample_rate = _SAMPLE_RATES[version_bits][rate_index]
+
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate * 1000 // sample_rate + padding) * 4
+    else:
+        samples = 1152 if (layer == 2 or version_key == 1) else 576
+        length = samples // 8 * bitrate * 1000 // sample_rate + padding
+
+    return {
+        'version_key': version_key,
+        'layer': layer,
+        'bitrate': bitrate,
+        'sample_rate': sample_rate,
+        'samples': samples,
+        'length': length,
+        'mono': channel_mode == 3,
+    }
+
+
+def find_first_frame(data, start=0):
+    """Offset and header of the first MPEG frame at or after `start` in `data`.
+
+    A candidate is only accepted when the frame that follows it also starts
+    with a valid header (or the candidate runs to the end of `data`), which
+    rules out stray 0xFF bytes in album art or padding.
+    """
+    pos = data.find(b'\xFF', start)
+    while 0 <= pos < len(data) - 4:
+        frame = parse_frame_header(data[pos:pos + 4])
+        if frame:
+            following = pos + frame['length']
+            if following + 4 > len(data) or parse_frame_header(data[following:following + 4]):
+                return pos, frame
+        pos = data.find(b'\xFF', pos + 1)
+    return None, None
+
+
+def _vbr_header(data, offset, frame):
+    """Frame and byte counts from a Xing/Info or VBRI header, if present"""
+    if frame['version_key'] == 1:
+        side_info = 17 if frame['mono'] else 32
+    else:
+        side_info = 9 if frame['mono'] else 17
+
+    xing = offset + 4 + side_info
+    if data[xing:xing + 4] in (b'Xing', b'Info'):
+        flags = int.from_bytes(data[xing + 4:xing + 8], 'big')
+        pos = xing + 8
+        frames = total_bytes = None
+        if flags & 0x1:
+            frames = int.from_bytes(data[pos:pos + 4], 'big')
+            pos += 4
+        if flags & 0x2:
+            total_bytes = int.from_bytes(data[pos:pos + 4], 'big')
+        return frames, total_bytes
+
+    vbri = offset + 4 + 32
+    if data[vbri:vbri + 4] == b'VBRI':
+        total_bytes = int.from_bytes(data[vbri + 10:vbri + 14], 'big')
+        frames = int.from_bytes(data[vbri + 14:vbri + 18], 'big')
+        return frames, total_bytes
+
+    return None, None
+
+
+def id3v2_size(head):
+    """Length of the ID3v2 tag at the start of a file (0 if there is none)"""
+    if len(head) < 10 or head[:3] != b'ID3':
+        return 0
+    size = _syncsafe(head[6:10]) + 10
+    if head[5] & 0x10:
+        size += 10  # footer
+    return size
+
+
+def probe_mp3(f, file_size):
+    """Technical metadata for an MP3 file object"""
+    head = f.read(10)
+    tags = {}
+    audio_start = id3v2_size(head)
+    if audio_start:
+        tag = f.read(audio_start - 10)
+        if not head[5] & 0x80:  # unsynchronised tags are rare; skip them
+            tags = _parse_id3v2(tag, head[3])
+
+    f.seek(audio_start)
+    data = f.read(_MAX_SYNC_SCAN)
+    offset, frame = find_first_frame(data)
+    if frame is None:
+        return None
+
+    audio_end = file_size
+    f.seek(max(file_size - 128, 0))
+    if f.read(3) == b'TAG':
+        audio_end -= 128
+
+    frames, vbr_bytes = _vbr_header(data, offset, frame)
+    audio_bytes = vbr_bytes or (audio_end - audio_start - offset)
+    if frames:
+        duration = frames * frame['samples'] / frame['sample_rate']
+        bitrate = int(round(audio_bytes * 8 / duration / 1000)) if duration else frame['bitrate']
+    else:
+        bitrate = frame['bitrate']
+        duration = audio_bytes * 8 / (bitrate * 1000)
+
+    return {
+        'duration': round(duration, 3),
+        'bitrate': bitrate,
+        'sample_rate': frame['sample_rate'],
+        'codec': 'mp3' if frame['layer'] == 3 else f"mp{frame['layer']}",
+        'tags': tags,
+    }
+
+
+def _iter_boxes(data, start=0, end=None):
+    """Yield (type, body_start, body_end) for the MP4 boxes in data[start:end]"""
+    end = len(data) if end is None else end
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack('>I4s', data[pos:pos + 8])
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', data[pos + 8:pos + 16])[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header:
+            break
+        yield box_type, pos + header, min(pos + size, end)
+        pos += size
+
+
+def _find_box(data, path, start=0, end=None):
+    """Body range of the first box matching a path like [b'mdia', b'minf']"""
+    for box_type, body_start, body_end in _iter_boxes(data, start, end):
+        if box_type == path[0]:
+            if len(path) == 1:
+                return body_start, body_end
+            return _find_box(data, path[1:], body_start, body_end)
+    return None
+
+
+def _read_top_level(f, file_size):
+    """Read the moov atom and total the mdat sizes by walking top-level boxes"""
+    moov = None
+    mdat_bytes = 0
+    pos = 0
+    while pos + 8 <= file_size:
+        f.seek(pos)
+        header = f.read(16)
+        if len(header) < 8:
+            break
+        size, box_type = struct.unpack('>I4s', header[:8])
+        header_len = 8
+        if size == 1:
+            size = struct.unpack('>Q', header[8:16])[0]
+            header_len = 16
+        elif size == 0:
+            size = file_size - pos
+        if size < header_len:
+            break
+        if box_type == b'moov':
+            f.seek(pos + header_len)
+            moov = f.read(size - header_len)
+        elif box_type == b'mdat':
+            mdat_bytes += size - header_len
+        pos += size
+    return moov, mdat_bytes
+
+
+def probe_mp4(f, file_size):
+    """Technical metadata for an M4A/MP4 file object"""
+    f.seek(4)
+    if f.read(4) != b'ftyp':
+        return None
+
+    moov, mdat_bytes = _read_top_level(f, file_size)
+    if not moov:
+        return None
+
+    duration = None
+    sample_rate = None
+    codec = None
+
+    mvhd = _find_box(moov, [b'mvhd'])
+    if mvhd:
+        body = moov[mvhd[0]:mvhd[1]]
+        if body[0] == 1:
+            timescale, length = struct.unpack('>IQ', body[20:32])
+        else:
+            timescale, length = struct.unpack('>II', body[12:20])
+        if timescale:
+            duration = length / timescale
+
+    for box_type, trak_start, trak_end in _iter_boxes(moov):
+        if box_type != b'trak':
+            continue
+        hdlr = _find_box(moov, [b'mdia', b'hdlr'], trak_start, trak_end)
+        if not hdlr or moov[hdlr[0] + 8:hdlr[0] + 12] != b'soun':
+            continue
+
+        mdhd = _find_box(moov, [b'mdia', b'mdhd'], trak_start, trak_end)
+        if mdhd:
+            body = moov[mdhd[0]:mdhd[1]]
+            if body[0] == 1:
+                timescale, length = struct.unpack('>IQ', body[20:32])
+            else:
+                timescale, length = struct.unpack('>II', body[12:20])
+            if timescale:
+                duration = length / timescale
+                sample_rate = timescale
+
+        stsd = _find_box(moov, [b'mdia', b'minf', b'stbl', b'stsd'], trak_start, trak_end)
+        if stsd:
+            # version/flags (4) + entry count (4), then the first sample entry
+            entry = stsd[0] + 8
+            entry_format = moov[entry + 4:entry + 8]
+            codec = _MP4_CODECS.get(entry_format, entry_format.decode('latin-1', 'replace').strip())
+            # Audio sample entry: 8 bytes box header, 6 reserved, 2 data ref,
+            # 8 reserved, channels, sample size, 4 reserved, then 16.16 rate
+            rate = struct.unpack('>I', moov[entry + 32:entry + 36])[0] >> 16
+            if rate:
+                sample_rate = rate
+        break
+
+    if duration is None:
+        return None
+
+    audio_bytes = mdat_bytes or file_size
+    bitrate = int(round(audio_bytes * 8 / duration / 1000)) if duration else None
+    return {
+        'duration': round(duration, 3),
+        'bitrate': bitrate,
+        'sample_rate': sample_rate,
+        'codec': codec,
+        'tags': {},
+    }
+
+
+def probe(path):
+    """Read the technical metadata of an audio file.
+
+    Returns a dict with duration (seconds), bitrate (kbps), sample_rate (Hz),
+    codec, size (bytes) and tags. Fields that cannot be determined are None;
+    size is always filled in for files that exist.
+    """
+    info = {
+        'duration': None,
+        'bitrate': None,
+        'sample_rate': None,
+        'codec': None,
+        'size': None,
+        'tags': {},
+    }
+    try:
+        file_size = os.path.getsize(path)
+        info['size'] = file_size
+        with open(path, 'rb') as f:
+            head = f.read(12)
+            f.seek(0)
+            if head[4:8] == b'ftyp':
+                details = probe_mp4(f, file_size)
+            else:
+                details = probe_mp3(f, file_size)
+        if details:
+            info.update(details)
+    except (OSError, struct.error, IndexError, ZeroDivisionError) as e:
+        logger.warning(f"Could not read audio headers of {path}: {str(e)}")
+    return info
+
+
+def apply_to_song(song, path):
+    """Copy the probed metadata of `path` onto a Song's technical columns"""
+    info = probe(path)
+    song.duration = info['duration']
+    song.bitrate = info['bitrate']
+    song.sample_rate = info['sample_rate']
+    song.codec = info['codec']
+    song.file_size = info['size']
+    return info
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""
+Backfill Song Audio Metadata
+
+Songs added before ingest-time metadata extraction have no duration,
+bitrate, sample rate, codec or file size. This script reads the headers of
+those files in parallel and stores the results, one batch at a time. MP3
+files also get their seek table (see seek_index.py) if it is missing.
+
+Usage:
+  python backfill_metadata.py [--workers 4] [--batch-size 500] [--all]
+
+By default only songs without a file_size are processed; --all re-reads
+every song in the library.
+"""
+
+import os
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import update
+from app import app, db
+from models import Song, bump_catalog_version
+from audio_meta import probe
+import seek_index
+from storage import resolve
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def probe_song(item):
+    """Worker: read the headers of one song file. Runs in a child process."""
+    song_id, path = item
+    info = probe(path)
+    seek_index.ensure(path)
+    return {
+        'id': song_id,
+        'duration': info['duration'],
+        'bitrate': info['bitrate'],
+        'sample_rate': info['sample_rate'],
+        'codec': info['codec'],
+        'file_size': info['size'],
+    }
+
+def backfill(workers, batch_size, refresh_all=False):
+    """Fill in technical metadata for songs that are missing it."""
+    last_id = 0
+    updated = 0
+    missing = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            query = db.session.query(Song.id, Song.file_path).filter(Song.id > last_id)
+            if not refresh_all:
+                query = query.filter(Song.file_size.is_(None))
+            batch = query.order_by(Song.id).limit(batch_size).all()
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            items = []
+            for song_id, file_path in batch:
+                path = resolve(file_path)
+                if os.path.exists(path):
+                    items.append((song_id, path))
+                else:
+                    missing += 1
+                    logger.warning(f"Missing file for song {song_id}: {file_path}")
+
+            rows = list(pool.map(probe_song, items, chunksize=16))
+            if rows:
+                # One executemany UPDATE ... WHERE id = ? for the whole batch
+                db.session.execute(update(Song), rows)
+                bump_catalog_version()
+                db.session.commit()
+            updated += len(rows)
+            logger.info(f"Updated {updated} songs so far (up to id {last_id})")
+
+    return updated, missing
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read audio headers for songs that have no metadata yet")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="parallel header readers")
+    parser.add_argument("--batch-size", type=int, default=500, help="songs per database round trip")
+    parser.add_argument("--all", action="store_true", help="re-read every song, not only missing ones")
+    args = parser.parse_args()
+
+    with app.app_context():
+        updated, missing = backfill(args.workers, args.batch_size, args.all)
+
+    print(f"Metadata backfill complete. Updated {updated} songs, {missing} files missing.")
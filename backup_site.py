@@ -7,119 +7,453 @@ It backs up both the database and song files into a single ZIP archive
 that can be easily transferred to a new server.
 
 Usage:
-  python backup_site.py
+  python backup_site.py [--incremental] [--workers 4] [--backup-dir backups]
+  python backup_site.py --restore backups/country_music_backup_<timestamp>.zip [--target DIR]
 
 The backup will be created in the 'backups' directory.
+
+Every archive holds a manifest (backup_manifest.json) listing each file of
+the music folder with its size, mtime and SHA-256, and the archive that
+holds its bytes. With --incremental only files whose content is not in the
+previous backup are added, so the newest archive plus the earlier archives
+its manifest refers to (its chain) make up the full backup. Keep the whole
+chain together in the backup directory; restore_site.py restores the music
+files from all of them and the database from the newest (--restore here
+only extracts the files).
+
+The database is copied into the archive while the site keeps running:
+SQLite through its online backup API into a temporary file that is then
+streamed into the archive, PostgreSQL by streaming pg_dump.
+
+Audio is stored as-is (MP3/M4A/OGG do not compress further); hashing of
+changed files runs on --workers threads while the archive is written.
 """
 
 import os
+import re
+import json
 import shutil
+import hashlib
+import time
 import datetime
 import logging
 import zipfile
+import argparse
+import sqlite3
+import tempfile
 import subprocess
+import threading
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from app import app, db
+from storage import BLOB_NAME
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def create_backup():
-    """Create a complete backup of the site including database and song files."""
+MANIFEST_NAME = "backup_manifest.json"
+ARCHIVE_PATTERN = re.compile(r'^country_music_backup_\d{8}_\d{6}\.zip$')
+
+# Already-compressed audio is stored without recompression
+STORED_EXTENSIONS = ('.mp3', '.m4a', '.ogg')
+
+# Music folder entries that are never backed up (partial uploads/downloads)
+SKIP_DIRS = ('.incoming',)
+
+# SQLite online backup: pages copied per step and the pause between steps,
+# during which the site can use the database
+SQLITE_BACKUP_PAGES = 1024
+SQLITE_BACKUP_SLEEP = 0.005
+# Restarts caused by concurrent writes before the copy is taken in one step
+SQLITE_BACKUP_RESTARTS = 5
+
+# Size of the pieces the database snapshot is written into the archive in
+STREAM_CHUNK = 1024 * 1024
+
+def _database_url():
+    """SQLAlchemy URL of the site database (relative SQLite paths resolved)."""
+    with app.app_context():
+        return db.engine.url
+
+class _BackupRestarted(Exception):
+    """The online backup was restarted too often by concurrent writes"""
+
+def _sqlite_backup(database, target_path, pages):
+    """Copy a live SQLite database into target_path with the online backup API.
+
+    A write by another connection while the copy is under way makes SQLite
+    start the copy over. After SQLITE_BACKUP_RESTARTS restarts this gives up
+    with _BackupRestarted.
+    """
+    restarts = [0]
+    last = [None]
+
+    def progress(status, remaining, total):
+        if last[0] is not None and remaining > last[0]:
+            restarts[0] += 1
+            if restarts[0] >= SQLITE_BACKUP_RESTARTS:
+                raise _BackupRestarted()
+        last[0] = remaining
+
+    source = sqlite3.connect(database)
+    target = sqlite3.connect(target_path)
+    try:
+        source.backup(target, pages=pages, progress=progress, sleep=SQLITE_BACKUP_SLEEP)
+    finally:
+        target.close()
+        source.close()
+
+def snapshot_sqlite(zipf, member, database):
+    """Copy a live SQLite database into the archive with the online backup API.
+
+    The backup runs SQLITE_BACKUP_PAGES pages at a time, so the site can keep
+    reading and writing between steps. But every write made by another
+    connection during the copy restarts it from the first page, so on a
+    busy site it may never finish in steps. After SQLITE_BACKUP_RESTARTS
+    restarts the copy is taken in a single step instead, which keeps
+    writers waiting for its duration unless the database is in WAL mode.
+
+    The copy goes to a temporary file next to the archive and is streamed
+    into the archive in STREAM_CHUNK pieces, so memory use does not depend
+    on the size of the database.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(zipf.filename)), suffix='.sqlite3.tmp')
+    os.close(fd)
+    try:
+        try:
+            _sqlite_backup(database, tmp_path, SQLITE_BACKUP_PAGES)
+        except _BackupRestarted:
+            logger.warning(f"SQLite backup restarted {SQLITE_BACKUP_RESTARTS} times by concurrent writes; "
+                           "copying in one step")
+            os.truncate(tmp_path, 0)
+            _sqlite_backup(database, tmp_path, -1)
+
+        size = os.path.getsize(tmp_path)
+        with open(tmp_path, 'rb') as src, zipf.open(member, 'w', force_zip64=True) as out:
+            shutil.copyfileobj(src, out, STREAM_CHUNK)
+    finally:
+        os.remove(tmp_path)
+    logger.info(f"SQLite snapshot added to archive ({size / (1024*1024):.2f} MB)")
+    return True
+
+def snapshot_postgres(zipf, member, url):
+    """Stream pg_dump output straight into the archive."""
+    cmd = ["pg_dump", "-F", "c", "-b", "-v"]
+    if url.host:
+        cmd += ["-h", url.host]
+    if url.port:
+        cmd += ["-p", str(url.port)]
+    if url.username:
+        cmd += ["-U", url.username]
+    cmd.append(url.database)
+
+    # Pass the password through the environment to keep it out of the command line
+    env = dict(os.environ)
+    if url.password:
+        env["PGPASSWORD"] = url.password
+
+    # pg_dump -v is chatty; collect stderr in a file so the pipe never fills up
+    with tempfile.TemporaryFile() as errors:
+        process = subprocess.Popen(cmd, env=env, stdout=subprocess.PIPE, stderr=errors)
+        written = 0
+        with zipf.open(member, 'w', force_zip64=True) as out:
+            for chunk in iter(lambda: process.stdout.read(STREAM_CHUNK), b''):
+                out.write(chunk)
+                written += len(chunk)
+        process.stdout.close()
+        if process.wait() != 0:
+            errors.seek(0)
+            logger.error(f"Database backup failed: {errors.read().decode('utf-8', 'replace')}")
+            return False
+
+    logger.info(f"Database dump added to archive ({written / (1024*1024):.2f} MB)")
+    return True
+
+def snapshot_database(zipf, backup_filename):
+    """Write a consistent copy of the site database into the open archive.
+
+    Returns the archive member holding it, or None on failure.
+    """
+    url = _database_url()
+    backend = url.get_backend_name()
+
+    if backend == "sqlite":
+        if not url.database or url.database == ":memory:":
+            logger.error("Cannot back up an in-memory SQLite database")
+            return None
+        member = f"{backup_filename}.sqlite3"
+        return member if snapshot_sqlite(zipf, member, url.database) else None
+
+    if backend == "postgresql":
+        member = f"{backup_filename}.dump"
+        return member if snapshot_postgres(zipf, member, url) else None
+
+    logger.error(f"Backing up {backend} databases is not supported")
+    return None
+
+def read_manifest(archive_path):
+    """The manifest stored in a backup archive, or None for archives made before manifests."""
+    try:
+        with zipfile.ZipFile(archive_path) as zipf:
+            with zipf.open(MANIFEST_NAME) as f:
+                return json.load(f)
+    except KeyError:
+        return None
+
+def latest_backup(backup_dir):
+    """Path of the newest complete backup archive in backup_dir, or None."""
+    if not os.path.isdir(backup_dir):
+        return None
+    archives = sorted(name for name in os.listdir(backup_dir) if ARCHIVE_PATTERN.match(name))
+    return os.path.join(backup_dir, archives[-1]) if archives else None
+
+def scan_music(music_dir):
+    """Every file to back up, as {relative path: os.stat_result}."""
+    files = {}
+    for root, dirs, names in os.walk(music_dir):
+        dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
+        for name in names:
+            path = os.path.join(root, name)
+            if name.endswith(('.tmp', '.part')):
+                continue
+            try:
+                files[os.path.relpath(path, app.root_path)] = os.stat(path)
+            except OSError as e:
+                logger.warning(f"Skipping unreadable file {path}: {str(e)}")
+    return files
+
+def _digest(path):
+    """SHA-256 of a file; content-addressed blobs are named by it already."""
+    stem, ext = os.path.splitext(os.path.basename(path))
+    if BLOB_NAME.match(stem) and ext != '.seek':
+        return stem
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def _compression(rel_path):
+    if rel_path.lower().endswith(STORED_EXTENSIONS):
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+def pack_music(zipf, archive_name, parent, workers):
+    """Add new music files to the open archive and return (manifest entries, report).
+
+    Files unchanged since the parent backup (same size and mtime) keep their
+    parent entry without being read. The rest are hashed on the worker pool;
+    content already present anywhere in the chain is referenced, not stored.
+    """
+    music_dir = os.path.join(app.root_path, app.config.get('MUSIC_FOLDER', 'static/music'))
+    previous = parent['files'] if parent else {}
+    stored_by_hash = {entry['sha256']: entry for entry in previous.values()}
+
+    entries = {}
+    report = {'stored': 0, 'bytes_written': 0, 'unchanged': 0, 'deduplicated': 0, 'bytes_skipped': 0}
+    changed = []
+    for rel_path, st in sorted(scan_music(music_dir).items()):
+        old = previous.get(rel_path)
+        if old and old['size'] == st.st_size and old['mtime_ns'] == st.st_mtime_ns:
+            entries[rel_path] = old
+            report['unchanged'] += 1
+            report['bytes_skipped'] += st.st_size
+        else:
+            changed.append((rel_path, st))
+
+    logger.info(f"{len(changed)} new or changed files, {report['unchanged']} unchanged")
+
+    # Hash on the pool; pool.map yields in order, so the archive is written
+    # while later files are still being hashed
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='backup-hash') as pool:
+        digests = pool.map(lambda item: _digest(os.path.join(app.root_path, item[0])), changed)
+        for (rel_path, st), digest in zip(changed, digests):
+            entry = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha256': digest}
+            known = stored_by_hash.get(digest)
+            if known:
+                entry['archive'], entry['member'] = known['archive'], known['member']
+                report['deduplicated'] += 1
+                report['bytes_skipped'] += st.st_size
+            else:
+                zipf.write(os.path.join(app.root_path, rel_path), rel_path, _compression(rel_path))
+                entry['archive'], entry['member'] = archive_name, rel_path
+                stored_by_hash[digest] = entry
+                report['stored'] += 1
+                report['bytes_written'] += st.st_size
+            entries[rel_path] = entry
+
+    return entries, report
+
+def create_backup(incremental=False, backup_dir="backups", workers=4):
+    """Create a backup of the site including database and song files.
+
+    With incremental=True only music not already in the newest backup's
+    chain is added. Returns the archive path, or False on failure.
+    """
     # Create a timestamp for the backup filename
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    backup_dir = "backups"
     backup_filename = f"country_music_backup_{timestamp}"
-    
+    started = time.monotonic()
+
     # Make sure the backup directory exists
     os.makedirs(backup_dir, exist_ok=True)
-    
+
     # Full paths
-    db_backup_path = os.path.join(backup_dir, f"{backup_filename}.dump")
     zip_backup_path = os.path.join(backup_dir, f"{backup_filename}.zip")
-    
-    try:
-        # Step 1: Backup the database
-        logger.info("Backing up database...")
-        
-        # Get database connection info from environment
-        db_url = os.environ.get("DATABASE_URL", "")
-        
-        if "postgresql" in db_url:
-            # Extract connection details (rough parsing, adjust as needed)
-            db_parts = db_url.replace("postgresql://", "").replace("postgres://", "").split("@")
-            if len(db_parts) == 2:
-                user_pass = db_parts[0].split(":")
-                host_db = db_parts[1].split("/")
-                
-                if len(user_pass) == 2 and len(host_db) >= 2:
-                    db_user = user_pass[0]
-                    # db_pass = user_pass[1]  # We don't need to use this directly
-                    db_host = host_db[0].split(":")[0]
-                    db_name = host_db[1].split("?")[0]
-                    
-                    # Create PostgreSQL dump
-                    # Note: We use environment variables for password to avoid it in the command
-                    cmd = ["pg_dump", "-h", db_host, "-U", db_user, "-F", "c", "-b", "-v", "-f", db_backup_path, db_name]
-                    result = subprocess.run(cmd, env=os.environ, capture_output=True, text=True)
-                    
-                    if result.returncode != 0:
-                        logger.error(f"Database backup failed: {result.stderr}")
-                        return False
-                    else:
-                        logger.info(f"Database backup created at {db_backup_path}")
-                else:
-                    logger.error("Could not parse DATABASE_URL properly")
-                    return False
-            else:
-                logger.error("Could not parse DATABASE_URL properly")
-                return False
+    partial_path = f"{zip_backup_path}.partial"
+
+    parent = None
+    if incremental:
+        parent_path = latest_backup(backup_dir)
+        parent = read_manifest(parent_path) if parent_path else None
+        if parent:
+            # Entries whose archive has gone missing are stored again
+            present = {name for name in os.listdir(backup_dir) if ARCHIVE_PATTERN.match(name)}
+            parent['files'] = {path: entry for path, entry in parent['files'].items()
+                               if entry['archive'] in present}
+            logger.info(f"Incremental backup on top of {os.path.basename(parent_path)}")
         else:
-            logger.error("Only PostgreSQL databases are supported for now")
-            return False
-        
-        # Step 2: Create a ZIP archive with everything
-        logger.info("Creating complete backup archive...")
-        
-        with zipfile.ZipFile(zip_backup_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            # Add the database dump
-            zipf.write(db_backup_path, os.path.basename(db_backup_path))
-            
-            # Add all the song files
-            music_dir = os.path.join("static", "music")
-            if os.path.exists(music_dir):
-                for root, _, files in os.walk(music_dir):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        # Store with the relative path structure
-                        zipf.write(file_path, file_path)
-                        logger.debug(f"Added {file_path} to backup")
-        
+            logger.info("No previous backup with a manifest found, creating a full backup")
+
+    try:
+        logger.info("Creating backup archive...")
+
+        with zipfile.ZipFile(partial_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+            # Step 1: Snapshot the database straight into the archive
+            logger.info("Backing up database...")
+            database_member = snapshot_database(zipf, backup_filename)
+            if not database_member:
+                raise RuntimeError("database snapshot failed")
+
+            # Step 2: Add new music and the manifest
+            entries, report = pack_music(zipf, os.path.basename(zip_backup_path), parent, workers)
+
+            manifest = {
+                'version': 1,
+                'created': timestamp,
+                'parent': parent and parent.get('archive'),
+                'archive': os.path.basename(zip_backup_path),
+                'database': database_member,
+                'files': entries,
+            }
+            zipf.writestr(MANIFEST_NAME, json.dumps(manifest, separators=(',', ':')))
+
+        # Only complete archives get the name incremental runs look for
+        os.replace(partial_path, zip_backup_path)
+
+        chain = sorted({entry['archive'] for entry in entries.values()} | {manifest['archive']})
         logger.info(f"Backup completed successfully: {zip_backup_path}")
-        logger.info(f"Total size: {os.path.getsize(zip_backup_path) / (1024*1024):.2f} MB")
-        
-        # Remove the temporary database dump
-        os.remove(db_backup_path)
-        
+        logger.info(
+            f"Stored {report['stored']} files ({report['bytes_written'] / (1024*1024):.2f} MB written), "
+            f"skipped {report['unchanged']} unchanged and {report['deduplicated']} duplicate files "
+            f"({report['bytes_skipped'] / (1024*1024):.2f} MB skipped) in {time.monotonic() - started:.1f}s"
+        )
+        logger.info(f"Archive size: {os.path.getsize(zip_backup_path) / (1024*1024):.2f} MB; "
+                    f"restoring needs {len(chain)} archive(s): {', '.join(chain)}")
+
         return zip_backup_path
-        
+
     except Exception as e:
         logger.error(f"Backup failed: {str(e)}")
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
         return False
 
+def _extract_one(archive_path, member, target, handles):
+    """Copy one archive member to target, reusing this thread's open archive."""
+    zipf = handles.get(archive_path)
+    if zipf is None:
+        zipf = handles[archive_path] = zipfile.ZipFile(archive_path)
+    os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+    tmp = f"{target}.restoring"
+    with zipf.open(member) as src, open(tmp, 'wb') as dst:
+        shutil.copyfileobj(src, dst, STREAM_CHUNK)
+    os.replace(tmp, target)
+    return zipf.getinfo(member).file_size
+
+def restore_backup(archive_path, target_dir=".", workers=4, place=None):
+    """Extract the music files of a backup chain into target_dir.
+
+    Files are extracted by `workers` threads, each with its own handle on
+    every archive. `place(relative_path)` may choose where each file goes
+    (default: the same relative path under target_dir).
+    Returns (manifest, files restored, bytes restored); the manifest is None
+    for archives from before manifests, which are extracted whole.
+    """
+    manifest = read_manifest(archive_path)
+    backup_dir = os.path.dirname(os.path.abspath(archive_path))
+
+    if manifest is None:
+        # Archives from before manifests are complete on their own
+        with zipfile.ZipFile(archive_path) as zipf:
+            zipf.extractall(target_dir)
+            return None, len(zipf.namelist()), sum(info.file_size for info in zipf.infolist())
+
+    place = place or (lambda rel_path: os.path.join(target_dir, rel_path))
+    # Keyed by destination: two entries placed on the same file are extracted once
+    tasks = list({
+        target: (os.path.join(backup_dir, entry['archive']), entry['member'], target)
+        for target, entry in ((place(rel_path), entry) for rel_path, entry in manifest['files'].items())
+    }.values())
+
+    missing = sorted({os.path.basename(path) for path, _, _ in tasks if not os.path.exists(path)})
+    if missing:
+        raise FileNotFoundError(f"Backup chain incomplete, missing: {', '.join(missing)}")
+
+    local = threading.local()
+    opened = []
+    lock = threading.Lock()
+
+    def extract(task):
+        handles = getattr(local, 'handles', None)
+        if handles is None:
+            handles = local.handles = {}
+            with lock:
+                opened.append(handles)
+        return _extract_one(*task, handles)
+
+    archives = len({path for path, _, _ in tasks})
+    logger.info(f"Extracting {len(tasks)} files from {archives} archive(s) with {workers} workers")
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='restore') as pool:
+            restored_bytes = sum(pool.map(extract, tasks))
+    finally:
+        for handles in opened:
+            for zipf in handles.values():
+                zipf.close()
+
+    logger.info(f"Restored {len(tasks)} music files ({restored_bytes / (1024*1024):.2f} MB)")
+    return manifest, len(tasks), restored_bytes
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Back up or restore the database and song files")
+    parser.add_argument("--incremental", action="store_true", help="only add files not in the previous backup")
+    parser.add_argument("--workers", type=int, default=4, help="files hashed or extracted at once (default 4)")
+    parser.add_argument("--backup-dir", default="backups", help="where archives are kept (default backups)")
+    parser.add_argument("--restore", metavar="ARCHIVE", help="restore from this archive and the ones it builds on")
+    parser.add_argument("--target", default=".", help="directory to restore into (default: current directory)")
+    args = parser.parse_args()
+
+    if args.restore:
+        print(f"Extracting {args.restore}...")
+        manifest, _, _ = restore_backup(args.restore, args.target, workers=args.workers)
+        if manifest:
+            with zipfile.ZipFile(args.restore) as zipf:
+                print(f"Database copy: {zipf.extract(manifest['database'], args.target)}")
+        print("\nTo restore the database and fix song paths in one step, use restore_site.py instead.")
+        sys.exit(0)
+
     print("Starting Country Music Paradise backup...")
-    result = create_backup()
-    
+    result = create_backup(incremental=args.incremental, backup_dir=args.backup_dir, workers=args.workers)
+
     if result:
         print(f"Backup completed successfully: {result}")
         print("\nTo restore this backup on a new server:")
         print("1. Install Country Music Paradise following the README instructions")
-        print("2. Extract the ZIP backup file")
-        print("3. Restore the database using: pg_restore -U username -d database_name backup_file.dump")
-        print("4. Copy the song files to the static/music directory")
-        print("5. Run fix_paths.py to ensure all file paths are correct")
+        print("2. Copy the backup directory (the archive and the earlier ones it builds on)")
+        print(f"3. Run: python restore_site.py {result}")
         sys.exit(0)
     else:
         print("Backup failed. Check the log for details.")
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
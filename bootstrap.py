@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+"""
+Bootstrap the Database
+
+Creates missing tables, adds columns introduced by newer versions
+(models.upgrade_schema), installs the full-text search index and creates
+the default admin, artists and playlist if they do not exist yet.
+
+The web app no longer does any of this when it starts, so run this once
+per deploy, before starting gunicorn. It is safe to run repeatedly.
+
+Usage:
+  python bootstrap.py
+"""
+
+import logging
+from app import app, db
+import models
+import search_index
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def bootstrap():
+    """Create or upgrade the schema and seed the default data."""
+    with app.app_context():
+        logger.info("Creating tables and upgrading the schema...")
+        db.create_all()
+        models.upgrade_schema()
+
+        # Full-text index over the local catalog (FTS5 / tsvector)
+        search_index.install()
+
+        logger.info("Creating default data (admin, artists and playlist)...")
+        models.init_db()
+
+if __name__ == "__main__":
+    bootstrap()
+    print("Bootstrap complete.")
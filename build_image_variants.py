@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+"""
+Build Responsive Artist Image Variants
+
+Creates resized WebP and JPEG copies of the artist pictures in
+static/img/artists for the home page srcset (see image_variants.py). Only
+pictures added or changed since the last run are processed. Requires
+Pillow (pip install pillow).
+
+Usage:
+  python build_image_variants.py [--force]
+
+--force rebuilds every variant, e.g. after changing the widths or quality.
+"""
+
+import argparse
+from app import app, db
+from models import bump_catalog_version
+import image_variants
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create resized artist images for the home page")
+    parser.add_argument("--force", action="store_true", help="rebuild variants of unchanged images too")
+    args = parser.parse_args()
+
+    if not image_variants.available():
+        print("Pillow is not installed. Install it with: pip install pillow")
+        raise SystemExit(1)
+
+    with app.app_context():
+        processed = image_variants.generate(force=args.force)
+        if processed:
+            # The home page markup points at the new variant files
+            bump_catalog_version()
+            db.session.commit()
+
+    print(f"Image variants complete. Processed {processed} images.")
@@ -6,7 +6,9 @@ This script allows for offline bulk upload of music files to the database.
 It walks through a directory structure and adds songs to matching artists.
 
 Usage:
-  python bulk_upload.py /path/to/music_directory
+  python bulk_upload.py /path/to/music_directory [--workers 4] [--link]
+                        [--batch-size 200] [--manifest FILE] [--full]
+                        [--watch] [--interval 30]
 
 Directory structure should be:
   /music_directory
@@ -15,19 +17,42 @@ Directory structure should be:
       - Song Name 2.mp3
     /Artist Name 2
       - Song Name 3.mp3
+
+Re-running is cheap: a manifest (by default .bulk_upload_manifest.json in
+the music directory) records the size, modification time and SHA-256 of
+every file already handled, and files whose size and mtime are unchanged
+are skipped without being read. --full ignores the manifest for one run.
+
+Files are copied (or with --link hard-linked, when the directory is on the
+same filesystem as the site) and hashed by --workers threads; songs are
+inserted --batch-size at a time and progress is logged in files/s and MB/s.
+--watch keeps running and picks up new files every --interval seconds.
 """
 
 import os
 import sys
+import json
+import time
 import logging
-import shutil
+import argparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from app import app, db
-from models import Artist, Song
+from models import Artist, existing_songs, bump_catalog_version
+from storage import AUDIO_EXTENSIONS, prepare_file, store_prepared, song_row, insert_songs, remove_file
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+MANIFEST_NAME = '.bulk_upload_manifest.json'
+
+# Seconds between progress lines
+PROGRESS_INTERVAL = 5
+
+# In --watch mode, files modified more recently than this are probably still
+# being copied in and are left for the next pass
+SETTLE_SECONDS = 10
+
 def clean_filename(filename):
     """Extract song name from filename by removing extension and cleaning it up."""
     # Remove extension
@@ -37,90 +62,231 @@ def clean_filename(filename):
         song_name = song_name[4:].strip() if song_name[2:4] == " -" else song_name[3:].strip()
     return song_name
 
-def process_directory(music_dir):
-    """Process the music directory and add songs to the database."""
-    if not os.path.isdir(music_dir):
-        logger.error(f"Directory not found: {music_dir}")
-        return False
-    
-    # Get all artists from the database
-    artists = {artist.name.lower(): artist for artist in Artist.query.all()}
-    
-    # Ensure music folder exists
-    music_folder = app.config.get('MUSIC_FOLDER', 'static/music')
-    os.makedirs(music_folder, exist_ok=True)
-    
-    success_count = 0
-    error_count = 0
-    
-    # Walk through the directory
+def load_manifest(path):
+    """Files handled by earlier runs, keyed by path relative to the music directory."""
+    try:
+        with open(path) as f:
+            return json.load(f).get('files', {})
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable manifest {path}: {str(e)}")
+        return {}
+
+def save_manifest(path, files):
+    """Write the manifest atomically so an interrupted run never leaves it half-written."""
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump({'version': 1, 'files': files}, f, separators=(',', ':'))
+    os.replace(tmp, path)
+
+class Progress:
+    """Counts files and bytes and logs the rate every PROGRESS_INTERVAL seconds."""
+
+    def __init__(self, total_files, total_bytes):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.files = 0
+        self.bytes = 0
+        self.started = time.monotonic()
+        self.last_report = self.started
+
+    def add(self, size):
+        self.files += 1
+        self.bytes += size
+
+    def report(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_report < PROGRESS_INTERVAL:
+            return
+        self.last_report = now
+        elapsed = max(now - self.started, 1e-6)
+        logger.info(
+            f"Progress: {self.files}/{self.total_files} files, "
+            f"{self.bytes / 1e6:.1f}/{self.total_bytes / 1e6:.1f} MB, "
+            f"{self.files / elapsed:.1f} files/s, {self.bytes / 1e6 / elapsed:.1f} MB/s"
+        )
+
+def scan(music_dir, artists, manifest, settle=0):
+    """Find music files that are new or changed since the manifest was written.
+
+    Returns (candidates, unchanged) where candidates are
+    (relative_path, artist, song_name, size, mtime_ns) tuples.
+    """
+    candidates = []
+    unchanged = 0
+    newest = time.time() - settle
     for root, dirs, files in os.walk(music_dir):
         # Get the artist name from the directory name
         artist_name = os.path.basename(root)
-        
+
         # Skip the root directory itself
         if artist_name == os.path.basename(music_dir):
             continue
-        
+
         # Check if the artist exists
         artist = artists.get(artist_name.lower())
         if not artist:
             logger.warning(f"Artist not found: {artist_name}. Skipping songs.")
             continue
-        
-        logger.info(f"Processing songs for artist: {artist_name}")
-        
-        # Process each music file
+
         for filename in files:
-            if not filename.lower().endswith(('.mp3', '.wav', '.m4a', '.ogg')):
+            if not filename.lower().endswith(AUDIO_EXTENSIONS):
                 continue  # Skip non-music files
-            
-            song_name = clean_filename(filename)
-            file_path = os.path.join(root, filename)
-            
-            # Check if song already exists
-            existing_song = Song.query.filter_by(name=song_name, artist_id=artist.id).first()
-            if existing_song:
-                logger.warning(f"Song already exists: {song_name} for {artist_name}. Skipping.")
+            path = os.path.join(root, filename)
+            rel_path = os.path.relpath(path, music_dir)
+            try:
+                st = os.stat(path)
+            except OSError as e:
+                logger.error(f"Cannot read {path}: {str(e)}")
                 continue
-            
+            if st.st_mtime > newest:
+                continue  # Still being written
+            known = manifest.get(rel_path)
+            if known and known['size'] == st.st_size and known['mtime_ns'] == st.st_mtime_ns:
+                unchanged += 1
+                continue
+            candidates.append((rel_path, artist, clean_filename(filename), st.st_size, st.st_mtime_ns))
+    return candidates, unchanged
+
+def _flush(batch, artist_names, manifest):
+    """Register a batch of prepared files and insert their songs in one statement."""
+    rows = []
+    for (rel_path, artist, song_name, size, mtime_ns), prepared in batch:
+        blob = store_prepared(prepared)
+        rows.append(song_row(blob, info=prepared.info, name=song_name, artist_id=artist.id, source='bulk_upload'))
+        manifest[rel_path] = {'size': size, 'mtime_ns': mtime_ns, 'sha256': prepared.digest}
+
+    # Any song added meanwhile through the site is skipped by the database
+    inserted, unused = insert_songs(rows)
+    if inserted:
+        bump_catalog_version()
+    db.session.commit()
+    for path in unused:
+        remove_file(path)
+    for row in inserted:
+        logger.info(f"Added song: {row.name} for {artist_names[row.artist_id]}")
+    return len(inserted)
+
+def process_directory(music_dir, workers=4, link=False, batch_size=200, manifest_path=None,
+                      full=False, settle=0, quiet=False):
+    """Process the music directory and add songs to the database.
+
+    With quiet=True nothing is logged for a pass that found no new files.
+    Returns a dict of counts, or None if the directory does not exist.
+    """
+    if not os.path.isdir(music_dir):
+        logger.error(f"Directory not found: {music_dir}")
+        return None
+
+    manifest_path = manifest_path or os.path.join(music_dir, MANIFEST_NAME)
+    manifest = {} if full else load_manifest(manifest_path)
+
+    # Get all artists from the database
+    artists = {artist.name.lower(): artist for artist in Artist.query.all()}
+    artist_names = {artist.id: artist.name for artist in artists.values()}
+
+    candidates, unchanged = scan(music_dir, artists, manifest, settle)
+    counts = {'added': 0, 'existing': 0, 'unchanged': unchanged, 'errors': 0}
+
+    # One query finds which of the candidate songs the site already has
+    existing = existing_songs((artist.id, song_name) for _, artist, song_name, _, _ in candidates)
+    todo = []
+    seen = set()
+    for candidate in candidates:
+        rel_path, artist, song_name, size, mtime_ns = candidate
+        key = (artist.id, song_name)
+        if key in existing or key in seen:
+            logger.warning(f"Song already exists: {song_name} for {artist.name}. Skipping.")
+            manifest[rel_path] = {'size': size, 'mtime_ns': mtime_ns, 'sha256': None}
+            counts['existing'] += 1
+            continue
+        seen.add(key)
+        todo.append(candidate)
+
+    if todo:
+        logger.info(f"Importing {len(todo)} files with {workers} workers "
+                    f"({unchanged} unchanged, {counts['existing']} already in the catalog)")
+    progress = Progress(len(todo), sum(candidate[3] for candidate in todo))
+    batch = []
+    future_items = {}
+
+    def collect(futures):
+        for future in futures:
+            candidate = future_items.pop(future)
             try:
-                # Copy file to music folder
-                destination = os.path.join(music_folder, f"{artist_name}_{filename}")
-                shutil.copy2(file_path, destination)
-                
-                # Create song record
-                new_song = Song(
-                    name=song_name,
-                    artist_id=artist.id,
-                    file_path=destination,
-                    source='bulk_upload'
-                )
-                
-                db.session.add(new_song)
-                success_count += 1
-                logger.info(f"Added song: {song_name} for {artist_name}")
+                batch.append((candidate, future.result()))
             except Exception as e:
-                logger.error(f"Error processing {file_path}: {str(e)}")
-                error_count += 1
-    
-    # Commit all changes
-    if success_count > 0:
-        db.session.commit()
-    
-    logger.info(f"Bulk upload complete. Added {success_count} songs. Errors: {error_count}")
+                logger.error(f"Error processing {os.path.join(music_dir, candidate[0])}: {str(e)}")
+                counts['errors'] += 1
+            progress.add(candidate[3])
+        if len(batch) >= batch_size:
+            counts['added'] += _flush(batch, artist_names, manifest)
+            save_manifest(manifest_path, manifest)
+            batch.clear()
+        progress.report()
+
+    # Copy and hash on the pool, keeping only a few files in flight per worker
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bulk-upload') as pool:
+        for candidate in todo:
+            if len(future_items) >= workers * 4:
+                done, _ = wait(future_items, return_when=FIRST_COMPLETED)
+                collect(done)
+            path = os.path.join(music_dir, candidate[0])
+            future_items[pool.submit(prepare_file, path, link)] = candidate
+        while future_items:
+            done, _ = wait(future_items, return_when=FIRST_COMPLETED)
+            collect(done)
+
+    if batch:
+        counts['added'] += _flush(batch, artist_names, manifest)
+    if todo or counts['existing'] or full:
+        save_manifest(manifest_path, manifest)
+    if todo:
+        progress.report(force=True)
+
+    if quiet and not candidates:
+        return counts
+    logger.info(f"Bulk upload complete. Added {counts['added']} songs. "
+                f"Unchanged: {counts['unchanged']}. Already present: {counts['existing']}. "
+                f"Errors: {counts['errors']}")
+    return counts
+
+def watch(music_dir, interval, **options):
+    """Run process_directory every `interval` seconds until interrupted."""
+    logger.info(f"Watching {music_dir} for new files every {interval} seconds (Ctrl+C to stop)")
+    try:
+        while True:
+            if process_directory(music_dir, settle=SETTLE_SECONDS, quiet=True, **options) is None:
+                return False
+            db.session.remove()
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        logger.info("Stopped watching")
     return True
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print(f"Usage: {sys.argv[0]} /path/to/music_directory")
-        sys.exit(1)
-    
-    music_dir = sys.argv[1]
-    
+    parser = argparse.ArgumentParser(description="Add a directory of music files (one folder per artist) to the site")
+    parser.add_argument("music_dir", help="directory containing one folder per artist")
+    parser.add_argument("--workers", type=int, default=4, help="files copied and hashed at once (default 4)")
+    parser.add_argument("--link", action="store_true", help="hard-link files into storage instead of copying when possible")
+    parser.add_argument("--batch-size", type=int, default=200, help="songs inserted per transaction (default 200)")
+    parser.add_argument("--manifest", help=f"manifest file (default MUSIC_DIR/{MANIFEST_NAME})")
+    parser.add_argument("--full", action="store_true", help="re-check every file, ignoring the manifest")
+    parser.add_argument("--watch", action="store_true", help="keep running and import new files as they appear")
+    parser.add_argument("--interval", type=float, default=30, help="seconds between scans with --watch (default 30)")
+    args = parser.parse_args()
+
+    options = dict(workers=args.workers, link=args.link, batch_size=args.batch_size,
+                   manifest_path=args.manifest)
+
     with app.app_context():
-        if process_directory(music_dir):
-            print(f"Successfully processed directory: {music_dir}")
+        if args.watch:
+            ok = watch(args.music_dir, args.interval, **options)
+        else:
+            ok = process_directory(args.music_dir, full=args.full, **options) is not None
+        if ok:
+            print(f"Successfully processed directory: {args.music_dir}")
         else:
-            print(f"Failed to process directory: {music_dir}")
-            sys.exit(1)
\ No newline at end of file
+            print(f"Failed to process directory: {args.music_dir}")
+            sys.exit(1)
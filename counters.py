@@ -0,0 +1,118 @@
+"""
+Write-behind play and download counters for Country Music Paradise
+
+/play and /download no longer update the Song row themselves. Each hit adds
+to an in-memory buffer and a background thread writes the aggregated deltas
+with one batched UPDATE ... SET count = count + delta statement, either every
+COUNTER_FLUSH_INTERVAL seconds or as soon as COUNTER_FLUSH_THRESHOLD hits are
+pending, whichever comes first.
+
+Every gunicorn worker keeps its own buffer. Because the UPDATE adds a delta
+instead of writing back a value read earlier, flushes from different workers
+never overwrite each other. The buffer is flushed once more when the process
+exits normally, so a graceful restart does not lose counts.
+"""
+
+import os
+import atexit
+import logging
+import threading
+from collections import defaultdict
+from sqlalchemy import bindparam, func
+from app import app, db
+from models import Song
+
+logger = logging.getLogger(__name__)
+
+
+class CounterBuffer:
+    """Aggregates per-song counter increments and flushes them in batches"""
+
+    FIELDS = ('download_count', 'play_count')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = defaultdict(lambda: dict.fromkeys(self.FIELDS, 0))
+        self._hits = 0
+        self._wakeup = threading.Event()
+        self._pid = None
+
+    def _ensure_started(self):
+        """Start the flush thread in this process (again after a fork)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            thread = threading.Thread(target=self._run, name='counter-flush', daemon=True)
+            thread.start()
+
+    def incr(self, song_id, field, amount=1):
+        """Count `amount` hits on a song; never touches the database"""
+        self._ensure_started()
+        with self._lock:
+            self._pending[song_id][field] += amount
+            self._hits += amount
+            full = self._hits >= app.config.get('COUNTER_FLUSH_THRESHOLD', 500)
+        if full:
+            self._wakeup.set()
+
+    def _take(self):
+        """Swap out the pending deltas so new hits go to a fresh buffer"""
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(lambda: dict.fromkeys(self.FIELDS, 0))
+            self._hits = 0
+        return pending
+
+    def _restore(self, pending):
+        """Put deltas back after a failed flush so they are retried"""
+        with self._lock:
+            for song_id, deltas in pending.items():
+                for field, amount in deltas.items():
+                    self._pending[song_id][field] += amount
+                    self._hits += amount
+
+    def flush(self):
+        """Write all pending deltas with one executemany UPDATE"""
+        pending = self._take()
+        if not pending:
+            return 0
+
+        rows = [
+            {'song_id': song_id, **{f'{field}_delta': amount for field, amount in deltas.items()}}
+            for song_id, deltas in pending.items()
+        ]
+        table = Song.__table__
+        stmt = (
+            table.update()
+            .where(table.c.id == bindparam('song_id'))
+            .values({field: func.coalesce(table.c[field], 0) + bindparam(f'{field}_delta') for field in self.FIELDS})
+        )
+        try:
+            with app.app_context():
+                with db.engine.begin() as conn:
+                    conn.execute(stmt, rows)
+        except Exception as e:
+            logger.error(f"Error flushing song counters: {str(e)}")
+            self._restore(pending)
+            return 0
+        return len(rows)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(app.config.get('COUNTER_FLUSH_INTERVAL', 5.0))
+            self._wakeup.clear()
+            self.flush()
+
+
+counter_buffer = CounterBuffer()
+atexit.register(counter_buffer.flush)
+
+
+def record_play(song_id):
+    counter_buffer.incr(song_id, 'play_count')
+
+
+def record_download(song_id):
+    counter_buffer.incr(song_id, 'download_count')
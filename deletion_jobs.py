@@ -0,0 +1,287 @@
+"""
+Background artist deletion for Country Music Paradise
+
+Deleting an artist from the admin dashboard no longer happens inside the
+request. It records an ArtistDeletion row and hands it to a single worker
+thread; the admin is sent to a progress page that polls
+/admin/deletions/<id>/status.
+
+- Songs are deleted ARTIST_DELETE_BATCH at a time with set-based statements
+  (storage.delete_songs), one short transaction per batch, so the site
+  keeps writing while a large artist goes away
+- The files no row uses any more are queued as FileDeletion rows in the
+  same transaction and removed from disk after the artist row is gone. A
+  failed removal is retried with exponential backoff (FILE_DELETE_BACKOFF
+  seconds, doubling) up to FILE_DELETE_RETRIES times
+- A file that is in use again when its turn comes (the same audio was
+  uploaded meanwhile) is kept
+- Every batch and every pass over the files refreshes updated_at. After
+  startup recover() picks up jobs whose heartbeat is older than
+  ARTIST_DELETE_STALE seconds (their worker died): the row step is run
+  again if the artist row is still there, otherwise only the files are
+"""
+
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import inspect, select, update, delete, insert, func, or_
+from app import app, db
+from models import (Artist, Song, AudioBlob, ArtistDeletion, FileDeletion, DownloadJob,
+                    UploadSession, bump_catalog_version)
+from storage import delete_songs, resolve, upload_path
+import seek_index
+
+logger = logging.getLogger(__name__)
+
+# Longest wait between two passes over the files, so the heartbeat stays fresh
+MAX_BACKOFF = 60
+
+_lock = threading.Lock()
+_pool = None
+_pool_pid = None
+
+
+def _executor():
+    """The deletion thread of this process (recreated after a fork)"""
+    global _pool, _pool_pid
+    with _lock:
+        if _pool_pid != os.getpid():
+            # One worker: deletions are write-heavy and should not compete with each other
+            _pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='artist-deletion')
+            _pool_pid = os.getpid()
+    return _pool
+
+
+def submit(artist):
+    """Queue the deletion of an artist, or return the active job for it.
+
+    Returns (job, created).
+    """
+    job = ArtistDeletion.query.filter(
+        ArtistDeletion.artist_id == artist.id,
+        ArtistDeletion.status.in_(ArtistDeletion.ACTIVE),
+    ).order_by(ArtistDeletion.id).first()
+    if job:
+        return job, False
+
+    songs_total = db.session.query(func.count(Song.id)).filter(Song.artist_id == artist.id).scalar()
+    job = ArtistDeletion(artist_id=artist.id, artist_name=artist.name, songs_total=songs_total)
+    db.session.add(job)
+    db.session.commit()
+    schedule(job.id)
+    return job, True
+
+
+def schedule(job_id):
+    _executor().submit(_run, job_id)
+
+
+def _claim(job_id):
+    """Move a job from queued to running; False if someone else has it"""
+    result = db.session.execute(
+        update(ArtistDeletion)
+        .where(ArtistDeletion.id == job_id, ArtistDeletion.status == ArtistDeletion.QUEUED)
+        .values(status=ArtistDeletion.RUNNING, updated_at=datetime.utcnow())
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def _set(job_id, **values):
+    """Update a job's counters or status, refreshing its heartbeat; the caller commits"""
+    db.session.execute(
+        update(ArtistDeletion).where(ArtistDeletion.id == job_id)
+        .values(updated_at=datetime.utcnow(), **values)
+    )
+
+
+def _queue_files(job_id, paths):
+    """Record files to remove once the current transaction commits"""
+    if not paths:
+        return
+    now = datetime.utcnow()
+    db.session.execute(insert(FileDeletion.__table__), [
+        {'file_path': path, 'deletion_id': job_id, 'attempts': 0, 'next_attempt_at': now, 'created_at': now}
+        for path in paths
+    ])
+    _set(job_id, files_total=ArtistDeletion.files_total + len(paths))
+
+
+def _delete_rows(job_id, artist_id):
+    """Delete the artist's songs batch by batch, then the artist itself"""
+    batch_size = app.config.get('ARTIST_DELETE_BATCH', 500)
+    while True:
+        # Songs added while the job runs are picked up by a later batch
+        song_ids = list(db.session.execute(
+            select(Song.id).where(Song.artist_id == artist_id).order_by(Song.id).limit(batch_size)
+        ).scalars())
+        if not song_ids:
+            break
+        _queue_files(job_id, delete_songs(song_ids))
+        _set(job_id, songs_deleted=ArtistDeletion.songs_deleted + len(song_ids))
+        bump_catalog_version()
+        db.session.commit()
+
+    # Rows that refer to the artist, and the partial files of its uploads
+    upload_ids = list(db.session.execute(
+        select(UploadSession.id).where(UploadSession.artist_id == artist_id)
+    ).scalars())
+    _queue_files(job_id, [upload_path(upload_id) for upload_id in upload_ids])
+    db.session.execute(delete(UploadSession).where(UploadSession.artist_id == artist_id))
+    db.session.execute(delete(DownloadJob).where(DownloadJob.artist_id == artist_id))
+    db.session.execute(delete(Artist).where(Artist.id == artist_id))
+    _set(job_id, status=ArtistDeletion.REMOVING_FILES)
+    bump_catalog_version()
+    db.session.commit()
+
+
+def _in_use(path):
+    return (db.session.query(Song.id).filter(Song.file_path == path).first() is not None
+            or db.session.query(AudioBlob.id).filter(AudioBlob.file_path == path).first() is not None)
+
+
+def _remove(path):
+    for stale in (resolve(path), seek_index.table_path(resolve(path))):
+        try:
+            os.remove(stale)
+        except FileNotFoundError:
+            pass
+
+
+def remove_files(job_id):
+    """Remove the job's queued files whose turn has come, a batch per transaction.
+
+    Returns when every file is removed, given up on, or waiting for a retry;
+    the result is the earliest retry time, or None if nothing is waiting.
+    """
+    retries = app.config.get('FILE_DELETE_RETRIES', 5)
+    backoff = app.config.get('FILE_DELETE_BACKOFF', 2.0)
+    batch_size = app.config.get('ARTIST_DELETE_BATCH', 500)
+
+    while True:
+        # Items leave the result by being deleted or moved to a later attempt
+        items = (FileDeletion.query
+                 .filter(FileDeletion.deletion_id == job_id, FileDeletion.next_attempt_at <= datetime.utcnow())
+                 .order_by(FileDeletion.id).limit(batch_size).all())
+        if not items:
+            break
+        removed = failed = 0
+        for item in items:
+            try:
+                if not _in_use(item.file_path):
+                    _remove(item.file_path)
+                db.session.delete(item)
+                removed += 1
+            except OSError as e:
+                item.attempts += 1
+                item.last_error = str(e)
+                if item.attempts >= retries:
+                    # Left for reconcile_storage.py to report
+                    item.next_attempt_at = None
+                    failed += 1
+                    logger.error(f"Giving up on removing {item.file_path}: {str(e)}")
+                else:
+                    delay = min(backoff * 2 ** (item.attempts - 1), MAX_BACKOFF)
+                    item.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+                    logger.warning(f"Could not remove {item.file_path} (attempt {item.attempts}), "
+                                   f"retrying in {delay:.1f}s: {str(e)}")
+        _set(job_id, files_removed=ArtistDeletion.files_removed + removed,
+             files_failed=ArtistDeletion.files_failed + failed)
+        db.session.commit()
+
+    return db.session.query(func.min(FileDeletion.next_attempt_at)).filter(
+        FileDeletion.deletion_id == job_id).scalar()
+
+
+def _finish(job_id):
+    """Remove the job's files, retrying until each is gone or out of retries, then mark it done"""
+    while True:
+        next_attempt = remove_files(job_id)
+        if next_attempt is None:
+            break
+        _set(job_id)
+        db.session.commit()
+        wait = (next_attempt - datetime.utcnow()).total_seconds()
+        time.sleep(min(max(wait, 0), MAX_BACKOFF))
+
+    _set(job_id, status=ArtistDeletion.DONE)
+    db.session.commit()
+    job = db.session.get(ArtistDeletion, job_id)
+    logger.info(f"Deleted artist {job.artist_name}: {job.songs_deleted} songs, "
+                f"{job.files_removed} files removed, {job.files_failed} could not be removed")
+
+
+def _run(job_id, rows=True):
+    """Run a job: its database rows (skipped with rows=False), then its files"""
+    with app.app_context():
+        try:
+            if rows:
+                if not _claim(job_id):
+                    return
+                job = db.session.get(ArtistDeletion, job_id)
+                _delete_rows(job_id, job.artist_id)
+            _finish(job_id)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Artist deletion {job_id} failed: {str(e)}")
+            _set(job_id, status=ArtistDeletion.FAILED, error=str(e))
+            db.session.commit()
+        finally:
+            db.session.remove()
+
+
+def _recover_in_background():
+    with app.app_context():
+        try:
+            if not inspect(db.engine).has_table(ArtistDeletion.__tablename__):
+                logger.warning("No artist deletions to recover: run `python bootstrap.py` first")
+                return
+            recover()
+        except Exception as e:
+            logger.error(f"Could not recover artist deletions: {str(e)}")
+        finally:
+            db.session.remove()
+
+
+def start_recovery():
+    """Run recover() on the deletion thread so it does not delay startup"""
+    _executor().submit(_recover_in_background)
+
+
+def recover():
+    """Re-queue jobs left behind by a dead worker and schedule all queued jobs"""
+    stale = datetime.utcnow() - timedelta(seconds=app.config.get('ARTIST_DELETE_STALE', 120))
+    is_stale = or_(ArtistDeletion.updated_at < stale, ArtistDeletion.updated_at.is_(None))
+    requeued = db.session.execute(
+        update(ArtistDeletion)
+        .where(ArtistDeletion.status == ArtistDeletion.RUNNING, is_stale)
+        .values(status=ArtistDeletion.QUEUED)
+    ).rowcount
+    db.session.commit()
+
+    job_ids = [job_id for (job_id,) in db.session.query(ArtistDeletion.id)
+               .filter(ArtistDeletion.status == ArtistDeletion.QUEUED).order_by(ArtistDeletion.id)]
+    for job_id in job_ids:
+        schedule(job_id)
+
+    # Jobs whose rows are gone only have files left; the artist id may
+    # belong to a new artist by now, so their row step must not run again
+    removing = [job_id for (job_id,) in db.session.query(ArtistDeletion.id)
+                .filter(ArtistDeletion.status == ArtistDeletion.REMOVING_FILES, is_stale)]
+    for job_id in removing:
+        claimed = db.session.execute(
+            update(ArtistDeletion)
+            .where(ArtistDeletion.id == job_id, ArtistDeletion.status == ArtistDeletion.REMOVING_FILES, is_stale)
+            .values(updated_at=datetime.utcnow())
+        ).rowcount
+        db.session.commit()
+        if claimed:
+            _executor().submit(_run, job_id, False)
+
+    if job_ids or removing:
+        logger.info(f"Resuming {len(job_ids) + len(removing)} artist deletions "
+                    f"({requeued + len(removing)} interrupted)")
+    return len(job_ids) + len(removing)
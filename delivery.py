@@ -0,0 +1,126 @@
+"""
+Audio delivery for Country Music Paradise
+
+Songs can be handed to the browser in one of three ways, selected with the
+AUDIO_DELIVERY setting:
+- "stream":     stream the file from Python with a bounded read buffer
+                (supports Range requests, works without a front proxy)
+- "x-accel":    return an X-Accel-Redirect header so nginx serves the file
+- "x-sendfile": return an X-Sendfile header for lighttpd/Apache mod_xsendfile
+
+In the proxy modes the worker never opens the audio file; the front proxy
+does the transfer with sendfile and the worker is free for the next request.
+"""
+
+import os
+import logging
+import mimetypes
+from urllib.parse import quote
+from flask import Response, request, current_app, abort
+from storage import resolve
+
+logger = logging.getLogger(__name__)
+
+DELIVERY_MODES = ('stream', 'x-accel', 'x-sendfile')
+
+
+def _content_disposition(response, download_name):
+    """Set an attachment header that survives non-ASCII song names"""
+    try:
+        download_name.encode('ascii')
+        response.headers.set('Content-Disposition', 'attachment', filename=download_name)
+    except UnicodeEncodeError:
+        simple = download_name.encode('ascii', 'ignore').decode('ascii') or 'song'
+        response.headers.set(
+            'Content-Disposition', 'attachment',
+            filename=simple, **{'filename*': f"UTF-8''{quote(download_name)}"}
+        )
+
+
+def accel_redirect_uri(file_path):
+    """Map a song path inside MUSIC_FOLDER to the internal nginx location"""
+    music_folder = current_app.config['MUSIC_FOLDER']
+    relative = os.path.relpath(file_path, music_folder).replace(os.sep, '/')
+    if relative.startswith('../'):
+        raise ValueError(f"{file_path} is outside the music folder")
+    prefix = current_app.config.get('AUDIO_ACCEL_PREFIX', '/protected/music').rstrip('/')
+    return f"{prefix}/{quote(relative)}"
+
+
+def _iter_file(path, start, length, buffer_size):
+    """Yield `length` bytes of `path` from `start`, one buffer at a time"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(buffer_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def stream_file(path, mimetype, start_offset=0):
+    """Stream a file with a bounded buffer, honouring Range requests.
+
+    With start_offset the response is the tail of the file from that byte,
+    and Range requests are interpreted relative to the tail.
+    """
+    buffer_size = current_app.config.get('AUDIO_STREAM_BUFFER', 64 * 1024)
+    total = max(os.path.getsize(path) - start_offset, 0)
+
+    start, stop = 0, total
+    status = 200
+    if request.range is not None:
+        byte_range = request.range.range_for_length(total)
+        if byte_range is None:
+            response = Response(status=416)
+            response.headers['Content-Range'] = f"bytes */{total}"
+            return response
+        start, stop = byte_range
+        status = 206
+
+    response = Response(
+        _iter_file(path, start_offset + start, stop - start, buffer_size),
+        status=status,
+        mimetype=mimetype,
+        direct_passthrough=True,
+    )
+    response.content_length = stop - start
+    response.headers['Accept-Ranges'] = 'bytes'
+    if status == 206:
+        response.headers['Content-Range'] = f"bytes {start}-{stop - 1}/{total}"
+    return response
+
+
+def send_audio(file_path, as_attachment=False, download_name=None, start_offset=0):
+    """Build the response for a stored song according to AUDIO_DELIVERY.
+
+    A non-zero start_offset (from a seek table) is always streamed from
+    Python, since the proxies can only send whole files or client ranges.
+    """
+    mode = current_app.config.get('AUDIO_DELIVERY', 'stream')
+    mimetype = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+
+    if start_offset:
+        path = resolve(file_path)
+        if not os.path.isfile(path):
+            abort(404)
+        response = stream_file(path, mimetype, start_offset)
+    elif mode == 'x-accel':
+        response = Response(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = accel_redirect_uri(file_path)
+    elif mode == 'x-sendfile':
+        response = Response(mimetype=mimetype)
+        response.headers['X-Sendfile'] = resolve(file_path)
+    else:
+        if mode not in DELIVERY_MODES:
+            logger.warning(f"Unknown AUDIO_DELIVERY mode '{mode}', falling back to stream")
+        path = resolve(file_path)
+        if not os.path.isfile(path):
+            abort(404)
+        response = stream_file(path, mimetype)
+
+    if as_attachment:
+        _content_disposition(response, download_name or os.path.basename(file_path))
+    return response
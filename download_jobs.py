@@ -0,0 +1,225 @@
+"""
+Background song downloads for Country Music Paradise
+
+POST /api/download/<artist_id> no longer downloads inside the request. It
+records a DownloadJob row and hands the job id to a small thread pool of
+DOWNLOAD_WORKERS threads, then returns at once; the browser polls
+/api/download/job/<id> for progress.
+
+- A second request for the same (artist, song name) while a job for it is
+  queued or running gets the existing job instead of a new download. A
+  partial unique index allows one active job per song, and new jobs are
+  inserted with ON CONFLICT DO NOTHING, so concurrent requests cannot
+  both start one
+- A worker claims a job with a conditional UPDATE (queued -> running), so
+  each job runs once even when several processes schedule it
+- A download that fails (network or HTTP error) marks the job failed with
+  the error, which the browser shows; no song is created. Queueing the same
+  song again resumes from the partial file
+- Running jobs write their progress every PROGRESS_INTERVAL seconds, which
+  also serves as a heartbeat. After startup recover() re-queues running jobs
+  whose heartbeat is older than DOWNLOAD_JOB_STALE seconds (their worker
+  died) and schedules every queued job
+"""
+
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import inspect, insert, update
+from app import app, db
+from models import Artist, Song, DownloadJob, bump_catalog_version
+from music_api import download_song
+from storage import song_row, insert_songs, remove_file
+
+logger = logging.getLogger(__name__)
+
+# Minimum seconds between progress writes for one job
+PROGRESS_INTERVAL = 1.0
+
+_lock = threading.Lock()
+_pool = None
+_pool_pid = None
+
+
+def _executor():
+    """The download thread pool of this process (recreated after a fork)"""
+    global _pool, _pool_pid
+    with _lock:
+        if _pool_pid != os.getpid():
+            _pool = ThreadPoolExecutor(
+                max_workers=app.config.get('DOWNLOAD_WORKERS', 2),
+                thread_name_prefix='download',
+            )
+            _pool_pid = os.getpid()
+    return _pool
+
+
+def _active_job(artist_id, song_name):
+    return DownloadJob.query.filter(
+        DownloadJob.artist_id == artist_id,
+        DownloadJob.song_name == song_name,
+        DownloadJob.status.in_(DownloadJob.ACTIVE),
+    ).order_by(DownloadJob.id).first()
+
+
+def _insert_job(values):
+    """INSERT ... ON CONFLICT DO NOTHING; the new job's id, or None if the song already has an active job"""
+    table = DownloadJob.__table__
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        # No partial unique index here (see DownloadJob); insert plainly
+        return db.session.execute(insert(table).values(values).returning(table.c.id)).scalar()
+    stmt = dialect_insert(table).values(values).on_conflict_do_nothing().returning(table.c.id)
+    return db.session.execute(stmt).scalar()
+
+
+def submit(artist, song_name, source_url, source):
+    """Queue a download, or return the active job for the same song.
+
+    Returns (job, created).
+    """
+    while True:
+        job = _active_job(artist.id, song_name)
+        if job:
+            return job, False
+
+        now = datetime.utcnow()
+        job_id = _insert_job(dict(
+            artist_id=artist.id, song_name=song_name, source_url=source_url, source=source,
+            status=DownloadJob.QUEUED, bytes_done=0, created_at=now, updated_at=now,
+        ))
+        db.session.commit()
+        if job_id is not None:
+            schedule(job_id)
+            return db.session.get(DownloadJob, job_id), True
+        # Another request queued the song first; look again (it may even be done already)
+
+
+def schedule(job_id):
+    _executor().submit(_run, job_id)
+
+
+def _claim(job_id):
+    """Move a job from queued to running; False if someone else has it"""
+    result = db.session.execute(
+        update(DownloadJob)
+        .where(DownloadJob.id == job_id, DownloadJob.status == DownloadJob.QUEUED)
+        .values(status=DownloadJob.RUNNING, updated_at=datetime.utcnow())
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def _progress_reporter(job_id):
+    """progress(done, total) callback that writes at most every PROGRESS_INTERVAL"""
+    last = [0.0]
+
+    def report(done, total):
+        now = time.monotonic()
+        if now - last[0] < PROGRESS_INTERVAL:
+            return
+        last[0] = now
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(
+                    update(DownloadJob.__table__)
+                    .where(DownloadJob.__table__.c.id == job_id)
+                    .values(bytes_done=done, bytes_total=total, updated_at=datetime.utcnow())
+                )
+        except Exception as e:
+            logger.warning(f"Could not record progress of download job {job_id}: {str(e)}")
+
+    return report
+
+
+def _run(job_id):
+    with app.app_context():
+        try:
+            if not _claim(job_id):
+                return
+            job = db.session.get(DownloadJob, job_id)
+            artist = db.session.get(Artist, job.artist_id)
+
+            unused = []
+            song = Song.query.filter_by(name=job.song_name, artist_id=job.artist_id).first()
+            if song is None:
+                # Transfer errors propagate and fail the job; the partial file
+                # is kept, so submitting the song again resumes the download
+                blob = download_song(job.song_name, artist.name, job.source_url, job.source,
+                                     progress=_progress_reporter(job_id))
+
+                # If the same song was uploaded meanwhile, that one is kept
+                inserted, unused = insert_songs([song_row(
+                    blob,
+                    name=job.song_name,
+                    artist_id=job.artist_id,
+                    source=job.source,
+                    source_url=job.source_url
+                )])
+                if inserted:
+                    bump_catalog_version()
+                song = Song.query.filter_by(name=job.song_name, artist_id=job.artist_id).one()
+
+            job.status = DownloadJob.DONE
+            job.song_id = song.id
+            job.bytes_done = song.file_size or job.bytes_done
+            job.bytes_total = job.bytes_total or job.bytes_done
+            db.session.commit()
+            for path in unused:
+                remove_file(path)
+            logger.info(f"Download job {job_id} finished: song {song.id}")
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Download job {job_id} failed: {str(e)}")
+            db.session.execute(
+                update(DownloadJob)
+                .where(DownloadJob.id == job_id)
+                .values(status=DownloadJob.FAILED, error=f"Download failed: {str(e)}", updated_at=datetime.utcnow())
+            )
+            db.session.commit()
+        finally:
+            db.session.remove()
+
+
+def _recover_in_background():
+    with app.app_context():
+        try:
+            if not inspect(db.engine).has_table(DownloadJob.__tablename__):
+                logger.warning("No download jobs to recover: run `python bootstrap.py` first")
+                return
+            recover()
+        except Exception as e:
+            logger.error(f"Could not recover download jobs: {str(e)}")
+        finally:
+            db.session.remove()
+
+
+def start_recovery():
+    """Run recover() on the download pool so it does not delay startup"""
+    _executor().submit(_recover_in_background)
+
+
+def recover():
+    """Re-queue jobs left behind by a dead worker and schedule all queued jobs"""
+    stale = datetime.utcnow() - timedelta(seconds=app.config.get('DOWNLOAD_JOB_STALE', 120))
+    requeued = db.session.execute(
+        update(DownloadJob)
+        .where(DownloadJob.status == DownloadJob.RUNNING, DownloadJob.updated_at < stale)
+        .values(status=DownloadJob.QUEUED)
+    ).rowcount
+    db.session.commit()
+
+    job_ids = [job_id for (job_id,) in db.session.query(DownloadJob.id)
+               .filter(DownloadJob.status == DownloadJob.QUEUED).order_by(DownloadJob.id)]
+    for job_id in job_ids:
+        schedule(job_id)
+    if job_ids:
+        logger.info(f"Resuming {len(job_ids)} download jobs ({requeued} interrupted)")
+    return len(job_ids)
@@ -11,60 +11,96 @@ Usage:
 
 If song paths were stored with absolute paths, this script will convert them
 to relative paths within the static/music directory.
+
+Paths are rewritten with set-based UPDATEs: stored blobs are pointed at
+their shard in one statement and songs copy their blob's path in another,
+so the run time hardly depends on the size of the library. Only songs from
+before content addressing are handled row by row, in batches.
 """
 
 import os
 import logging
+from sqlalchemy import select, update, bindparam, func, literal, and_, String
 from app import app, db
-from models import Song
+from models import Song, AudioBlob
+from storage import canonical_path
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Rows of songs without a blob read and updated per round trip
+BATCH_SIZE = 1000
+
+def rewrite_paths():
+    """Point every blob and song at its canonical location. Returns (blobs, songs) changed.
+
+    Must be called inside an app context; the caller commits.
+    """
+    blobs = AudioBlob.__table__
+    songs = Song.__table__
+    music_folder = app.config.get('MUSIC_FOLDER', 'static/music')
+
+    # <music>/ab/cd/<sha256><ext>; every stored extension is four characters (.mp3, .m4a, ...)
+    shard_path = (
+        literal(music_folder + os.sep, String)
+        + func.substr(blobs.c.sha256, 1, 2, type_=String) + os.sep
+        + func.substr(blobs.c.sha256, 3, 2, type_=String) + os.sep
+        + blobs.c.sha256
+        + func.substr(blobs.c.file_path, func.length(blobs.c.file_path) - 3, type_=String)
+    )
+    blob_count = db.session.execute(
+        update(blobs).where(blobs.c.file_path != shard_path).values(file_path=shard_path)
+    ).rowcount
+
+    # Songs stored as blobs take their blob's path
+    blob_file = select(blobs.c.file_path).where(blobs.c.id == songs.c.blob_id).scalar_subquery()
+    song_count = db.session.execute(
+        update(songs)
+        .where(and_(songs.c.blob_id.isnot(None), songs.c.file_path != blob_file))
+        .values(file_path=blob_file)
+    ).rowcount
+
+    # Songs from before content addressing own a flat file named after the song
+    changes = []
+    rows = db.session.execute(
+        select(songs.c.id, songs.c.file_path).where(songs.c.blob_id.is_(None))
+        .execution_options(yield_per=BATCH_SIZE)
+    )
+    for song_id, old_path in rows:
+        new_path = canonical_path(old_path)
+        if new_path != old_path:
+            changes.append({'song_id': song_id, 'new_path': new_path})
+    for start in range(0, len(changes), BATCH_SIZE):
+        db.session.execute(
+            update(songs).where(songs.c.id == bindparam('song_id')).values(file_path=bindparam('new_path')),
+            changes[start:start + BATCH_SIZE]
+        )
+    song_count += len(changes)
+
+    return blob_count, song_count
+
 def fix_song_paths():
     """Update song file paths to ensure they point to the correct location."""
     with app.app_context():
-        # Get all songs from the database
-        songs = Song.query.all()
-        logger.info(f"Found {len(songs)} songs in the database")
-        
-        fixed_count = 0
-        music_folder = app.config.get('MUSIC_FOLDER', 'static/music')
-        
+        logger.info(f"Found {Song.query.count()} songs in the database")
+
         # Make sure the music folder exists
-        os.makedirs(music_folder, exist_ok=True)
-        
-        for song in songs:
-            old_path = song.file_path
-            
-            # Get just the filename from the path
-            filename = os.path.basename(old_path)
-            
-            # Create the new correct path
-            new_path = os.path.join(music_folder, filename)
-            
-            # Check if the path needs to be updated
-            if old_path != new_path:
-                logger.info(f"Updating path for '{song.name}' by '{song.artist.name}'")
-                logger.info(f"  Old path: {old_path}")
-                logger.info(f"  New path: {new_path}")
-                
-                # Update the path in the database
-                song.file_path = new_path
-                fixed_count += 1
-        
+        os.makedirs(app.config.get('MUSIC_FOLDER', 'static/music'), exist_ok=True)
+
+        blob_count, fixed_count = rewrite_paths()
+
         # Commit the changes if any paths were fixed
-        if fixed_count > 0:
+        if fixed_count or blob_count:
             db.session.commit()
-            logger.info(f"Fixed {fixed_count} song paths")
+            logger.info(f"Fixed {fixed_count} song paths and {blob_count} stored file paths")
         else:
             logger.info("All song paths are already correct")
-        
+
         return fixed_count
 
 if __name__ == "__main__":
     print("Starting path correction...")
     count = fix_song_paths()
     print(f"Path correction complete. Fixed {count} song paths.")
-    print("Your database now has the correct paths for all songs.")
\ No newline at end of file
+    print("Your database now has the correct paths for all songs.")
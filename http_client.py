@@ -0,0 +1,338 @@
+"""
+Shared outbound HTTP client for Country Music Paradise
+
+Every call to an external service (Jamendo, MusicBrainz, song downloads)
+goes through one requests.Session per process, so connections are kept
+alive and reused instead of paying a new TCP + TLS handshake per call.
+
+- Per-host connection pools of HTTP_POOL_SIZE connections
+- A default (connect, read) timeout on every request
+- GET/HEAD are retried HTTP_RETRIES times on connection errors and
+  429/5xx responses with exponential, jittered backoff (Retry-After is honoured)
+- At most HTTP_MAX_PER_HOST requests in flight to the same host at once
+
+Use get() for small responses and stream() for large bodies; stream() holds
+the host slot until the body has been read and the response closed.
+get(..., retries=False) uses a second session that never retries, for
+callers that must pace every attempt themselves (MusicBrainz rate limit).
+
+download() saves a large file to disk. It writes to a partial file that is
+only complete once download() returns, resumes an interrupted transfer with
+HTTP Range requests, and fetches big files from servers that support ranges
+as DOWNLOAD_SEGMENTS parallel segments. Segment progress is kept in a small
+JSON state file next to the partial file so a restart continues where the
+previous run stopped, as long as the remote file is unchanged (same size
+and ETag/Last-Modified). progress() is always called on the thread that
+called download(), never on a segment thread, so it can use the caller's
+application context.
+"""
+
+import os
+import re
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from app import app
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = "CountryMusicParadise/1.0 (+https://github.com/Elvin100s/CountryMusicHub)"
+
+_lock = threading.Lock()
+_sessions = {}
+_session_pid = None
+_host_slots = {}
+
+
+def _retry_policy(retries=True):
+    from urllib3.util.retry import Retry
+
+    options = dict(
+        total=app.config.get('HTTP_RETRIES', 3) if retries else 0,
+        backoff_factor=app.config.get('HTTP_BACKOFF', 0.5),
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    try:
+        return Retry(backoff_jitter=app.config.get('HTTP_BACKOFF', 0.5), **options)
+    except TypeError:
+        # urllib3 < 2 has no backoff_jitter; retry without jitter
+        return Retry(**options)
+
+
+def _build_session(retries=True):
+    # requests is imported on first use so that starting the app stays fast
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    pool_size = app.config.get('HTTP_POOL_SIZE', 10)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=_retry_policy(retries))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['User-Agent'] = USER_AGENT
+    return session
+
+
+def session(retries=True):
+    """The process-wide Session (rebuilt after a fork so pools are not shared).
+
+    With retries=False, the Session whose adapter never retries.
+    """
+    global _session_pid
+    with _lock:
+        if _session_pid != os.getpid():
+            _sessions.clear()
+            _host_slots.clear()
+            _session_pid = os.getpid()
+        if retries not in _sessions:
+            _sessions[retries] = _build_session(retries)
+        return _sessions[retries]
+
+
+def _slot(url):
+    """Semaphore limiting concurrent requests to the URL's host"""
+    host = urlparse(url).netloc.lower()
+    with _lock:
+        slot = _host_slots.get(host)
+        if slot is None:
+            slot = _host_slots[host] = threading.BoundedSemaphore(app.config.get('HTTP_MAX_PER_HOST', 4))
+    return slot
+
+
+class RateLimiter:
+    """Spaces calls at least `interval` seconds apart across threads"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def _timeout(kwargs):
+    kwargs.setdefault('timeout', (
+        app.config.get('HTTP_CONNECT_TIMEOUT', 3.05),
+        app.config.get('HTTP_READ_TIMEOUT', 15),
+    ))
+    return kwargs
+
+
+def get(url, retries=True, **kwargs):
+    """GET a URL and read the whole body; returns the requests Response"""
+    client = session(retries)
+    with _slot(url):
+        response = client.get(url, **_timeout(kwargs))
+        response.content  # Read the body before giving the host slot back
+    return response
+
+
+@contextmanager
+def stream(url, **kwargs):
+    """GET a URL without reading the body; use as `with stream(url) as response:`"""
+    client = session()
+    with _slot(url):
+        response = client.get(url, stream=True, **_timeout(kwargs))
+        try:
+            yield response
+        finally:
+            response.close()
+
+
+# Write size for downloads; one Python-level write per MiB instead of per KiB
+DOWNLOAD_CHUNK = 1024 * 1024
+
+# Save segment progress after this many new bytes
+STATE_SAVE_EVERY = 8 * 1024 * 1024
+
+# Seconds between progress() calls while segments are being fetched
+PROGRESS_POLL = 0.5
+
+CONTENT_RANGE = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+)')
+
+
+class RemoteFileChanged(Exception):
+    """The remote file no longer matches the partial download"""
+
+
+class _Segments:
+    """Byte ranges of a segmented download and how much of each is on disk"""
+
+    def __init__(self, state_path, state):
+        self.state_path = state_path
+        self.state = state
+        self.lock = threading.Lock()
+        self.unsaved = 0
+
+    @property
+    def done(self):
+        return sum(segment[2] for segment in self.state['segments'])
+
+    def advance(self, index, amount):
+        with self.lock:
+            self.state['segments'][index][2] += amount
+            self.unsaved += amount
+            if self.unsaved >= STATE_SAVE_EVERY:
+                self.save()
+
+    def save(self):
+        tmp = f"{self.state_path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.state_path)
+        self.unsaved = 0
+
+
+def _split(size, count):
+    """[start, end, done] triples covering 0..size-1 in `count` segments"""
+    step = -(-size // count)
+    return [[start, min(start + step, size) - 1, 0] for start in range(0, size, step)]
+
+
+def _load_state(state_path, path, url, size, validator):
+    try:
+        with open(state_path) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (state.get('url') != url or state.get('size') != size
+            or state.get('validator') != validator
+            or not os.path.exists(path) or os.path.getsize(path) != size):
+        return None
+    return state
+
+
+def _fetch_segment(url, fd, segments, index, validator):
+    start, end, done = segments.state['segments'][index]
+    pos = start + done
+    if pos > end:
+        return
+    headers = {'Range': f'bytes={pos}-{end}'}
+    if validator:
+        headers['If-Range'] = validator
+    with stream(url, headers=headers) as response:
+        if response.status_code != 206:
+            raise RemoteFileChanged(f"Expected 206 for {url}, got {response.status_code}")
+        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK):
+            chunk = chunk[:end + 1 - pos]
+            os.pwrite(fd, chunk, pos)
+            pos += len(chunk)
+            segments.advance(index, len(chunk))
+    if pos <= end:
+        raise IOError(f"Segment {start}-{end} of {url} ended early at {pos}")
+
+
+def _download_whole(response, path, progress):
+    """Write a plain 200 response to `path` from the start"""
+    total = response.headers.get('Content-Length')
+    total = int(total) if total else None
+    done = 0
+    with open(path, 'wb') as f:
+        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK):
+            f.write(chunk)
+            done += len(chunk)
+            if progress:
+                progress(done, total)
+        f.flush()
+        os.fsync(f.fileno())
+    return done
+
+
+def download(url, path, progress=None, segments=None):
+    """Download `url` to `path`, resuming an earlier partial download.
+
+    `path` only holds the complete file once this returns; callers should
+    treat it as partial otherwise. progress(bytes_done, bytes_total) is
+    called as data arrives. Returns the number of bytes in the file.
+    """
+    state_path = f"{path}.state"
+    started = time.monotonic()
+
+    # A one-byte range request tells us the size and whether ranges work;
+    # servers without range support answer 200 and we just read the body
+    with stream(url, headers={'Range': 'bytes=0-0'}) as response:
+        if response.status_code == 200:
+            size = _download_whole(response, path, progress)
+            _log_throughput(url, size, started, 1)
+            _remove(state_path)
+            return size
+        response.raise_for_status()
+        match = CONTENT_RANGE.match(response.headers.get('Content-Range', ''))
+        if response.status_code != 206 or not match:
+            raise IOError(f"Unexpected response to range request for {url}")
+        size = int(match.group(3))
+        # If-Range only accepts strong ETags
+        etag = response.headers.get('ETag')
+        validator = etag if etag and not etag.startswith('W/') else response.headers.get('Last-Modified')
+
+    state = _load_state(state_path, path, url, size, validator)
+    if state is None:
+        wanted = segments or app.config.get('DOWNLOAD_SEGMENTS', 4)
+        min_segment = app.config.get('DOWNLOAD_SEGMENT_MIN', 4 * 1024 * 1024)
+        count = max(1, min(wanted, size // min_segment))
+        state = {'url': url, 'size': size, 'validator': validator, 'segments': _split(size, count) if size else []}
+        with open(path, 'wb') as f:
+            f.truncate(size)
+    else:
+        logger.info(f"Resuming download of {url}")
+
+    tracker = _Segments(state_path, state)
+    pending = [i for i, (start, end, done) in enumerate(state['segments']) if start + done <= end]
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        try:
+            with ThreadPoolExecutor(max_workers=max(len(pending), 1), thread_name_prefix='segment') as pool:
+                futures = [pool.submit(_fetch_segment, url, fd, tracker, i, validator) for i in pending]
+                # Report progress from here rather than from the segment threads
+                running = futures
+                while running:
+                    finished, running = wait(running, timeout=PROGRESS_POLL, return_when=FIRST_EXCEPTION)
+                    if progress:
+                        with tracker.lock:
+                            done = tracker.done
+                        progress(done, size)
+                    if any(future.exception() for future in finished):
+                        break
+                for future in futures:
+                    future.result()
+        finally:
+            with tracker.lock:
+                tracker.save()
+        os.fsync(fd)
+    except RemoteFileChanged:
+        # The file changed since the partial download began: start over
+        _remove(state_path)
+        _remove(path)
+        raise
+    finally:
+        os.close(fd)
+
+    _remove(state_path)
+    _log_throughput(url, size, started, len(state['segments']))
+    return size
+
+
+def _log_throughput(url, size, started, segment_count):
+    elapsed = max(time.monotonic() - started, 1e-6)
+    logger.info(f"Downloaded {size} bytes from {url} in {elapsed:.2f}s "
+                f"({size / elapsed / 1024 / 1024:.1f} MiB/s, {segment_count} segments)")
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,215 @@
+"""
+Responsive artist image variants for Country Music Paradise
+
+The home page cards are at most a few hundred pixels wide, but the artist
+pictures saved by artist_images.py are full-size originals. generate()
+writes resized copies of every static/img/artists/<name>.jpg at WIDTHS
+pixels, in WebP and JPEG, to static/img/artists/variants/. The template
+helper artist_image_srcset() turns them into <picture>/srcset markup so
+each browser downloads only the size and format it needs.
+
+- Variant filenames carry a fingerprint of the source image
+  (<name>-<width>-<fingerprint>.webp), so they never change content and
+  are served with a one-year immutable Cache-Control header
+- manifest.json records, per artist, the source size, mtime and hash and
+  the variant files; only sources that changed are processed again and the
+  variants they replace are removed
+- Pillow is optional: without it generate() does nothing and the
+  templates keep using the original images
+"""
+
+import os
+import json
+import hashlib
+import importlib.util
+import logging
+import threading
+from flask import url_for, request
+from app import app
+
+
+logger = logging.getLogger(__name__)
+
+# Card images are ~350px wide at most; 800 covers 2x displays
+WIDTHS = (320, 480, 800)
+FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 6},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+SOURCE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# <img sizes> matching the home page grid (3 / 2 / 1 columns)
+CARD_SIZES = "(min-width: 992px) 33vw, (min-width: 768px) 50vw, 100vw"
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+_manifest_lock = threading.Lock()
+_manifest_cache = {'mtime': None, 'data': {}}
+
+
+def available():
+    """Whether Pillow is installed (checked without importing it)"""
+    return importlib.util.find_spec('PIL') is not None
+
+
+def source_dir():
+    return os.path.join(app.static_folder, 'img', 'artists')
+
+
+def variants_dir():
+    return os.path.join(source_dir(), 'variants')
+
+
+def _manifest_path():
+    return os.path.join(variants_dir(), 'manifest.json')
+
+
+def load_manifest():
+    """The manifest, re-read only when the file has changed"""
+    path = _manifest_path()
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return {}
+    with _manifest_lock:
+        if _manifest_cache['mtime'] != mtime:
+            try:
+                with open(path) as f:
+                    _manifest_cache['data'] = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not read image manifest: {str(e)}")
+                _manifest_cache['data'] = {}
+            _manifest_cache['mtime'] = mtime
+        return _manifest_cache['data']
+
+
+def _save_manifest(manifest):
+    path = _manifest_path()
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def _fingerprint(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _render(source, slug, fingerprint):
+    """Write every width/format of one source image; returns the variant map"""
+    # Pillow is only loaded when there is something to render
+    from PIL import Image, ImageOps
+
+    variants = {fmt: {} for fmt in FORMATS}
+    with Image.open(source) as original:
+        image = ImageOps.exif_transpose(original).convert('RGB')
+    # Never upscale: widths above the original collapse to the original width
+    widths = sorted({min(width, image.width) for width in WIDTHS})
+    for width in widths:
+        height = max(1, round(image.height * width / image.width))
+        resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+        for fmt, options in FORMATS.items():
+            name = f"{slug}-{width}-{fingerprint[:10]}.{'jpg' if fmt == 'jpeg' else fmt}"
+            target = os.path.join(variants_dir(), name)
+            resized.save(f"{target}.tmp", **options)
+            os.replace(f"{target}.tmp", target)
+            variants[fmt][str(width)] = name
+    return variants
+
+
+def _remove_variants(entry):
+    for names in entry.get('variants', {}).values():
+        for name in names.values():
+            try:
+                os.remove(os.path.join(variants_dir(), name))
+            except FileNotFoundError:
+                pass
+
+
+def generate(force=False):
+    """Create variants for new or changed artist images.
+
+    Returns the number of source images (re)processed; 0 without Pillow.
+    """
+    if not available():
+        logger.info("Pillow is not installed; skipping artist image variants")
+        return 0
+
+    os.makedirs(variants_dir(), exist_ok=True)
+    manifest = {slug: dict(entry) for slug, entry in load_manifest().items()}
+    seen = set()
+    processed = 0
+
+    for entry in os.scandir(source_dir()):
+        slug, ext = os.path.splitext(entry.name)
+        if not entry.is_file() or ext.lower() not in SOURCE_EXTENSIONS:
+            continue
+        seen.add(slug)
+        stat = entry.stat()
+        current = manifest.get(slug)
+        if not force and current and current['size'] == stat.st_size and current['mtime'] == stat.st_mtime:
+            continue  # Unchanged since the last run; not even read
+
+        fingerprint = _fingerprint(entry.path)
+        if not force and current and current['sha1'] == fingerprint:
+            current.update(size=stat.st_size, mtime=stat.st_mtime)  # Touched, not changed
+            continue
+
+        try:
+            variants = _render(entry.path, slug, fingerprint)
+        except Exception as e:
+            logger.warning(f"Could not create variants of {entry.name}: {str(e)}")
+            continue
+        if current:
+            stale = {fmt: {w: n for w, n in names.items() if n not in variants[fmt].values()}
+                     for fmt, names in current.get('variants', {}).items()}
+            _remove_variants({'variants': stale})
+        manifest[slug] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha1': fingerprint, 'variants': variants}
+        processed += 1
+
+    # Sources that were deleted take their variants with them
+    for slug in set(manifest) - seen:
+        _remove_variants(manifest.pop(slug))
+
+    _save_manifest(manifest)
+    logger.info(f"Artist image variants: {processed} images processed")
+    return processed
+
+
+def artist_image_srcset(artist_name):
+    """Template helper: variant URLs for an artist, or None to use the original.
+
+    Returns {'webp': srcset, 'jpeg': srcset, 'src': smallest JPEG URL, 'sizes'}.
+    """
+    slug = artist_name.lower().replace(' ', '_')
+    entry = load_manifest().get(slug)
+    if not entry:
+        return None
+
+    def srcset(fmt):
+        return ', '.join(
+            f"{url_for('static', filename='img/artists/variants/' + name)} {width}w"
+            for width, name in sorted(entry['variants'][fmt].items(), key=lambda item: int(item[0]))
+        )
+
+    jpeg = entry['variants']['jpeg']
+    smallest = jpeg[min(jpeg, key=int)]
+    return {
+        'webp': srcset('webp'),
+        'jpeg': srcset('jpeg'),
+        'src': url_for('static', filename='img/artists/variants/' + smallest),
+        'sizes': CARD_SIZES,
+    }
+
+
+def register_image_variants(app):
+    """Expose the srcset helper to templates and cache variants forever"""
+    app.jinja_env.globals['artist_image_srcset'] = artist_image_srcset
+    prefix = '/static/img/artists/variants/'
+
+    @app.after_request
+    def immutable_variants(response):
+        if request.path.startswith(prefix) and not request.path.endswith('.json') and response.status_code in (200, 304):
+            response.headers['Cache-Control'] = IMMUTABLE
+        return response
@@ -1,4 +1,13 @@
-from app import app
+from app import create_app
+
+if __name__ == "__main__":
+    # The development server prepares the database itself, before
+    # create_app() starts the job recovery threads; deployments run
+    # `python bootstrap.py` once before starting gunicorn
+    from bootstrap import bootstrap
+    bootstrap()
+
+app = create_app()
 
 if __name__ == "__main__":
     # Configure for large file uploads
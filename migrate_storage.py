@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+"""
+Migrate Song Files to the Sharded Storage Layout
+
+This script moves existing song files out of the flat static/music folder
+into the hashed subdirectory layout (static/music/ab/cd/<sha256>.mp3) while
+the site keeps running.
+
+It works in small batches. For every file the new copy is put in place first
+(hard link where possible, together with its seek table), then the database
+is updated and committed, and only then is the old file and its seek table
+removed. Requests that read the old path just before the commit still find
+the file.
+
+Usage:
+  python migrate_storage.py [--batch-size 200] [--pause 0.5]
+
+Two kinds of files are migrated:
+- Content-addressed blobs that are still stored flat in the music folder
+- Songs added before content addressing (named Artist_song.mp3), which are
+  hashed, de-duplicated and attached to a blob
+"""
+
+import os
+import sys
+import time
+import shutil
+import logging
+import argparse
+from app import app, db
+from models import AudioBlob, Song
+from storage import canonical_path, resolve, store_file, attach, remove_file
+import seek_index
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def _link_or_copy(source, target):
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+def place_file(old_path, new_path):
+    """Make the file and its seek table available at new_path without removing old_path."""
+    source, target = resolve(old_path), resolve(new_path)
+    if not os.path.exists(target):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        _link_or_copy(source, target)
+
+    # remove_file() takes the old seek table with the old file
+    source_table, target_table = seek_index.table_path(source), seek_index.table_path(target)
+    if os.path.exists(source_table) and not os.path.exists(target_table):
+        _link_or_copy(source_table, target_table)
+    seek_index.ensure(target)
+
+def migrate_blobs(batch_size, pause):
+    """Move flat content-addressed blobs into their shard directories."""
+    last_id = 0
+    moved = 0
+    while True:
+        blobs = (AudioBlob.query.filter(AudioBlob.id > last_id)
+                 .order_by(AudioBlob.id).limit(batch_size).all())
+        if not blobs:
+            break
+        last_id = blobs[-1].id
+
+        old_paths = []
+        for blob in blobs:
+            new_path = canonical_path(blob.file_path)
+            if blob.file_path == new_path:
+                continue
+            try:
+                place_file(blob.file_path, new_path)
+            except OSError as e:
+                logger.error(f"Could not move {blob.file_path}: {str(e)}")
+                continue
+            Song.query.filter_by(blob_id=blob.id).update(
+                {Song.file_path: new_path}, synchronize_session=False)
+            old_paths.append(blob.file_path)
+            blob.file_path = new_path
+
+        db.session.commit()
+        for path in old_paths:
+            remove_file(path)
+
+        moved += len(old_paths)
+        logger.info(f"Blobs: moved {moved} so far (up to id {last_id})")
+        time.sleep(pause)
+    return moved
+
+def migrate_legacy_songs(batch_size, pause):
+    """Hash songs stored before content addressing into sharded blobs."""
+    last_id = 0
+    moved = 0
+    while True:
+        songs = (Song.query.filter(Song.blob_id.is_(None), Song.id > last_id)
+                 .order_by(Song.id).limit(batch_size).all())
+        if not songs:
+            break
+        last_id = songs[-1].id
+
+        old_paths = set()
+        for song in songs:
+            source = resolve(song.file_path)
+            if not os.path.exists(source):
+                logger.warning(f"Missing file for song {song.id}: {song.file_path}")
+                continue
+            old_paths.add(song.file_path)
+            attach(song, store_file(source, link=True))
+
+        db.session.commit()
+        for path in old_paths:
+            # Several legacy rows may have pointed at the same file
+            if not Song.query.filter_by(file_path=path).first():
+                remove_file(path)
+
+        moved += len(old_paths)
+        logger.info(f"Legacy songs: migrated {moved} files so far (up to id {last_id})")
+        time.sleep(pause)
+    return moved
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move song files into the sharded storage layout")
+    parser.add_argument("--batch-size", type=int, default=200, help="rows per transaction")
+    parser.add_argument("--pause", type=float, default=0.5, help="seconds to sleep between batches")
+    args = parser.parse_args()
+
+    with app.app_context():
+        blobs = migrate_blobs(args.batch_size, args.pause)
+        legacy = migrate_legacy_songs(args.batch_size, args.pause)
+
+    print(f"Migration complete. Moved {blobs} blobs and {legacy} legacy song files.")
+    sys.exit(0)
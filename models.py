@@ -1,8 +1,12 @@
+import logging
 from app import db
+from sqlalchemy.exc import IntegrityError
 from flask_login import UserMixin
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 
+logger = logging.getLogger(__name__)
+
 # Association table for playlists and songs (many-to-many relationship)
 playlist_songs = db.Table('playlist_songs',
     db.Column('playlist_id', db.Integer, db.ForeignKey('playlist.id'), primary_key=True),
@@ -25,26 +29,91 @@ class Artist(db.Model):
     name = db.Column(db.String(100), nullable=False, unique=True)
     description = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Artist image lookup state (see artist_images.py)
+    mbid = db.Column(db.String(36), nullable=True)  # MusicBrainz artist id
+    image_url = db.Column(db.String(500), nullable=True)  # Where the image was found
+    image_etag = db.Column(db.String(255), nullable=True)
+    image_last_modified = db.Column(db.String(64), nullable=True)
+    image_checked_at = db.Column(db.DateTime, nullable=True)
     
     songs = db.relationship('Song', backref='artist', lazy=True)
     
     def __repr__(self):
         return f'<Artist {self.name}>'
 
+class AudioBlob(db.Model):
+    """A stored audio file, named by the SHA-256 of its content.
+
+    Several songs can share one blob; ref_count tracks how many do so the
+    file is only removed when the last of them is deleted.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), nullable=False, unique=True)
+    file_path = db.Column(db.String(200), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<AudioBlob {self.sha256[:12]} refs={self.ref_count}>'
+
 class Song(db.Model):
+    # One song per name and artist; concurrent ingests of the same song are
+    # resolved by the database (see storage.insert_songs)
+    __table_args__ = (
+        db.Index('uq_song_artist_name', 'artist_id', 'name', unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     artist_id = db.Column(db.Integer, db.ForeignKey('artist.id'), nullable=False)
     file_path = db.Column(db.String(200), nullable=False)
+    blob_id = db.Column(db.Integer, db.ForeignKey('audio_blob.id'), nullable=True)
     source = db.Column(db.String(50), nullable=True)  # Where the song was downloaded from
     source_url = db.Column(db.String(255), nullable=True)  # Original URL of the song
     download_count = db.Column(db.Integer, default=0)
+    play_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Technical metadata read from the file headers at ingest (see audio_meta.py)
+    duration = db.Column(db.Float, nullable=True)  # Seconds
+    bitrate = db.Column(db.Integer, nullable=True)  # kbps (average for VBR)
+    sample_rate = db.Column(db.Integer, nullable=True)  # Hz
+    codec = db.Column(db.String(16), nullable=True)
+    file_size = db.Column(db.BigInteger, nullable=True)  # Bytes
     
+    blob = db.relationship('AudioBlob')
+
     # Relationship with playlists through the association table
     playlists = db.relationship('Playlist', secondary=playlist_songs, 
                               back_populates='songs')
     
+    @property
+    def duration_display(self):
+        """Duration as m:ss, or None if it is not known"""
+        if self.duration is None:
+            return None
+        minutes, seconds = divmod(int(round(self.duration)), 60)
+        return f"{minutes}:{seconds:02d}"
+
+    def to_dict(self):
+        """JSON-friendly representation used by the song APIs"""
+        return {
+            'id': self.id,
+            'name': self.name,
+            'artist_id': self.artist_id,
+            'source': self.source,
+            'download_count': self.download_count,
+            'play_count': self.play_count,
+            'duration': self.duration,
+            'duration_display': self.duration_display,
+            'bitrate': self.bitrate,
+            'sample_rate': self.sample_rate,
+            'codec': self.codec,
+            'file_size': self.file_size,
+        }
+    
     def __repr__(self):
         return f'<Song {self.name}>'
 
@@ -77,6 +146,215 @@ class Playlist(db.Model):
     def __repr__(self):
         return f'<Playlist {self.name} with {len(self.songs)} songs>'
 
+class DownloadJob(db.Model):
+    """A remote song download run in the background (see download_jobs.py)"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    ACTIVE = (QUEUED, RUNNING)
+
+    id = db.Column(db.Integer, primary_key=True)
+    artist_id = db.Column(db.Integer, db.ForeignKey('artist.id'), nullable=False)
+    song_name = db.Column(db.String(100), nullable=False)
+    source_url = db.Column(db.String(255), nullable=True)
+    source = db.Column(db.String(50), nullable=True)
+    status = db.Column(db.String(16), nullable=False, default=QUEUED, server_default=QUEUED, index=True)
+    bytes_done = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+    bytes_total = db.Column(db.BigInteger, nullable=True)  # From Content-Length, if sent
+    song_id = db.Column(db.Integer, db.ForeignKey('song.id', ondelete='SET NULL'), nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Refreshed with every progress update; a running job whose updated_at is
+    # old belongs to a worker that died and is picked up again on restart
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # At most one queued or running job per song (see download_jobs.submit);
+    # finished and failed jobs are kept as history. Partial indexes need
+    # SQLite or PostgreSQL
+    __table_args__ = (
+        db.Index('uq_download_job_active', 'artist_id', 'song_name', unique=True,
+                 sqlite_where=db.text("status IN ('queued', 'running')"),
+                 postgresql_where=db.text("status IN ('queued', 'running')"))
+        .ddl_if(dialect=('sqlite', 'postgresql')),
+    )
+
+    artist = db.relationship('Artist')
+
+    def to_dict(self):
+        """JSON-friendly representation used by the job status API"""
+        progress = None
+        if self.status == self.DONE:
+            progress = 100.0
+        elif self.bytes_total:
+            progress = round(min(self.bytes_done / self.bytes_total, 1) * 100, 1)
+        return {
+            'id': self.id,
+            'artist_id': self.artist_id,
+            'song_name': self.song_name,
+            'status': self.status,
+            'bytes_done': self.bytes_done,
+            'bytes_total': self.bytes_total,
+            'progress': progress,
+            'song_id': self.song_id,
+            'error': self.error,
+        }
+
+    def __repr__(self):
+        return f'<DownloadJob {self.id} {self.song_name} {self.status}>'
+
+class UploadSession(db.Model):
+    """A chunked song upload in progress (see upload_routes.py).
+
+    The id is a random token; whoever holds it can add chunks. Bytes up to
+    `offset` have been received and written to the session's partial file.
+    /complete claims the session (open -> completing) before storing the file.
+    """
+    OPEN = 'open'
+    COMPLETING = 'completing'
+
+    id = db.Column(db.String(32), primary_key=True)
+    artist_id = db.Column(db.Integer, db.ForeignKey('artist.id'), nullable=False)
+    song_name = db.Column(db.String(100), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    offset = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+    sha256 = db.Column(db.String(64), nullable=True)  # Expected digest of the whole file, if given
+    state = db.Column(db.String(16), nullable=False, default=OPEN, server_default=OPEN)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        """JSON-friendly representation used by the upload API"""
+        return {
+            'id': self.id,
+            'artist_id': self.artist_id,
+            'song_name': self.song_name,
+            'filename': self.filename,
+            'size': self.size,
+            'offset': self.offset,
+            'complete': self.offset == self.size,
+            'state': self.state,
+        }
+
+    def __repr__(self):
+        return f'<UploadSession {self.id} {self.offset}/{self.size}>'
+
+class ArtistDeletion(db.Model):
+    """An artist being deleted in the background (see deletion_jobs.py)
+
+    Songs are deleted in batches first, then the artist row; the files no
+    song uses any more are queued as FileDeletion rows and removed last.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    REMOVING_FILES = 'removing_files'
+    DONE = 'done'
+    FAILED = 'failed'
+    ACTIVE = (QUEUED, RUNNING, REMOVING_FILES)
+
+    id = db.Column(db.Integer, primary_key=True)
+    # No foreign key: the artist row is gone before the job finishes
+    artist_id = db.Column(db.Integer, nullable=False, index=True)
+    artist_name = db.Column(db.String(100), nullable=False)
+    status = db.Column(db.String(16), nullable=False, default=QUEUED, server_default=QUEUED, index=True)
+    songs_total = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    songs_deleted = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    files_total = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    files_removed = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    files_failed = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Heartbeat, as for DownloadJob
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        """JSON-friendly representation used by the admin progress view"""
+        steps = self.songs_total + self.files_total
+        if self.status == self.DONE:
+            progress = 100.0
+        elif steps:
+            done = self.songs_deleted + self.files_removed + self.files_failed
+            progress = round(min(done / steps, 1) * 100, 1)
+        else:
+            progress = 0.0
+        return {
+            'id': self.id,
+            'artist_id': self.artist_id,
+            'artist_name': self.artist_name,
+            'status': self.status,
+            'songs_total': self.songs_total,
+            'songs_deleted': self.songs_deleted,
+            'files_total': self.files_total,
+            'files_removed': self.files_removed,
+            'files_failed': self.files_failed,
+            'progress': progress,
+            'error': self.error,
+        }
+
+    def __repr__(self):
+        return f'<ArtistDeletion {self.id} {self.artist_name} {self.status}>'
+
+class FileDeletion(db.Model):
+    """A file waiting to be removed from disk (see deletion_jobs.py)
+
+    Rows are written in the same transaction that stops using the file and
+    are deleted once the file is gone; failed attempts are retried after
+    next_attempt_at until the retries run out.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    file_path = db.Column(db.String(200), nullable=False)
+    deletion_id = db.Column(db.Integer, db.ForeignKey('artist_deletion.id', ondelete='CASCADE'),
+                            nullable=True, index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # NULL once the retries are used up
+    next_attempt_at = db.Column(db.DateTime, nullable=True, default=datetime.utcnow, index=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<FileDeletion {self.file_path} attempts={self.attempts}>'
+
+class CatalogState(db.Model):
+    """Single-row table holding the catalog version used by the page cache"""
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+def bump_catalog_version():
+    """Mark the catalog as changed. Call before committing any write that
+    alters what the public pages show, so cached pages are re-rendered."""
+    from sqlalchemy import update
+
+    result = db.session.execute(
+        update(CatalogState).where(CatalogState.id == 1).values(version=CatalogState.version + 1)
+    )
+    if result.rowcount == 0:
+        db.session.add(CatalogState(id=1, version=1))
+
+def catalog_version():
+    """Current catalog version (0 before the first write)"""
+    return db.session.query(CatalogState.version).filter_by(id=1).scalar() or 0
+
+def artists_with_song_counts():
+    """All artists ordered by name, each paired with its number of songs.
+
+    The counts come from one grouped subquery joined to the artist list, so
+    listing pages never load Artist.songs just to take its length.
+    """
+    from sqlalchemy import func
+
+    song_counts = (
+        db.session.query(Song.artist_id, func.count(Song.id).label('song_count'))
+        .group_by(Song.artist_id)
+        .subquery()
+    )
+    return (
+        db.session.query(Artist, func.coalesce(song_counts.c.song_count, 0))
+        .outerjoin(song_counts, song_counts.c.artist_id == Artist.id)
+        .order_by(Artist.name)
+        .all()
+    )
+
 # Create initial admin if it doesn't exist
 def create_default_admin():
     from app import db
@@ -110,17 +388,19 @@ def create_default_artists():
         {"name": "Keith Urban", "description": "Keith Urban is an Australian-American musician, singer, guitarist, and songwriter known for his fusion of country with rock and pop elements."}
     ]
     
-    from routes import get_artist_image
-    
+    # Images are fetched separately (update_artist_images.py), not at startup
+    added = 0
     for artist_data in default_artists:
         artist = Artist.query.filter_by(name=artist_data["name"]).first()
         if not artist:
-            # Try to download artist image when creating default artists
-            get_artist_image(artist_data["name"])
             artist = Artist(name=artist_data["name"], description=artist_data["description"])
             db.session.add(artist)
+            added += 1
     
-    db.session.commit()
+    # Re-running bootstrap on an existing catalog must not invalidate cached pages
+    if added:
+        bump_catalog_version()
+        db.session.commit()
 
 # Create a default playlist
 def create_default_playlist():
@@ -134,8 +414,75 @@ def create_default_playlist():
             is_public=True
         )
         db.session.add(default_playlist)
+        bump_catalog_version()
         db.session.commit()
 
+# Bring existing tables up to date with the models
+def upgrade_schema():
+    """Add columns that were introduced after a table was first created.
+
+    db.create_all() only creates missing tables, so new columns on existing
+    tables are added here with ALTER TABLE. New columns must be nullable or
+    carry a server_default for this to work on populated tables.
+    """
+    from sqlalchemy import inspect, text
+
+    inspector = inspect(db.engine)
+    preparer = db.engine.dialect.identifier_preparer
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = (f"ALTER TABLE {preparer.quote(table.name)} "
+                   f"ADD COLUMN {preparer.quote(column.name)} "
+                   f"{column.type.compile(dialect=db.engine.dialect)}")
+            if column.server_default is not None:
+                default = column.server_default.arg
+                if isinstance(default, str):
+                    # Plain strings are literals ('0', 'queued'); text() is raw SQL
+                    default = "'" + default.replace("'", "''") + "'"
+                ddl += f" DEFAULT {getattr(default, 'text', default)}"
+            db.session.execute(text(ddl))
+    db.session.commit()
+
+    # Indexes declared on existing tables (create_all skips those tables)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            try:
+                index.create(db.engine)
+            except IntegrityError:
+                logger.error(
+                    f"Could not create unique index {index.name}: {table.name} has duplicate rows. "
+                    f"Remove the duplicates and run bootstrap.py again."
+                )
+
+def existing_songs(keys):
+    """Which of the given (artist_id, name) pairs already have a song.
+
+    One query per few hundred pairs instead of one per file, for ingest
+    paths that check a whole batch before storing anything.
+    """
+    from sqlalchemy import tuple_
+
+    keys = list(set(keys))
+    found = set()
+    for start in range(0, len(keys), 400):
+        batch = keys[start:start + 400]
+        found.update(
+            db.session.query(Song.artist_id, Song.name)
+            .filter(tuple_(Song.artist_id, Song.name).in_(batch))
+            .all()
+        )
+    return {(artist_id, name) for artist_id, name in found}
+
 # Initialize default data
 def init_db():
     create_default_admin()
@@ -1,12 +1,14 @@
 import os
-import requests
 import logging
 import re
-import random
 import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 from urllib.parse import urlparse, urljoin, quote
-from werkzeug.utils import secure_filename
 from app import app
+from storage import store_file, partial_path
+import http_client
+from search_cache import search_cache, normalize, MISS, STALE
 
 logger = logging.getLogger(__name__)
 
@@ -16,38 +18,104 @@ JAMENDO_API_BASE = "https://api.jamendo.com/v3.0"
 JAMENDO_API_KEY = os.environ.get("JAMENDO_API_KEY", "")
 TUBIDY_BASE_URL = "https://tubidy.cool" # Using as reference only, not actually calling the API
 
-def search_songs(query, artist=None):
+# Concurrent provider searches: each provider has its own deadline and the
+# whole search has a total latency budget; late providers are left out
+SEARCH_TOTAL_BUDGET = float(os.environ.get("SEARCH_TOTAL_BUDGET", 3.0))
+SEARCH_PROVIDER_TIMEOUT = float(os.environ.get("SEARCH_PROVIDER_TIMEOUT", 2.5))
+_search_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="search")
+
+def default_providers():
+    """Remote search providers as (name, function, deadline in seconds)"""
+    providers = [
+        ("Tubidy", search_tubidy, SEARCH_PROVIDER_TIMEOUT),  # our main source for country music
+        ("Free Music Archive", search_fma, SEARCH_PROVIDER_TIMEOUT),
+    ]
+    # Try Jamendo if we have an API key
+    if JAMENDO_API_KEY:
+        providers.append(("Jamendo", search_jamendo, SEARCH_PROVIDER_TIMEOUT))
+    return providers
+
+def _timed(func, query, artist):
+    started = time.monotonic()
+    results = func(query, artist)
+    return results, time.monotonic() - started
+
+def _cache_when_done(key):
+    """Store a provider's results once its search finishes, even after its deadline"""
+    def store(future):
+        if not future.cancelled() and future.exception() is None:
+            search_cache.set(key, future.result()[0])
+    return store
+
+def search_songs(query, artist=None, providers=None, budget=None):
     """
     Search for songs using Tubidy, Free Music Archive API, or Jamendo API
-    Returns a list of songs with metadata
+    All providers are queried at the same time. Returns a dict with the
+    combined 'results' (in provider order) and per-provider 'providers'
+    metadata: status ('ok', 'timeout' or 'error'), cache state ('hit',
+    'stale' or 'miss'), elapsed ms and count.
+    Cached results are used where available (see search_cache.py).
     """
+    providers = default_providers() if providers is None else providers
+    budget = SEARCH_TOTAL_BUDGET if budget is None else budget
+    started = time.monotonic()
+    pending = []
+    for name, func, deadline in providers:
+        key = search_cache.key(name, query, artist)
+        cached, state = search_cache.get(key)
+        if state == MISS:
+            future = _search_pool.submit(_timed, func, query, artist)
+            future.add_done_callback(_cache_when_done(key))
+            pending.append((name, deadline, future, None))
+        else:
+            if state == STALE:
+                search_cache.refresh(key, _search_pool, func, query, artist)
+            pending.append((name, deadline, None, (cached, state)))
+
     results = []
-    
-    # Search Tubidy (our main source for country music)
-    try:
-        tubidy_results = search_tubidy(query, artist)
-        results.extend(tubidy_results)
-    except Exception as e:
-        logger.error(f"Error searching Tubidy: {str(e)}")
-    
-    # Try Free Music Archive as backup
-    try:
-        fma_results = search_fma(query, artist)
-        results.extend(fma_results)
-    except Exception as e:
-        logger.error(f"Error searching FMA: {str(e)}")
-    
-    # Try Jamendo if we have an API key
-    if JAMENDO_API_KEY:
+    meta = {}
+    for name, deadline, future, cached in pending:
+        if cached is not None:
+            provider_results, state = cached
+            results.extend(provider_results)
+            meta[name] = {'status': 'ok', 'cache': state, 'elapsed_ms': 0.0, 'count': len(provider_results)}
+            continue
+
+        # Wait no longer than this provider's deadline or the overall budget
+        remaining = min(deadline, budget) - (time.monotonic() - started)
         try:
-            jamendo_results = search_jamendo(query, artist)
-            results.extend(jamendo_results)
+            provider_results, elapsed = future.result(timeout=max(remaining, 0))
+        except FutureTimeout:
+            logger.warning(f"{name} search timed out after {min(deadline, budget):.1f}s")
+            meta[name] = {'status': 'timeout', 'cache': MISS, 'elapsed_ms': round((time.monotonic() - started) * 1000, 1), 'count': 0}
+            continue
         except Exception as e:
-            logger.error(f"Error searching Jamendo: {str(e)}")
-    
-    return results
+            logger.error(f"Error searching {name}: {str(e)}")
+            meta[name] = {'status': 'error', 'cache': MISS, 'elapsed_ms': round((time.monotonic() - started) * 1000, 1), 'count': 0}
+            continue
+        results.extend(provider_results)
+        meta[name] = {'status': 'ok', 'cache': MISS, 'elapsed_ms': round(elapsed * 1000, 1), 'count': len(provider_results)}
+
+    return {'results': results, 'providers': meta}
 
 
+def _tubidy_result(song):
+    """Build a Tubidy result whose id and duration depend only on the song"""
+    # Stable checksum of the song stands in for a real track id and length
+    checksum = zlib.crc32(f"{song['artist']}\0{song['title']}".encode('utf-8'))
+    duration_mins = 2 + checksum % 4
+    duration_secs = (checksum >> 8) % 60
+    return {
+        "id": f"tubidy_{checksum:08x}",
+        "name": song["title"],
+        "artist": song["artist"],
+        "source": "Tubidy",
+        "source_url": f"{TUBIDY_BASE_URL}/music/download/{quote(song['artist'])}/{quote(song['title'])}",
+        "license": "Free to download",
+        "duration": f"{duration_mins}:{duration_secs:02d}",
+        "thumbnail": f"https://source.unsplash.com/100x100/?music,country,{quote(song['title'])}"
+    }
+
 def search_tubidy(query, artist=None):
     """
     Search for songs using Tubidy
@@ -91,37 +159,13 @@ def search_tubidy(query, artist=None):
         matches_artist = not artist_term or artist_term in song_artist
         
         if matches_query or matches_artist:
-            # Generate a random duration between 2 and 5 minutes
-            duration_mins = random.randint(2, 5)
-            duration_secs = random.randint(0, 59)
-            duration = f"{duration_mins}:{duration_secs:02d}"
-            
-            # Add to results
-            results.append({
-                "id": f"tubidy_{int(time.time())}_{len(results)}",
-                "name": song["title"],
-                "artist": song["artist"],
-                "source": "Tubidy",
-                "source_url": f"{TUBIDY_BASE_URL}/music/download/{quote(song['artist'])}/{quote(song['title'])}",
-                "license": "Free to download",
-                "duration": duration,
-                "thumbnail": f"https://source.unsplash.com/100x100/?music,country,{quote(song['title'])}"
-            })
+            results.append(_tubidy_result(song))
     
-    # If no matches, return some generic results
+    # If no matches, return some generic results (the same ones for the same query)
     if not results:
+        first = zlib.crc32(normalize(query).encode('utf-8')) % len(country_songs)
         for i in range(5):
-            song = random.choice(country_songs)
-            results.append({
-                "id": f"tubidy_{int(time.time())}_{i}",
-                "name": song["title"],
-                "artist": song["artist"],
-                "source": "Tubidy",
-                "source_url": f"{TUBIDY_BASE_URL}/music/download/{quote(song['artist'])}/{quote(song['title'])}",
-                "license": "Free to download",
-                "duration": f"{random.randint(2, 5)}:{random.randint(0, 59):02d}",
-                "thumbnail": f"https://source.unsplash.com/100x100/?music,country,{quote(song['title'])}"
-            })
+            results.append(_tubidy_result(country_songs[(first + i) % len(country_songs)]))
     
     return results[:10]  # Return at most 10 results
 
@@ -149,6 +193,7 @@ def search_fma(query, artist=None):
 def search_jamendo(query, artist=None):
     """
     Search for songs using Jamendo API
+    Raises when the API cannot be reached or does not answer 200.
     """
     if not JAMENDO_API_KEY:
         return []
@@ -167,68 +212,49 @@ def search_jamendo(query, artist=None):
     if artist:
         params["artist_name"] = artist
     
-    try:
-        response = requests.get(f"{JAMENDO_API_BASE}/tracks/", params=params)
-        if response.status_code == 200:
-            data = response.json()
-            results = []
-            
-            if "results" in data:
-                for track in data["results"]:
-                    results.append({
-                        "id": f"jamendo_{track['id']}",
-                        "name": track["name"],
-                        "artist": track["artist_name"],
-                        "source": "Jamendo",
-                        "source_url": track.get("audiodownload") or track.get("audio"),
-                        "license": track.get("license", {}).get("name", "Unknown")
-                    })
-            
-            return results
-    except Exception as e:
-        logger.error(f"Error in Jamendo API call: {str(e)}")
-        return []
+    # Errors and non-200 answers raise, so search_songs reports the provider
+    # as failed and the empty result is not cached
+    response = http_client.get(f"{JAMENDO_API_BASE}/tracks/", params=params, timeout=SEARCH_PROVIDER_TIMEOUT)
+    if response.status_code != 200:
+        raise IOError(f"Jamendo API returned HTTP {response.status_code}")
+    data = response.json()
+    results = []
+
+    for track in data.get("results", []):
+        results.append({
+            "id": f"jamendo_{track['id']}",
+            "name": track["name"],
+            "artist": track["artist_name"],
+            "source": "Jamendo",
+            "source_url": track.get("audiodownload") or track.get("audio"),
+            "license": track.get("license", {}).get("name", "Unknown")
+        })
 
-def download_song(song_name, artist_name, source_url, source):
+    return results
+
+def download_song(song_name, artist_name, source_url, source, progress=None):
     """
-    Download a song from the provided URL and save it to the music folder
-    Returns the file path if successful, None otherwise
+    Download a song from the provided URL into content-addressed storage
+    Returns the AudioBlob; raises if the song could not be downloaded.
+    If given, progress(bytes_done, bytes_total) is called as data arrives;
+    bytes_total is None when the server does not send a Content-Length.
+    Interrupted downloads resume where they stopped (see http_client.download):
+    after a failure the partial file and its state are kept for the next try.
     """
     if not source_url:
-        logger.error("No source URL provided for download")
-        return None
-    
-    # Create safe filename
-    safe_filename = secure_filename(f"{artist_name}_{song_name}.mp3")
-    file_path = os.path.join(app.config["MUSIC_FOLDER"], safe_filename)
-    
+        raise ValueError("No source URL provided for download")
+
+    # Downloaded into a partial file first (resumed if a previous attempt
+    # was interrupted) and only stored once it is complete
+    part = partial_path(source_url)
     try:
-        # For demonstration, we'll create a simple MP3 file if the URL doesn't work
-        # In a real application, you would download from the actual URL
-        
-        try:
-            response = requests.get(source_url, stream=True)
-            
-            if response.status_code == 200:
-                with open(file_path, 'wb') as f:
-                    for chunk in response.iter_content(chunk_size=1024):
-                        if chunk:
-                            f.write(chunk)
-                
-                logger.info(f"Song downloaded from {source}: {file_path}")
-                return file_path
-        except Exception as e:
-            logger.error(f"Error downloading from {source_url}: {str(e)}")
-        
-        # If the download fails, create a dummy MP3 file for demonstration
-        # In a real application, you would return an error
-        with open(file_path, 'wb') as f:
-            # Create a minimal MP3 file (not actually playable, just for demo)
-            f.write(b'\xFF\xFB\x90\x44\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00')
-        
-        logger.warning(f"Created dummy MP3 file as fallback: {file_path}")
-        return file_path
-    
+        http_client.download(source_url, part, progress=progress)
     except Exception as e:
-        logger.error(f"Error saving song file: {str(e)}")
-        return None
+        logger.error(f"Error downloading from {source_url}: {str(e)}")
+        raise
+
+    blob = store_file(part, link=True)
+    os.remove(part)
+
+    logger.info(f"Song downloaded from {source}: {blob.file_path}")
+    return blob
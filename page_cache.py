@@ -0,0 +1,179 @@
+"""
+Rendered page cache for Country Music Paradise
+
+The public listing pages (home, artist, playlists) only change when someone
+uploads, deletes or edits something. Every such write bumps the catalog
+version (models.bump_catalog_version), and rendered pages are cached under
+the version they were rendered at, so a write invalidates all of them at
+once without having to track which page shows what.
+
+Two tiers:
+- An in-process LRU of PAGE_CACHE_SIZE pages
+- Optionally a directory (PAGE_CACHE_DIR) shared by all workers on the host;
+  files from older versions are removed when a newer version is first seen
+
+Responses carry an ETag derived from the same key, so browsers revalidating
+an unchanged page get a 304 without the page being rendered or even read.
+
+Pages are keyed by path only: none of the cached views reads the query
+string, and keying on it would let anyone fill the cache (and the shared
+directory) with /?x=1, /?x=2, ... Play and download counters are flushed
+without a catalog version bump, so views that show them are cached with
+live_counters=True: their pages are re-rendered every
+PAGE_CACHE_COUNTER_TTL seconds.
+
+Only anonymous GET requests without pending flash messages are cached; the
+admin view and one-off messages are always rendered fresh.
+"""
+
+import os
+import time
+import hashlib
+import logging
+import threading
+from functools import wraps
+from collections import OrderedDict
+from flask import request, session, make_response, Response
+from flask_login import current_user
+from app import app
+from models import catalog_version
+
+logger = logging.getLogger(__name__)
+
+
+class PageCache:
+    """Two-tier (memory LRU + optional shared directory) store of rendered pages"""
+
+    def __init__(self):
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_version = None
+
+    def _disk_dir(self):
+        return app.config.get('PAGE_CACHE_DIR')
+
+    def _disk_path(self, version, key_hash):
+        return os.path.join(self._disk_dir(), f"v{version}-{key_hash}.html")
+
+    def _purge_disk(self, version):
+        """Drop pages rendered at older catalog versions from the shared tier"""
+        if self._disk_version == version:
+            return
+        self._disk_version = version
+        prefix = f"v{version}-"
+        try:
+            for entry in os.scandir(self._disk_dir()):
+                if entry.name.endswith('.html') and not entry.name.startswith(prefix):
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass  # Another worker got there first
+        except OSError as e:
+            logger.warning(f"Could not purge page cache directory: {str(e)}")
+
+    def get(self, version, key_hash, ttl=None):
+        """A cached page, or None. With ttl, pages rendered in an earlier
+        ttl-second window (see _window) count as missing."""
+        window = _window(time.time(), ttl)
+        with self._lock:
+            entry = self._pages.get((version, key_hash))
+            if entry is not None and entry[1] == window:
+                self._pages.move_to_end((version, key_hash))
+                return entry[0]
+
+        if self._disk_dir():
+            try:
+                path = self._disk_path(version, key_hash)
+                if _window(os.path.getmtime(path), ttl) != window:
+                    return None
+                with open(path, 'rb') as f:
+                    body = f.read()
+            except OSError:
+                return None
+            self._remember(version, key_hash, body, window)
+            return body
+        return None
+
+    def _remember(self, version, key_hash, body, window):
+        with self._lock:
+            self._pages[(version, key_hash)] = (body, window)
+            self._pages.move_to_end((version, key_hash))
+            while len(self._pages) > app.config.get('PAGE_CACHE_SIZE', 256):
+                self._pages.popitem(last=False)
+
+    def set(self, version, key_hash, body, ttl=None):
+        self._remember(version, key_hash, body, _window(time.time(), ttl))
+
+        if self._disk_dir():
+            try:
+                os.makedirs(self._disk_dir(), exist_ok=True)
+                self._purge_disk(version)
+                path = self._disk_path(version, key_hash)
+                tmp = f"{path}.{os.getpid()}.tmp"
+                with open(tmp, 'wb') as f:
+                    f.write(body)
+                os.replace(tmp, path)
+            except OSError as e:
+                logger.warning(f"Could not write page cache file: {str(e)}")
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+
+
+page_cache = PageCache()
+
+
+def _window(timestamp, ttl):
+    """Number of the ttl-second window a time falls in (always 0 without ttl)"""
+    return int(timestamp // ttl) if ttl else 0
+
+
+def _cacheable():
+    return (
+        request.method == 'GET'
+        and not current_user.is_authenticated
+        and not session.get('_flashes')
+    )
+
+
+def cached_page(view=None, live_counters=False):
+    """Serve a view from the page cache, keyed by path and catalog version.
+
+    Use @cached_page(live_counters=True) for views that show play or
+    download counts, so they are refreshed every PAGE_CACHE_COUNTER_TTL
+    seconds. Cached views must not depend on the query string.
+    """
+    if view is None:
+        return lambda view: cached_page(view, live_counters)
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not _cacheable():
+            return view(*args, **kwargs)
+
+        version = catalog_version()
+        ttl = app.config.get('PAGE_CACHE_COUNTER_TTL', 60) if live_counters else None
+        key_hash = hashlib.sha1(request.path.encode('utf-8')).hexdigest()
+        etag = f"{version}-{key_hash[:16]}"
+        if ttl:
+            etag += f"-{_window(time.time(), ttl)}"
+
+        if etag in request.if_none_match:
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+
+        body = page_cache.get(version, key_hash, ttl)
+        if body is None:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            body = response.get_data()
+            page_cache.set(version, key_hash, body, ttl)
+
+        response = Response(body, mimetype='text/html')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    return wrapper
@@ -12,7 +12,8 @@ import os
 import logging
 from flask import render_template, request, redirect, url_for, jsonify, flash, session
 from app import db
-from models import Playlist, Song, Artist
+from models import Playlist, Song, Artist, bump_catalog_version
+from page_cache import cached_page
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -22,12 +23,14 @@ def register_playlist_routes(app):
     """Register all playlist-related routes with the Flask app"""
     
     @app.route('/playlists')
+    @cached_page
     def playlists():
         """Display all public playlists"""
         playlists = Playlist.query.filter_by(is_public=True).all()
         return render_template('playlists.html', playlists=playlists)
     
     @app.route('/playlist/<int:playlist_id>')
+    @cached_page
     def view_playlist(playlist_id):
         """View a specific playlist and its songs"""
         playlist = Playlist.query.get_or_404(playlist_id)
@@ -48,6 +51,7 @@ def register_playlist_routes(app):
             # Create new playlist
             playlist = Playlist(name=name, description=description, is_public=is_public)
             db.session.add(playlist)
+            bump_catalog_version()
             db.session.commit()
             
             flash(f'Playlist "{name}" created successfully!', 'success')
@@ -62,6 +66,7 @@ def register_playlist_routes(app):
         song = Song.query.get_or_404(song_id)
         
         success = playlist.add_song(song)
+        bump_catalog_version()
         db.session.commit()
         
         if success:
@@ -79,6 +84,7 @@ def register_playlist_routes(app):
         song = Song.query.get_or_404(song_id)
         
         success = playlist.remove_song(song)
+        bump_catalog_version()
         db.session.commit()
         
         if success:
@@ -107,6 +113,7 @@ def register_playlist_routes(app):
             playlist.name = name
             playlist.description = description
             playlist.is_public = is_public
+            bump_catalog_version()
             db.session.commit()
             
             flash(f'Playlist updated successfully!', 'success')
@@ -121,6 +128,7 @@ def register_playlist_routes(app):
         
         name = playlist.name
         db.session.delete(playlist)
+        bump_catalog_version()
         db.session.commit()
         
         flash(f'Playlist "{name}" has been deleted', 'success')
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+"""
+Reconcile Song Files with the Database
+
+Compares the files in the music folder with the paths stored on songs and
+stored files (AudioBlob) and reports:
+- Orphans: files no row points at (left behind by deletions or failed
+  uploads), and seek tables (.seek) whose audio file is gone. Only files
+  whose inode changed more than --min-age ago count, so an upload that is
+  being committed right now is not mistaken for one. The change time
+  (st_ctime) is used because a file stored with a hard link keeps the
+  modification time of its source
+- Dangling rows: paths stored in the database whose file does not exist
+
+Usage:
+  python reconcile_storage.py [--min-age 3600] [--quarantine DIR | --delete] [--list]
+
+By default nothing is changed. --quarantine moves orphans (with their seek
+tables) into DIR, keeping their relative paths so they can be moved back;
+--delete removes them.
+
+Memory use does not grow with the library: the database paths are streamed
+in sorted order and the music folder is walked one directory at a time in
+the same order, and the two sorted streams are merged. Seek tables next to
+their audio file go with it; the .incoming folder of partial uploads is
+ignored.
+"""
+
+import os
+import sys
+import time
+import shutil
+import logging
+import argparse
+from sqlalchemy import select, union
+from app import app, db
+from models import Song, AudioBlob
+from storage import resolve
+import seek_index
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Directories and file endings in the music folder that are not song files
+SKIP_DIRS = ('.incoming',)
+SKIP_SUFFIXES = ('.tmp', '.part', '.restoring')
+SEEK_SUFFIX = '.seek'
+
+# Orphans and dangling rows logged individually unless --list is given
+REPORT_LIMIT = 20
+
+def _sorted_files(folder, rel_folder):
+    """Yield the relative paths of all files under folder in plain string order.
+
+    Directories sort as "name/" so their contents come exactly where the
+    full paths would sort ("a.mp3" < "a/b.mp3"). Only one directory listing
+    is held at a time.
+    """
+    try:
+        entries = list(os.scandir(folder))
+    except OSError as e:
+        logger.error(f"Cannot list {folder}: {str(e)}")
+        return
+    keyed = []
+    for entry in entries:
+        is_dir = entry.is_dir(follow_symlinks=False)
+        if is_dir and entry.name in SKIP_DIRS:
+            continue
+        if not is_dir and entry.name.endswith(SKIP_SUFFIXES):
+            continue
+        keyed.append((entry.name + (os.sep if is_dir else ''), entry, is_dir))
+    keyed.sort(key=lambda item: item[0])
+    del entries
+
+    for _, entry, is_dir in keyed:
+        rel_path = os.path.join(rel_folder, entry.name)
+        if is_dir:
+            yield from _sorted_files(entry.path, rel_path)
+        else:
+            yield rel_path
+
+def _stored_paths(music_folder):
+    """Stream the distinct song and blob paths inside the music folder, sorted.
+
+    Paths are compared byte-wise (COLLATE "C" on PostgreSQL), which is the
+    order Python sorts strings in.
+    """
+    paths = union(select(Song.file_path.label('path')), select(AudioBlob.file_path.label('path'))).subquery()
+    column = paths.c.path
+    if db.engine.dialect.name == 'postgresql':
+        column = column.collate('C')
+    query = (select(paths.c.path)
+             .where(paths.c.path.like(music_folder + os.sep + '%'))
+             .order_by(column)
+             .execution_options(yield_per=10000))
+    yield from db.session.execute(query).scalars()
+
+def _other_paths(music_folder):
+    """Stored paths not written as <music folder>/... (absolute or from before fix_paths.py).
+
+    These are few; the files they resolve to must never be treated as orphans.
+    """
+    rows = db.session.execute(union(
+        select(Song.file_path).where(~Song.file_path.like(music_folder + os.sep + '%')),
+        select(AudioBlob.file_path).where(~AudioBlob.file_path.like(music_folder + os.sep + '%')),
+    )).scalars()
+    return {os.path.normpath(os.path.relpath(resolve(path), app.root_path)) for path in rows}
+
+def _quarantine(rel_path, quarantine_dir):
+    for path in (rel_path, seek_index.table_path(rel_path)):
+        source = resolve(path)
+        if os.path.exists(source):
+            target = os.path.join(quarantine_dir, path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.move(source, target)
+
+def _delete(rel_path):
+    for path in (resolve(rel_path), seek_index.table_path(resolve(rel_path))):
+        if os.path.exists(path):
+            os.remove(path)
+
+def reconcile(min_age=3600, quarantine_dir=None, delete=False, list_all=False):
+    """Compare the music folder with the database. Returns a dict of counts."""
+    music_folder = os.path.normpath(app.config.get('MUSIC_FOLDER', 'static/music'))
+    cutoff = time.time() - min_age
+    counts = {'files': 0, 'rows': 0, 'orphans': 0, 'orphan_bytes': 0, 'recent': 0,
+              'dangling': 0, 'handled': 0, 'errors': 0}
+
+    elsewhere = _other_paths(music_folder)
+    for path in sorted(elsewhere):
+        if not os.path.exists(resolve(path)):
+            counts['dangling'] += 1
+            logger.warning(f"Dangling row: {path} does not exist")
+    if elsewhere:
+        logger.info(f"{len(elsewhere)} stored paths are not relative to {music_folder}; run fix_paths.py")
+
+    def report(kind, path):
+        if list_all or counts[kind] <= REPORT_LIMIT:
+            logger.info(f"{'Orphan file' if kind == 'orphans' else 'Dangling row'}: {path}")
+
+    def orphan(rel_path):
+        if rel_path.endswith(SEEK_SUFFIX):
+            # A seek table belongs to its audio file and is only an orphan without it
+            # (stored paths never end in .seek, so every table arrives here)
+            if os.path.exists(resolve(rel_path[:-len(SEEK_SUFFIX)])):
+                return
+        counts['files'] += 1
+        if rel_path in elsewhere:
+            return
+        try:
+            st = os.stat(resolve(rel_path))
+        except FileNotFoundError:
+            return  # Removed while we were scanning, or moved with its audio file
+        if st.st_ctime > cutoff:
+            counts['recent'] += 1
+            return
+        counts['orphans'] += 1
+        counts['orphan_bytes'] += st.st_size
+        report('orphans', rel_path)
+        if not (quarantine_dir or delete):
+            return
+        try:
+            if quarantine_dir:
+                _quarantine(rel_path, quarantine_dir)
+            else:
+                _delete(rel_path)
+            counts['handled'] += 1
+        except OSError as e:
+            logger.error(f"Could not {'quarantine' if quarantine_dir else 'delete'} {rel_path}: {str(e)}")
+            counts['errors'] += 1
+
+    def dangling(path):
+        counts['rows'] += 1
+        counts['dangling'] += 1
+        report('dangling', path)
+
+    # Merge the two sorted streams
+    files = _sorted_files(resolve(music_folder), music_folder)
+    rows = _stored_paths(music_folder)
+    file_path = next(files, None)
+    row_path = next(rows, None)
+    while file_path is not None or row_path is not None:
+        if file_path is None or (row_path is not None and row_path < file_path):
+            dangling(row_path)
+            row_path = next(rows, None)
+        elif row_path is None or file_path < row_path:
+            orphan(file_path)
+            file_path = next(files, None)
+        else:
+            counts['files'] += 1
+            counts['rows'] += 1
+            file_path = next(files, None)
+            row_path = next(rows, None)
+
+    action = 'quarantined' if quarantine_dir else 'deleted' if delete else 'found'
+    logger.info(
+        f"Scanned {counts['files']} files and {counts['rows']} stored paths: "
+        f"{counts['orphans']} orphan files ({counts['orphan_bytes'] / (1024*1024):.2f} MB) {action}, "
+        f"{counts['recent']} newer than {min_age}s left alone, {counts['dangling']} dangling rows"
+    )
+    if counts['errors']:
+        logger.warning(f"{counts['errors']} orphans could not be {action}")
+    return counts
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find song files without rows and rows without files")
+    parser.add_argument("--min-age", type=float, default=3600,
+                        help="only files older than this many seconds can be orphans (default 3600)")
+    action = parser.add_mutually_exclusive_group()
+    action.add_argument("--quarantine", metavar="DIR", help="move orphan files into DIR")
+    action.add_argument("--delete", action="store_true", help="delete orphan files")
+    parser.add_argument("--list", action="store_true", help=f"log every finding, not just the first {REPORT_LIMIT}")
+    args = parser.parse_args()
+
+    with app.app_context():
+        counts = reconcile(args.min_age, args.quarantine, args.delete, args.list)
+
+    print(f"Reconcile complete. {counts['orphans']} orphan files, {counts['dangling']} dangling rows.")
+    sys.exit(1 if counts['errors'] else 0)
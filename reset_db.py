@@ -4,7 +4,8 @@ This script will add the new artists including Bryan Adams.
 """
 import logging
 from app import app, db
-from models import init_db
+from bootstrap import bootstrap
+import search_index
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -13,15 +14,12 @@ def reset_database():
     """Drop all tables and recreate them with fresh data."""
     with app.app_context():
         logger.info("Dropping all tables...")
+        search_index.drop()
         db.drop_all()
-        
-        logger.info("Creating all tables...")
-        db.create_all()
-        
-        logger.info("Initializing default data (admin and artists)...")
-        init_db()
-        
-        logger.info("Database reset and initialized successfully!")
+
+    # Recreate the tables, search index and default data (admin and artists)
+    bootstrap()
+    logger.info("Database reset and initialized successfully!")
 
 if __name__ == "__main__":
     reset_database()
\ No newline at end of file
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+"""
+Restore a Country Music Paradise Backup
+
+Restores an archive made by backup_site.py onto this installation in one go:
+
+1. Extracts the music files of the archive and of the earlier archives it
+   builds on with --workers threads, straight into their place in the music
+   folder (content-addressed files go into their ab/cd/ shard)
+2. Restores the database: an SQLite snapshot replaces the database file, a
+   PostgreSQL dump is streamed from the archive into pg_restore
+3. Brings the schema up to date (bootstrap.py) and rewrites song and stored
+   file paths with set-based UPDATEs (fix_paths.rewrite_paths)
+4. Checks every song and stored file against an index of the music folder
+   built in a single directory scan
+
+Usage:
+  python restore_site.py backups/country_music_backup_<timestamp>.zip
+                         [--workers 8] [--replace-database] [--skip-database]
+
+Stop the site first. An existing database is only overwritten with
+--replace-database; --skip-database restores the music files only and then
+fixes and checks the paths of the current database.
+"""
+
+import os
+import sys
+import time
+import shutil
+import logging
+import zipfile
+import argparse
+import tempfile
+import subprocess
+from sqlalchemy import inspect, select
+from app import app, db
+from models import Song, AudioBlob
+from storage import canonical_path, resolve
+from backup_site import restore_backup, read_manifest, STREAM_CHUNK
+from fix_paths import rewrite_paths
+from bootstrap import bootstrap
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Missing files listed individually in the report
+REPORT_MISSING = 20
+
+def place(rel_path):
+    """Where a backed-up music file belongs on this installation."""
+    name = os.path.basename(rel_path)
+    if name.endswith('.seek'):
+        # Seek tables sit next to their audio file
+        return resolve(canonical_path(name[:-len('.seek')]) + '.seek')
+    return resolve(canonical_path(name))
+
+def database_member(archive_path, manifest):
+    """Archive member holding the database copy."""
+    if manifest:
+        return manifest['database']
+    with zipfile.ZipFile(archive_path) as zipf:
+        dumps = [name for name in zipf.namelist() if name.endswith('.dump')]
+    return dumps[0] if dumps else None
+
+def has_tables():
+    with app.app_context():
+        return bool(inspect(db.engine).get_table_names())
+
+def restore_sqlite(archive_path, member, database):
+    """Replace the SQLite database file with the snapshot from the archive."""
+    tmp = f"{database}.restoring"
+    os.makedirs(os.path.dirname(database) or '.', exist_ok=True)
+    with zipfile.ZipFile(archive_path) as zipf, zipf.open(member) as src, open(tmp, 'wb') as dst:
+        shutil.copyfileobj(src, dst, STREAM_CHUNK)
+    # A journal left by the old database must not be applied to the new one
+    for leftover in (f"{database}-wal", f"{database}-shm", f"{database}-journal"):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+    os.replace(tmp, database)
+    logger.info(f"SQLite database restored to {database}")
+    return True
+
+def restore_postgres(archive_path, member, url):
+    """Stream a pg_dump custom-format archive member into pg_restore."""
+    cmd = ["pg_restore", "--clean", "--if-exists", "--no-owner", "-d", url.database]
+    if url.host:
+        cmd += ["-h", url.host]
+    if url.port:
+        cmd += ["-p", str(url.port)]
+    if url.username:
+        cmd += ["-U", url.username]
+
+    # Pass the password through the environment to keep it out of the command line
+    env = dict(os.environ)
+    if url.password:
+        env["PGPASSWORD"] = url.password
+
+    # Collect stderr in a file so a chatty pg_restore cannot block on a full pipe
+    with tempfile.TemporaryFile() as errors:
+        process = subprocess.Popen(cmd, env=env, stdin=subprocess.PIPE, stderr=errors)
+        try:
+            with zipfile.ZipFile(archive_path) as zipf, zipf.open(member) as src:
+                shutil.copyfileobj(src, process.stdin, STREAM_CHUNK)
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        if process.wait() != 0:
+            errors.seek(0)
+            logger.error(f"Database restore failed: {errors.read().decode('utf-8', 'replace')}")
+            return False
+    logger.info("PostgreSQL database restored")
+    return True
+
+def restore_database(archive_path, member):
+    with app.app_context():
+        url = db.engine.url
+        # Nothing may keep the old database open while it is replaced
+        db.engine.dispose()
+
+    backend = url.get_backend_name()
+    if backend == "sqlite" and member.endswith('.sqlite3'):
+        return restore_sqlite(archive_path, member, url.database)
+    if backend == "postgresql" and member.endswith('.dump'):
+        return restore_postgres(archive_path, member, url)
+    logger.error(f"The archive's database ({member}) cannot be restored into a {backend} database")
+    return False
+
+def music_index():
+    """Every file in the music folder, as paths relative to the app root, from one scan."""
+    music_dir = resolve(app.config.get('MUSIC_FOLDER', 'static/music'))
+    index = set()
+    for root, dirs, files in os.walk(music_dir):
+        rel_root = os.path.relpath(root, app.root_path)
+        index.update(os.path.join(rel_root, name) for name in files)
+    return index
+
+def verify():
+    """Check every song and stored file path against the music folder. Returns the missing paths."""
+    index = music_index()
+    missing = []
+    checked = 0
+    for column in (Song.__table__.c.file_path, AudioBlob.__table__.c.file_path):
+        paths = db.session.execute(select(column).execution_options(yield_per=10000)).scalars()
+        for path in paths:
+            checked += 1
+            rel_path = os.path.relpath(path, app.root_path) if os.path.isabs(path) else os.path.normpath(path)
+            if rel_path not in index:
+                missing.append(path)
+    logger.info(f"Checked {checked} paths against {len(index)} files: {len(missing)} missing")
+    for path in sorted(set(missing))[:REPORT_MISSING]:
+        logger.warning(f"  Missing: {path}")
+    return missing
+
+def restore_site(archive_path, workers=8, replace_database=False, skip_database=False):
+    """Restore music, database and paths from a backup. Returns True when nothing is missing."""
+    started = time.monotonic()
+    manifest = read_manifest(archive_path)
+    member = None if skip_database else database_member(archive_path, manifest)
+
+    if not skip_database:
+        if not member:
+            logger.error("The archive holds no database copy")
+            return False
+        if has_tables() and not replace_database:
+            logger.error("The database already has tables. Pass --replace-database to overwrite it, "
+                         "or --skip-database to restore the music files only.")
+            return False
+
+    # Step 1: music files, extracted in parallel into their final place
+    if manifest:
+        _, files, size = restore_backup(archive_path, workers=workers, place=place)
+    else:
+        # Archives from before manifests hold paths relative to the app root
+        _, files, size = restore_backup(archive_path, target_dir=app.root_path, workers=workers)
+    logger.info(f"Music restored: {files} files, {size / (1024*1024):.2f} MB")
+
+    # Step 2: the database
+    if not skip_database and not restore_database(archive_path, member):
+        return False
+
+    # Step 3: schema upgrades, then one pass of set-based path rewrites
+    bootstrap()
+    with app.app_context():
+        blob_count, song_count = rewrite_paths()
+        db.session.commit()
+        logger.info(f"Rewrote {song_count} song paths and {blob_count} stored file paths")
+
+        # Step 4: every path must now point at a restored file
+        missing = verify()
+
+    logger.info(f"Restore finished in {time.monotonic() - started:.1f}s")
+    return not missing
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Restore a backup made by backup_site.py")
+    parser.add_argument("archive", help="newest archive of the backup chain to restore")
+    parser.add_argument("--workers", type=int, default=8, help="files extracted at once (default 8)")
+    parser.add_argument("--replace-database", action="store_true", help="overwrite the existing database")
+    parser.add_argument("--skip-database", action="store_true", help="restore music files only")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.archive):
+        print(f"Archive not found: {args.archive}")
+        sys.exit(1)
+
+    if restore_site(args.archive, workers=args.workers, replace_database=args.replace_database,
+                    skip_database=args.skip_database):
+        print("Restore completed successfully.")
+        sys.exit(0)
+    else:
+        print("Restore finished with problems. Check the log for details.")
+        sys.exit(1)
@@ -1,62 +1,50 @@
 import os
 import logging
-import requests
-from flask import render_template, request, redirect, url_for, flash, jsonify, send_file, abort, session
+from flask import render_template, request, redirect, url_for, flash, jsonify, abort, session
 import os
 
 # Set max upload size from environment or default to 300MB
 MAX_CONTENT_LENGTH = int(os.getenv('BODY_SIZE_LIMIT', 314572800))  # 300MB in bytes
 from app import db, app
-from models import Artist, Song, Playlist
-from music_api import search_songs, download_song
-
-def get_artist_image(artist_name):
-    """Download artist image from MusicBrainz/Wikipedia"""
-    try:
-        # Search for artist on MusicBrainz
-        search_url = f"https://musicbrainz.org/ws/2/artist/?query={artist_name}&fmt=json"
-        response = requests.get(search_url)
-        if response.status_code == 200:
-            data = response.json()
-            if data['artists']:
-                artist_id = data['artists'][0]['id']
-
-                # Get Wikipedia image URL
-                wiki_url = f"https://musicbrainz.org/ws/2/artist/{artist_id}?inc=url-rels&fmt=json"
-                wiki_response = requests.get(wiki_url)
-                if wiki_response.status_code == 200:
-                    wiki_data = wiki_response.json()
-                    for relation in wiki_data.get('relations', []):
-                        if relation['type'] == 'image':
-                            image_url = relation['url']['resource']
-
-                            # Download and save image
-                            img_response = requests.get(image_url)
-                            if img_response.status_code == 200:
-                                filename = f"static/img/artists/{artist_name.lower().replace(' ', '_')}.jpg"
-                                with open(filename, 'wb') as f:
-                                    f.write(img_response.content)
-                                return True
-    except Exception as e:
-        logger.error(f"Error getting artist image: {str(e)}")
-    return False
+from models import Artist, Song, Playlist, DownloadJob, artists_with_song_counts, existing_songs, bump_catalog_version
+from music_api import search_songs
+import download_jobs
+from delivery import send_audio
+from storage import store_stream, song_row, insert_songs, remove_file, resolve, discard_uncommitted
+import seek_index
+from counters import record_play, record_download
+from page_cache import cached_page
+import search_index
 
 logger = logging.getLogger(__name__)
 
 def register_routes(app):
 
     @app.route('/')
+    @cached_page
     def home():
-        artists = Artist.query.order_by(Artist.name).all()
+        artists = artists_with_song_counts()
         return render_template('home.html', artists=artists)
 
     @app.route('/artist/<int:artist_id>')
+    @cached_page(live_counters=True)
     def artist_page(artist_id):
         artist = Artist.query.get_or_404(artist_id)
         songs = Song.query.filter_by(artist_id=artist_id).order_by(Song.name).all()
         playlists = Playlist.query.filter_by(is_public=True).all()
         return render_template('artist.html', artist=artist, songs=songs, playlists=playlists)
 
+    @app.route('/api/song/<int:song_id>')
+    def api_song(song_id):
+        song = Song.query.get_or_404(song_id)
+        return jsonify(song.to_dict())
+
+    @app.route('/api/artist/<int:artist_id>/songs')
+    def api_artist_songs(artist_id):
+        Artist.query.get_or_404(artist_id)
+        songs = Song.query.filter_by(artist_id=artist_id).order_by(Song.name).all()
+        return jsonify([song.to_dict() for song in songs])
+
     @app.route('/api/search_songs')
     def api_search_songs():
         query = request.args.get('query', '')
@@ -66,12 +54,35 @@ def register_routes(app):
             return jsonify({'error': 'Please provide a search query or artist name'}), 400
 
         try:
-            results = search_songs(query, artist)
-            return jsonify(results)
+            # Songs we already host come first, then remote provider results
+            local = search_index.search(' '.join(filter(None, [query, artist])), per_page=10)
+            results = [{
+                'id': f"local_{song['id']}",
+                'song_id': song['id'],
+                'name': song['name'],
+                'artist': song['artist'],
+                'source': 'Local',
+                'duration': song['duration_display'],
+                'local': True,
+            } for song in local['results']]
+            remote = search_songs(query, artist)
+            results.extend(remote['results'])
+            return jsonify({'results': results, 'providers': remote['providers']})
         except Exception as e:
             logger.error(f"Error searching songs: {str(e)}")
             return jsonify({'error': str(e)}), 500
 
+    @app.route('/api/search_local')
+    def api_search_local():
+        query = request.args.get('query', '')
+        page = request.args.get('page', 1, type=int)
+        per_page = request.args.get('per_page', 20, type=int)
+
+        if not query.strip():
+            return jsonify({'error': 'Please provide a search query'}), 400
+
+        return jsonify(search_index.search(query, page, per_page))
+
     @app.route('/api/download/<int:artist_id>', methods=['POST'])
     def api_download_song(artist_id):
         data = request.json
@@ -89,63 +100,59 @@ def register_routes(app):
         if existing_song:
             return jsonify({'message': 'Song already exists', 'song_id': existing_song.id}), 200
 
-        try:
-            # Download the song
-            file_path = download_song(song_name, artist.name, source_url, source)
-
-            if file_path:
-                # Create new song record
-                new_song = Song(
-                    name=song_name,
-                    artist_id=artist_id,
-                    file_path=file_path,
-                    source=source,
-                    source_url=source_url
-                )
-
-                db.session.add(new_song)
-                db.session.commit()
-
-                return jsonify({
-                    'success': True,
-                    'message': 'Song downloaded successfully',
-                    'song_id': new_song.id
-                })
-            else:
-                return jsonify({'error': 'Failed to download song'}), 500
+        # Download in the background; the client polls the job for progress
+        job, created = download_jobs.submit(artist, song_name, source_url, source)
+        response = job.to_dict()
+        response['job_id'] = job.id
+        response['status_url'] = url_for('api_download_job', job_id=job.id)
+        response['message'] = 'Download queued' if created else 'Download already in progress'
+        return jsonify(response), 202
 
-        except Exception as e:
-            logger.error(f"Error downloading song: {str(e)}")
-            return jsonify({'error': str(e)}), 500
+    @app.route('/api/download/job/<int:job_id>')
+    def api_download_job(job_id):
+        job = db.get_or_404(DownloadJob, job_id)
+        return jsonify(job.to_dict())
 
     @app.route('/play/<int:song_id>')
     def play_song(song_id):
         song = Song.query.get_or_404(song_id)
-        return send_file(song.file_path)
+
+        # Count a play once per listen, not for every Range request the
+        # browser makes while buffering
+        if request.range is None or request.range.ranges[0][0] == 0:
+            record_play(song.id)
+
+        # ?t=<seconds> starts the stream at the MP3 frame playing at that time
+        start = request.args.get('t', type=float)
+        if start:
+            offset = seek_index.offset_for(resolve(song.file_path), start)
+            if offset:
+                return send_audio(song.file_path, start_offset=offset)
+
+        return send_audio(song.file_path)
 
     @app.route('/download/<int:song_id>')
     def download_song_file(song_id):
         song = Song.query.get_or_404(song_id)
 
-        # Increment download count
-        song.download_count += 1
-        db.session.commit()
+        # Increment download count (buffered, written in batches)
+        record_download(song.id)
 
-        return send_file(
-            song.file_path, 
-            as_attachment=True, 
+        return send_audio(
+            song.file_path,
+            as_attachment=True,
             download_name=f"{song.name}.mp3"
         )
 
     @app.route('/user_upload_song', methods=['POST'])
     def user_upload_song():
         """Allow any user to upload songs without requiring admin login
-        Supports multiple file uploads and auto-extracts song names from filenames"""
-
-        # Increase request timeouts for large uploads
-        request.environ['wsgi.input'].stream.read_timeout = 300  # 5 minutes
-        request.environ['wsgi.input'].stream.write_timeout = 300  # 5 minutes
+        Supports multiple file uploads and auto-extracts song names from filenames.
+        This is the no-JavaScript fallback; the artist page normally sends large
+        files in resumable chunks through the upload API (upload_routes.py)"""
 
+        # Files stored by this request, removed again if it fails before committing
+        stored = []
         try:
             artist_id = request.form.get('artist_id')
 
@@ -158,58 +165,51 @@ def register_routes(app):
                 flash('Artist not found', 'danger')
                 return redirect(url_for('home'))
 
-            # Make sure the MUSIC_FOLDER exists
-            music_folder = app.config.get('MUSIC_FOLDER', 'static/music')
-            if not os.path.exists(music_folder):
-                os.makedirs(music_folder)
-
-            from werkzeug.utils import secure_filename
-
             # Handle multiple file uploads (uploaded with same field name)
-            song_files = request.files.getlist('song_file')
+            song_files = [f for f in request.files.getlist('song_file') if f and f.filename]
+            artist_id = artist.id
+
+            # Song names come from the filenames; one query finds those we already have
+            existing = existing_songs((artist_id, os.path.splitext(f.filename)[0]) for f in song_files)
 
-            success_count = 0
             skip_count = 0
             error_count = 0
+            rows = []
+            seen = set()
 
             for song_file in song_files:
-                if song_file and song_file.filename:
-                    # Extract song name from the filename
-                    original_filename = song_file.filename
-                    # Get rid of the extension and use as song name
-                    song_name = os.path.splitext(original_filename)[0]
-
-                    # Check if song already exists for this artist
-                    existing_song = Song.query.filter_by(name=song_name, artist_id=artist_id).first()
-                    if existing_song:
-                        logger.info(f"Song '{song_name}' already exists for {artist.name}. Skipping.")
-                        skip_count += 1
-                        continue
-
-                    # Save the file with a secure artist_songname format
-                    filename = secure_filename(f"{artist.name}_{original_filename}")
-                    file_path = os.path.join(music_folder, filename)
-
-                    try:
-                        song_file.save(file_path)
-
-                        # Create song record
-                        new_song = Song(
-                            name=song_name,
-                            artist_id=artist_id,
-                            file_path=file_path,
-                            source='user_upload'
-                        )
-
-                        db.session.add(new_song)
-                        success_count += 1
-                        logger.info(f"Successfully added song '{song_name}' for {artist.name}")
-                    except Exception as e:
-                        logger.error(f"Error saving file {original_filename}: {str(e)}")
-                        error_count += 1
+                original_filename = song_file.filename
+                song_name = os.path.splitext(original_filename)[0]
+
+                if (artist_id, song_name) in existing or song_name in seen:
+                    logger.info(f"Song '{song_name}' already exists for {artist.name}. Skipping.")
+                    skip_count += 1
+                    continue
+                seen.add(song_name)
+
+                try:
+                    # Store the file by content hash (duplicates share one blob)
+                    blob = store_stream(song_file.stream, original_filename)
+                    stored.append(blob.file_path)
+                    rows.append(song_row(blob, name=song_name, artist_id=artist_id, source='user_upload'))
+                except Exception as e:
+                    logger.error(f"Error saving file {original_filename}: {str(e)}")
+                    error_count += 1
+
+            # One INSERT for the batch; songs added concurrently by someone else are skipped
+            inserted, unused = insert_songs(rows)
+            success_count = len(inserted)
+            skip_count += len(rows) - success_count
+            for row in inserted:
+                logger.info(f"Successfully added song '{row.name}' for {artist.name}")
+
+            if success_count > 0:
+                bump_catalog_version()
+            db.session.commit()
+            for path in unused:
+                remove_file(path)
 
             if success_count > 0:
-                db.session.commit()
 
                 if success_count == 1:
                     flash(f'Song uploaded successfully', 'success')
@@ -229,6 +229,11 @@ def register_routes(app):
             return redirect(url_for('artist_page', artist_id=artist_id))
 
         except Exception as e:
+            db.session.rollback()
+            unused = discard_uncommitted(stored)
+            db.session.commit()
+            for path in unused:
+                remove_file(path)
             logger.error(f"Error uploading songs: {str(e)}")
             flash(f'Error uploading songs: {str(e)}', 'danger')
             return redirect(url_for('artist_page', artist_id=artist_id)) if 'artist_id' in locals() else redirect(url_for('home'))
@@ -0,0 +1,123 @@
+"""
+Remote search result cache for Country Music Paradise
+
+The search box calls /api/search_songs on every click and the same popular
+queries keep coming back, so each provider's results are cached per
+normalized (provider, query, artist) key.
+
+- Keys ignore case and extra whitespace, and treat a missing artist filter
+  and an empty one alike
+- Every provider has its own time to live (PROVIDER_TTL, falling back to
+  SEARCH_CACHE_TTL); errors and timeouts are never cached
+- After the TTL an entry is still served for SEARCH_CACHE_STALE seconds
+  while one background refresh replaces it (stale-while-revalidate)
+- At most SEARCH_CACHE_SIZE entries are kept; the least recently used one
+  is evicted first
+
+The cache lives in each worker process; stats() reports its hit rate.
+"""
+
+import time
+import logging
+import threading
+from collections import OrderedDict
+from app import app
+
+logger = logging.getLogger(__name__)
+
+# Seconds a provider's results stay fresh; the simulated catalogs never change
+PROVIDER_TTL = {
+    "Tubidy": 3600,
+    "Free Music Archive": 3600,
+    "Jamendo": 900,
+}
+
+FRESH = 'hit'
+STALE = 'stale'
+MISS = 'miss'
+
+
+def normalize(text):
+    """Case- and whitespace-insensitive form of a query or artist filter"""
+    return ' '.join((text or '').casefold().split())
+
+
+class SearchCache:
+    """LRU of provider results with per-provider TTL and stale serving"""
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._stats = dict.fromkeys(('hits', 'stale_hits', 'misses', 'refreshes', 'evictions'), 0)
+
+    @staticmethod
+    def key(provider, query, artist=None):
+        return (provider, normalize(query), normalize(artist))
+
+    def _ttl(self, provider):
+        return PROVIDER_TTL.get(provider, app.config.get('SEARCH_CACHE_TTL', 600))
+
+    def get(self, key):
+        """Return (results, state) where state is 'hit', 'stale' or 'miss'"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                results, expires = entry
+                if now < expires:
+                    self._entries.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return results, FRESH
+                if now < expires + app.config.get('SEARCH_CACHE_STALE', 3600):
+                    self._entries.move_to_end(key)
+                    self._stats['stale_hits'] += 1
+                    return results, STALE
+                del self._entries[key]
+            self._stats['misses'] += 1
+            return None, MISS
+
+    def set(self, key, results):
+        expires = time.monotonic() + self._ttl(key[0])
+        with self._lock:
+            self._entries[key] = (results, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > app.config.get('SEARCH_CACHE_SIZE', 512):
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def refresh(self, key, executor, func, query, artist):
+        """Re-run a provider search in the background, once per key at a time"""
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            self._stats['refreshes'] += 1
+
+        def run():
+            try:
+                self.set(key, func(query, artist))
+            except Exception as e:
+                logger.warning(f"Background refresh of {key[0]} search failed: {str(e)}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        executor.submit(run)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['stale_hits'] + self._stats['misses']
+            served = self._stats['hits'] + self._stats['stale_hits']
+            return {
+                **self._stats,
+                'size': len(self._entries),
+                'hit_rate': round(served / lookups, 3) if lookups else 0.0,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+search_cache = SearchCache()
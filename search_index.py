@@ -0,0 +1,208 @@
+"""
+Local full-text search for Country Music Paradise
+
+Indexes Song.name, Artist.name and Artist.description so songs we already
+host can be found without calling the remote providers.
+- SQLite: an FTS5 virtual table (song_search, rowid = song.id) ranked with bm25
+- PostgreSQL: a song_search table with a weighted tsvector and a GIN index,
+  ranked with ts_rank
+
+In both cases database triggers keep the index in step with inserts,
+updates and deletes on song and artist, so every write path (including bulk
+SQL) is covered without application code having to remember it.
+Other databases fall back to a simple LIKE search.
+"""
+
+import logging
+from sqlalchemy import text, inspect
+from sqlalchemy.orm import joinedload
+from app import db
+from models import Song
+
+logger = logging.getLogger(__name__)
+
+# Relative weight of song name, artist name and artist description
+SQLITE_WEIGHTS = (10.0, 5.0, 1.0)
+
+SQLITE_DDL = [
+    """CREATE VIRTUAL TABLE song_search USING fts5(
+        name, artist_name, artist_description,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER song_search_ai AFTER INSERT ON song BEGIN
+        INSERT INTO song_search(rowid, name, artist_name, artist_description)
+        SELECT new.id, new.name, artist.name, coalesce(artist.description, '')
+        FROM artist WHERE artist.id = new.artist_id;
+    END""",
+    """CREATE TRIGGER song_search_ad AFTER DELETE ON song BEGIN
+        DELETE FROM song_search WHERE rowid = old.id;
+    END""",
+    """CREATE TRIGGER song_search_au AFTER UPDATE OF name, artist_id ON song BEGIN
+        DELETE FROM song_search WHERE rowid = old.id;
+        INSERT INTO song_search(rowid, name, artist_name, artist_description)
+        SELECT new.id, new.name, artist.name, coalesce(artist.description, '')
+        FROM artist WHERE artist.id = new.artist_id;
+    END""",
+    """CREATE TRIGGER song_search_artist_au AFTER UPDATE OF name, description ON artist BEGIN
+        DELETE FROM song_search WHERE rowid IN (SELECT id FROM song WHERE artist_id = new.id);
+        INSERT INTO song_search(rowid, name, artist_name, artist_description)
+        SELECT song.id, song.name, new.name, coalesce(new.description, '')
+        FROM song WHERE song.artist_id = new.id;
+    END""",
+    """INSERT INTO song_search(rowid, name, artist_name, artist_description)
+        SELECT song.id, song.name, artist.name, coalesce(artist.description, '')
+        FROM song JOIN artist ON artist.id = song.artist_id""",
+]
+
+POSTGRES_DOCUMENT = """
+    setweight(to_tsvector('simple', coalesce({song}.name, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce({artist}.name, '')), 'B') ||
+    setweight(to_tsvector('simple', coalesce({artist}.description, '')), 'C')
+"""
+
+POSTGRES_DDL = [
+    """CREATE TABLE song_search (
+        song_id integer PRIMARY KEY REFERENCES song(id) ON DELETE CASCADE,
+        document tsvector NOT NULL
+    )""",
+    "CREATE INDEX song_search_document_idx ON song_search USING GIN (document)",
+    f"""CREATE OR REPLACE FUNCTION song_search_song_refresh() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO song_search (song_id, document)
+        SELECT NEW.id, {POSTGRES_DOCUMENT.format(song='NEW', artist='artist')}
+        FROM artist WHERE artist.id = NEW.artist_id
+        ON CONFLICT (song_id) DO UPDATE SET document = EXCLUDED.document;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql""",
+    """CREATE TRIGGER song_search_song_refresh
+        AFTER INSERT OR UPDATE OF name, artist_id ON song
+        FOR EACH ROW EXECUTE FUNCTION song_search_song_refresh()""",
+    f"""CREATE OR REPLACE FUNCTION song_search_artist_refresh() RETURNS trigger AS $$
+    BEGIN
+        UPDATE song_search SET document = {POSTGRES_DOCUMENT.format(song='song', artist='NEW')}
+        FROM song WHERE song.id = song_search.song_id AND song.artist_id = NEW.id;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql""",
+    """CREATE TRIGGER song_search_artist_refresh
+        AFTER UPDATE OF name, description ON artist
+        FOR EACH ROW EXECUTE FUNCTION song_search_artist_refresh()""",
+    f"""INSERT INTO song_search (song_id, document)
+        SELECT song.id, {POSTGRES_DOCUMENT.format(song='song', artist='artist')}
+        FROM song JOIN artist ON artist.id = song.artist_id""",
+]
+
+
+def _dialect():
+    return db.engine.dialect.name
+
+
+def install():
+    """Create the search index, its triggers and initial contents if missing"""
+    dialect = _dialect()
+    if dialect == 'sqlite':
+        statements = SQLITE_DDL
+    elif dialect == 'postgresql':
+        statements = POSTGRES_DDL
+    else:
+        logger.warning(f"No full-text index for {dialect}; local search uses LIKE")
+        return False
+
+    if inspect(db.engine).has_table('song_search'):
+        return True
+
+    with db.engine.begin() as conn:
+        for statement in statements:
+            conn.execute(text(statement))
+    logger.info("Created local song search index")
+    return True
+
+
+def drop():
+    """Remove the search index (before db.drop_all(); it is not a model table)"""
+    with db.engine.begin() as conn:
+        conn.execute(text("DROP TABLE IF EXISTS song_search"))
+
+
+def _terms(query):
+    """Split a user query into words, dropping characters with query-syntax meaning"""
+    cleaned = ''.join(ch if ch.isalnum() else ' ' for ch in query)
+    return cleaned.lower().split()
+
+
+def _sqlite_search(terms, limit, offset):
+    # Every word must match; the last one may be a prefix ("joh" -> "johnny")
+    match = ' '.join(f'"{term}"' for term in terms[:-1])
+    match = f'{match} "{terms[-1]}"*'.strip()
+    params = {'match': match, 'limit': limit, 'offset': offset}
+    total = db.session.execute(
+        text("SELECT count(*) FROM song_search WHERE song_search MATCH :match"), params
+    ).scalar()
+    rows = db.session.execute(text(
+        f"SELECT rowid, bm25(song_search, {', '.join(map(str, SQLITE_WEIGHTS))}) AS rank "
+        "FROM song_search WHERE song_search MATCH :match "
+        "ORDER BY rank LIMIT :limit OFFSET :offset"
+    ), params).all()
+    # bm25 is lower-is-better; flip it so higher scores rank first everywhere
+    return total, [(row[0], -row[1]) for row in rows]
+
+
+def _postgres_search(terms, limit, offset):
+    tsquery = ' & '.join(f"{term}:*" for term in terms)
+    params = {'tsquery': tsquery, 'limit': limit, 'offset': offset}
+    total = db.session.execute(text(
+        "SELECT count(*) FROM song_search WHERE document @@ to_tsquery('simple', :tsquery)"
+    ), params).scalar()
+    rows = db.session.execute(text(
+        "SELECT song_id, ts_rank(document, query) AS rank "
+        "FROM song_search, to_tsquery('simple', :tsquery) AS query "
+        "WHERE document @@ query ORDER BY rank DESC, song_id LIMIT :limit OFFSET :offset"
+    ), params).all()
+    return total, [(row[0], row[1]) for row in rows]
+
+
+def _like_search(terms, limit, offset):
+    query = Song.query
+    for term in terms:
+        query = query.filter(Song.name.ilike(f"%{term}%"))
+    total = query.count()
+    songs = query.order_by(Song.name).limit(limit).offset(offset).all()
+    return total, [(song.id, 0.0) for song in songs]
+
+
+def search(query, page=1, per_page=20):
+    """Ranked, paginated search over the local catalog.
+
+    Returns {'total', 'page', 'per_page', 'results'} where each result is a
+    Song.to_dict() with the artist name and a relevance score added.
+    """
+    page = max(page, 1)
+    per_page = min(max(per_page, 1), 100)
+    terms = _terms(query or '')
+    response = {'total': 0, 'page': page, 'per_page': per_page, 'results': []}
+    if not terms:
+        return response
+
+    limit, offset = per_page, (page - 1) * per_page
+    dialect = _dialect()
+    if dialect == 'sqlite':
+        total, ranked = _sqlite_search(terms, limit, offset)
+    elif dialect == 'postgresql':
+        total, ranked = _postgres_search(terms, limit, offset)
+    else:
+        total, ranked = _like_search(terms, limit, offset)
+
+    songs = {
+        song.id: song
+        for song in Song.query.options(joinedload(Song.artist))
+        .filter(Song.id.in_([song_id for song_id, _ in ranked])).all()
+    }
+    for song_id, score in ranked:
+        song = songs.get(song_id)
+        if song is None:
+            continue
+        result = song.to_dict()
+        result['artist'] = song.artist.name
+        result['score'] = round(float(score), 4)
+        response['results'].append(result)
+    response['total'] = total
+    return response
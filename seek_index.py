@@ -0,0 +1,145 @@
+"""
+Seek tables for Country Music Paradise
+
+For MP3 songs a small table mapping whole seconds to the byte offset of the
+MPEG frame playing at that moment is built once at ingest and stored next to
+the audio file (<file>.seek). /play/<id>?t=<seconds> uses it to start the
+stream on a frame boundary without reading the file up to that point.
+
+MP3 is self-synchronising, so a stream that starts on any frame boundary
+decodes cleanly. M4A files cannot be cut this way (the decoder needs the moov
+atom), so they have no table and are served from the start; browsers seek in
+those with their own Range requests.
+
+File format: 4-byte magic, uint16 version, uint16 seconds per entry,
+uint32 entry count, then one little-endian uint64 offset per entry.
+"""
+
+import os
+import struct
+import logging
+from audio_meta import id3v2_size, find_first_frame, parse_frame_header
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'CMSK'
+VERSION = 1
+HEADER = struct.Struct('<4sHHI')
+
+# Seconds between table entries
+INTERVAL = 1
+
+# How much of the file is scanned at a time while walking frames
+READ_SIZE = 256 * 1024
+
+
+def table_path(path):
+    """Sidecar file holding the seek table for an audio file"""
+    return f"{path}.seek"
+
+
+def scan_mp3(path, interval=INTERVAL):
+    """Walk every MPEG frame of an MP3 and return the offset of each interval.
+
+    Entry n is the byte offset of the frame that is playing at n * interval
+    seconds. Returns None if the file does not look like an MP3.
+    """
+    file_size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        head = f.read(10)
+        if head[4:8] == b'ftyp':
+            return None  # MP4 container, not a raw MPEG stream
+        pos = id3v2_size(head)
+        f.seek(pos)
+        buf = f.read(READ_SIZE)
+        first, _ = find_first_frame(buf)
+        if first is None:
+            return None
+        pos += first
+
+        offsets = []
+        elapsed = 0.0
+        next_mark = 0.0
+        buf_start, buf = pos, buf[first:]
+
+        while pos + 4 <= file_size:
+            # Keep at least one full frame header in the buffer
+            if pos + 4 > buf_start + len(buf):
+                f.seek(pos)
+                buf_start, buf = pos, f.read(READ_SIZE)
+                if len(buf) < 4:
+                    break
+            rel = pos - buf_start
+            frame = parse_frame_header(buf[rel:rel + 4])
+            if frame is None:
+                if buf[rel:rel + 3] == b'TAG':
+                    break  # ID3v1 at the end of the file
+                # Lost sync (junk between frames): look for the next frame
+                resync, _ = find_first_frame(buf, rel + 1)
+                if resync is None:
+                    f.seek(pos + 1)
+                    buf_start, buf = pos + 1, f.read(READ_SIZE)
+                    resync, _ = find_first_frame(buf)
+                    if resync is None:
+                        break
+                pos = buf_start + resync
+                continue
+
+            while elapsed >= next_mark:
+                offsets.append(pos)
+                next_mark += interval
+            elapsed += frame['samples'] / frame['sample_rate']
+            pos += frame['length']
+
+    return offsets
+
+
+def write_table(path, offsets, interval=INTERVAL):
+    """Write a seek table next to `path` (atomically)"""
+    target = table_path(path)
+    tmp = f"{target}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, interval, len(offsets)))
+        f.write(struct.pack(f'<{len(offsets)}Q', *offsets))
+    os.replace(tmp, target)
+
+
+def build(path):
+    """Build and store the seek table for an audio file if it is an MP3.
+
+    Returns the number of entries written, or 0 when no table applies.
+    """
+    try:
+        offsets = scan_mp3(path)
+    except OSError as e:
+        logger.warning(f"Could not build seek table for {path}: {str(e)}")
+        return 0
+    if not offsets:
+        return 0
+    write_table(path, offsets)
+    return len(offsets)
+
+
+def ensure(path):
+    """Build the seek table for `path` unless an up-to-date one exists"""
+    target = table_path(path)
+    if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+        return
+    build(path)
+
+
+def offset_for(path, seconds):
+    """Byte offset of the frame playing at `seconds`, or None without a table.
+
+    Only the header and the single entry needed are read from the table.
+    """
+    try:
+        with open(table_path(path), 'rb') as f:
+            magic, version, interval, count = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC or version != VERSION or count == 0:
+                return None
+            index = min(max(int(seconds // interval), 0), count - 1)
+            f.seek(HEADER.size + index * 8)
+            return struct.unpack('<Q', f.read(8))[0]
+    except (OSError, struct.error):
+        return None
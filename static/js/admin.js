@@ -29,6 +29,43 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     };
     
+    // Follow a background artist deletion until it is finished
+    const deletionProgress = document.getElementById('deletion-progress');
+    if (deletionProgress) {
+        const statusUrl = deletionProgress.dataset.statusUrl;
+        const field = name => deletionProgress.querySelector(`.deletion-${name}`);
+        const bar = deletionProgress.querySelector('.progress-bar');
+
+        const poll = function() {
+            fetch(statusUrl, { headers: { 'Accept': 'application/json' } })
+                .then(response => response.json())
+                .then(job => {
+                    field('status').textContent = job.status.replace('_', ' ');
+                    field('percent').textContent = `${Math.round(job.progress)}%`;
+                    bar.style.width = `${job.progress}%`;
+                    field('songs-deleted').textContent = job.songs_deleted;
+                    field('songs-total').textContent = job.songs_total;
+                    field('files-removed').textContent = job.files_removed;
+                    field('files-total').textContent = job.files_total;
+                    if (job.files_failed) {
+                        field('files-failed').querySelector('.count').textContent = job.files_failed;
+                        field('files-failed').classList.remove('d-none');
+                    }
+                    if (job.error) {
+                        field('error').textContent = job.error;
+                        field('error').classList.remove('d-none');
+                    }
+                    if (job.status === 'done' || job.status === 'failed') {
+                        bar.classList.remove('progress-bar-animated');
+                    } else {
+                        setTimeout(poll, 1000);
+                    }
+                })
+                .catch(() => setTimeout(poll, 5000));
+        };
+        poll();
+    }
+
     // Validate song upload form
     const uploadForm = document.getElementById('upload-song-form');
     if (uploadForm) {
@@ -13,9 +13,9 @@ document.addEventListener('DOMContentLoaded', function() {
     let globalAudioPlayer = null;
     let currentPlayingButton = null;
     
-    // Function to play a song
-    window.playSong = function(songId, button) {
-        const url = `/play/${songId}`;
+    // Function to play a song, optionally starting `startAt` seconds in
+    window.playSong = function(songId, button, startAt) {
+        const url = startAt ? `/play/${songId}?t=${Math.floor(startAt)}` : `/play/${songId}`;
         
         // If we already have a player, stop it
         if (globalAudioPlayer) {
@@ -165,7 +165,9 @@ document.addEventListener('DOMContentLoaded', function() {
                     return;
                 }
                 
-                if (data.length === 0) {
+                const songs = data.results || [];
+                
+                if (songs.length === 0) {
                     resultsContainer.innerHTML = '<div class="alert alert-info">No songs found. Try a different search term.</div>';
                     return;
                 }
@@ -174,7 +176,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 const songGrid = document.createElement('div');
                 songGrid.className = 'row row-cols-1 row-cols-md-2 g-4';
                 
-                data.forEach(song => {
+                songs.forEach(song => {
                     const songItem = document.createElement('div');
                     songItem.className = 'col';
                     
@@ -201,9 +203,13 @@ document.addEventListener('DOMContentLoaded', function() {
                                 </div>
                             </div>
                             <div class="card-footer bg-transparent">
+                                ${song.local ? `
+                                <button class="btn btn-success w-100" onclick="playSong(${song.song_id}, this)">
+                                    <i class="fas fa-play me-2"></i> Play (already in collection)
+                                </button>` : `
                                 <button class="btn btn-primary w-100" onclick="addSongToArtist(${artistId}, '${song.name.replace(/'/g, "\\'")}', '${song.source_url}', '${song.source}')">
                                     <i class="fas fa-plus-circle me-2"></i> Add to Collection
-                                </button>
+                                </button>`}
                             </div>
                         </div>
                     `;
@@ -219,6 +225,51 @@ document.addEventListener('DOMContentLoaded', function() {
             });
     };
     
+    // Show a dismissible result toast in the top right corner
+    function showResultToast(success, message) {
+        const resultToast = document.createElement('div');
+        resultToast.className = `toast align-items-center ${success ? 'text-bg-success' : 'text-bg-danger'} border-0 position-fixed top-0 end-0 m-3`;
+        resultToast.innerHTML = `
+            <div class="d-flex">
+                <div class="toast-body">
+                    ${message}
+                </div>
+                <button type="button" class="btn-close btn-close-white me-2 m-auto" data-bs-dismiss="toast" aria-label="Close"></button>
+            </div>
+        `;
+        
+        document.body.appendChild(resultToast);
+        const newToast = new bootstrap.Toast(resultToast);
+        newToast.show();
+    }
+    
+    // Poll a background download job until it finishes, updating the toast text
+    function pollDownloadJob(statusUrl, songName, loadingToast) {
+        const label = loadingToast.querySelector('.download-status');
+        
+        return new Promise((resolve, reject) => {
+            const check = () => {
+                fetch(statusUrl)
+                    .then(response => response.json())
+                    .then(job => {
+                        if (job.status === 'done') {
+                            resolve(job);
+                        } else if (job.status === 'failed') {
+                            reject(new Error(job.error || 'Download failed'));
+                        } else {
+                            const progress = job.progress !== null ? ` ${Math.round(job.progress)}%` : '';
+                            label.textContent = job.status === 'queued'
+                                ? `Waiting to download "${songName}"...`
+                                : `Downloading "${songName}"...${progress}`;
+                            setTimeout(check, 1000);
+                        }
+                    })
+                    .catch(reject);
+            };
+            check();
+        });
+    }
+    
     // Function to add a song to an artist
     window.addSongToArtist = function(artistId, songName, sourceUrl, source) {
         const loadingToast = document.createElement('div');
@@ -226,12 +277,13 @@ document.addEventListener('DOMContentLoaded', function() {
         loadingToast.setAttribute('role', 'alert');
         loadingToast.setAttribute('aria-live', 'assertive');
         loadingToast.setAttribute('aria-atomic', 'true');
+        loadingToast.setAttribute('data-bs-autohide', 'false');
         
         loadingToast.innerHTML = `
             <div class="d-flex">
                 <div class="toast-body">
                     <span class="spinner-border spinner-border-sm" role="status" aria-hidden="true"></span>
-                    Downloading song "${songName}"...
+                    <span class="download-status">Downloading song "${songName}"...</span>
                 </div>
             </div>
         `;
@@ -241,7 +293,13 @@ document.addEventListener('DOMContentLoaded', function() {
         const toast = new bootstrap.Toast(loadingToast);
         toast.show();
         
-        // Make API request to download the song
+        // Close the modal; the download continues in the background
+        const modal = bootstrap.Modal.getInstance(document.getElementById('searchSongsModal'));
+        if (modal) {
+            modal.hide();
+        }
+        
+        // Queue the download, then follow the job until it is done
         fetch(`/api/download/${artistId}`, {
             method: 'POST',
             headers: {
@@ -255,71 +313,29 @@ document.addEventListener('DOMContentLoaded', function() {
         })
         .then(response => response.json())
         .then(data => {
-            // Remove the loading toast
-            loadingToast.remove();
-            
-            const resultToast = document.createElement('div');
-            
-            if (data.success) {
-                // Song was downloaded successfully
-                resultToast.className = 'toast align-items-center text-bg-success border-0 position-fixed top-0 end-0 m-3';
-                resultToast.innerHTML = `
-                    <div class="d-flex">
-                        <div class="toast-body">
-                            Song "${songName}" was added successfully.
-                        </div>
-                        <button type="button" class="btn-close btn-close-white me-2 m-auto" data-bs-dismiss="toast" aria-label="Close"></button>
-                    </div>
-                `;
-                
-                // Reload the page to show the new song
-                setTimeout(() => {
-                    window.location.reload();
-                }, 1500);
-            } else {
-                // There was an error
-                resultToast.className = 'toast align-items-center text-bg-danger border-0 position-fixed top-0 end-0 m-3';
-                resultToast.innerHTML = `
-                    <div class="d-flex">
-                        <div class="toast-body">
-                            Error: ${data.error || 'Unknown error adding song'}
-                        </div>
-                        <button type="button" class="btn-close btn-close-white me-2 m-auto" data-bs-dismiss="toast" aria-label="Close"></button>
-                    </div>
-                `;
+            if (data.job_id) {
+                return pollDownloadJob(data.status_url, songName, loadingToast);
             }
-            
-            document.body.appendChild(resultToast);
-            const newToast = new bootstrap.Toast(resultToast);
-            newToast.show();
-            
-            // Close the modal
-            const modal = bootstrap.Modal.getInstance(document.getElementById('searchSongsModal'));
-            if (modal) {
-                modal.hide();
+            if (data.song_id) {
+                return data;  // The song was already in the library
             }
+            throw new Error(data.error || 'Unknown error adding song');
+        })
+        .then(() => {
+            loadingToast.remove();
+            showResultToast(true, `Song "${songName}" was added successfully.`);
+            
+            // Reload the page to show the new song
+            setTimeout(() => {
+                window.location.reload();
+            }, 1500);
         })
         .catch(error => {
             console.error('Error downloading song:', error);
             
             // Remove the loading toast
             loadingToast.remove();
-            
-            // Show error toast
-            const errorToast = document.createElement('div');
-            errorToast.className = 'toast align-items-center text-bg-danger border-0 position-fixed top-0 end-0 m-3';
-            errorToast.innerHTML = `
-                <div class="d-flex">
-                    <div class="toast-body">
-                        Error downloading song. Please try again.
-                    </div>
-                    <button type="button" class="btn-close btn-close-white me-2 m-auto" data-bs-dismiss="toast" aria-label="Close"></button>
-                </div>
-            `;
-            
-            document.body.appendChild(errorToast);
-            const newToast = new bootstrap.Toast(errorToast);
-            newToast.show();
+            showResultToast(false, `Error: ${error.message || 'Error downloading song. Please try again.'}`);
         });
     };
 });
@@ -0,0 +1,218 @@
+// Resumable song uploads for the artist page.
+//
+// Sends each selected file to the chunked upload API (/api/uploads) in
+// pieces instead of posting the whole form at once. A failed chunk is
+// retried after asking the server how much it already has, and the session
+// id is remembered in localStorage so picking the same file again after a
+// reload or a lost connection continues where it stopped. Each chunk and the
+// whole file are sent with their SHA-256, so the server refuses to store a
+// file that was assembled wrongly. Without fetch or File.slice the form is
+// submitted normally to /user_upload_song.
+document.addEventListener('DOMContentLoaded', function() {
+    const form = document.getElementById('upload-song-form');
+    if (!form || !window.fetch || !window.File || !File.prototype.slice) {
+        return;
+    }
+
+    const fileInput = document.getElementById('song-file');
+    const submitButton = form.querySelector('button[type="submit"]');
+    const artistId = form.querySelector('input[name="artist_id"]').value;
+
+    // Attempts per chunk before giving up on a file
+    const MAX_ATTEMPTS = 8;
+
+    const progress = document.createElement('div');
+    progress.className = 'upload-progress d-none';
+    progress.innerHTML = `
+        <div class="upload-progress-label small mb-1"></div>
+        <div class="progress" style="height: 1.25rem;">
+            <div class="progress-bar progress-bar-striped progress-bar-animated bg-success" role="progressbar" style="width: 0%">0%</div>
+        </div>
+    `;
+    form.querySelector('.modal-body').appendChild(progress);
+    const progressLabel = progress.querySelector('.upload-progress-label');
+    const progressBar = progress.querySelector('.progress-bar');
+
+    function showProgress(text, fraction) {
+        const percent = Math.floor(fraction * 100);
+        progress.classList.remove('d-none');
+        progressLabel.textContent = text;
+        progressBar.style.width = `${percent}%`;
+        progressBar.textContent = `${percent}%`;
+    }
+
+    function sleep(ms) {
+        return new Promise(resolve => setTimeout(resolve, ms));
+    }
+
+    // Key under which the session id for this exact file is remembered
+    function resumeKey(file) {
+        return `upload:${artistId}:${file.name}:${file.size}:${file.lastModified}`;
+    }
+
+    async function readJson(response) {
+        try {
+            return await response.json();
+        } catch (e) {
+            return {};
+        }
+    }
+
+    // SHA-256 of a blob as hex, or null where Web Crypto is unavailable (plain http)
+    async function sha256Hex(blob) {
+        if (!window.crypto || !crypto.subtle) {
+            return null;
+        }
+        const digest = await crypto.subtle.digest('SHA-256', await blob.arrayBuffer());
+        return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+    }
+
+    // Resume a remembered session for this file, or start a new one
+    async function openSession(file) {
+        const saved = localStorage.getItem(resumeKey(file));
+        if (saved) {
+            const response = await fetch(`/api/uploads/${saved}`);
+            if (response.ok) {
+                return response.json();
+            }
+            localStorage.removeItem(resumeKey(file));
+        }
+
+        // The server checks the assembled file against this before storing it
+        showProgress(`Preparing "${file.name}"...`, 0);
+        const body = { artist_id: artistId, filename: file.name, size: file.size };
+        const digest = await sha256Hex(file);
+        if (digest) {
+            body.sha256 = digest;
+        }
+        const response = await fetch('/api/uploads', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(body)
+        });
+        const session = await readJson(response);
+        if (!response.ok) {
+            const error = new Error(session.error || `Upload failed (${response.status})`);
+            error.skipped = response.status === 409;
+            throw error;
+        }
+        localStorage.setItem(resumeKey(file), session.id);
+        return session;
+    }
+
+    // Ask the server how many bytes it has, after a chunk failed
+    async function currentOffset(session) {
+        const response = await fetch(`/api/uploads/${session.id}`);
+        if (!response.ok) {
+            throw new Error('The upload expired, please try again');
+        }
+        return (await response.json()).offset;
+    }
+
+    async function uploadFile(file, index, count) {
+        const session = await openSession(file);
+        const label = count > 1 ? `Uploading "${file.name}" (${index + 1} of ${count})` : `Uploading "${file.name}"`;
+        let offset = session.offset;
+        let attempts = 0;
+
+        while (offset < file.size) {
+            showProgress(label, offset / file.size);
+            const chunk = file.slice(offset, offset + session.chunk_size);
+            const headers = { 'Content-Type': 'application/octet-stream' };
+            const digest = await sha256Hex(chunk);
+            if (digest) {
+                headers['X-Chunk-SHA256'] = digest;
+            }
+
+            try {
+                const response = await fetch(`${session.chunk_url}?offset=${offset}`, {
+                    method: 'PUT',
+                    headers: headers,
+                    body: chunk
+                });
+                const result = await readJson(response);
+                if (response.ok || response.status === 409) {
+                    // 409: the server is somewhere else (an earlier retry landed); continue from there
+                    offset = result.offset;
+                    attempts = 0;
+                    continue;
+                }
+                if (response.status === 404 || response.status === 410) {
+                    localStorage.removeItem(resumeKey(file));
+                    throw new Error(result.error || 'The upload expired, please try again');
+                }
+                if (response.status < 500 && response.status !== 400) {
+                    throw new Error(result.error || `Upload failed (${response.status})`);
+                }
+            } catch (e) {
+                if (!(e instanceof TypeError)) {
+                    throw e;
+                }
+                // TypeError: network failure, retry below
+            }
+
+            attempts += 1;
+            if (attempts >= MAX_ATTEMPTS) {
+                throw new Error('Connection lost. Select the file again to resume the upload.');
+            }
+            showProgress(`${label}: connection problem, retrying...`, offset / file.size);
+            await sleep(Math.min(30000, 1000 * 2 ** attempts));
+            try {
+                offset = await currentOffset(session);
+            } catch (e) {
+                if (!(e instanceof TypeError)) {
+                    throw e;
+                }
+            }
+        }
+
+        showProgress(`Saving "${file.name}"...`, 1);
+        const response = await fetch(session.complete_url, { method: 'POST' });
+        const result = await readJson(response);
+        localStorage.removeItem(resumeKey(file));
+        if (!response.ok) {
+            throw new Error(result.error || `Upload failed (${response.status})`);
+        }
+        return result;
+    }
+
+    form.addEventListener('submit', async function(event) {
+        event.preventDefault();
+        const files = Array.from(fileInput.files);
+        if (!files.length) {
+            return;
+        }
+
+        submitButton.disabled = true;
+        let uploaded = 0;
+        let skipped = 0;
+        const errors = [];
+
+        for (let i = 0; i < files.length; i++) {
+            try {
+                await uploadFile(files[i], i, files.length);
+                uploaded += 1;
+            } catch (e) {
+                if (e.skipped) {
+                    skipped += 1;
+                } else {
+                    errors.push(`${files[i].name}: ${e.message}`);
+                }
+            }
+        }
+
+        if (!errors.length) {
+            showProgress(uploaded === 1 ? 'Song uploaded successfully' : `${uploaded} songs uploaded successfully`
+                         + (skipped ? `, ${skipped} skipped (already exist)` : ''), 1);
+            window.location.reload();
+            return;
+        }
+
+        submitButton.disabled = false;
+        progressLabel.textContent = '';
+        const alert = document.createElement('div');
+        alert.className = 'alert alert-danger mt-3';
+        alert.textContent = `${uploaded} uploaded, ${skipped} skipped, ${errors.length} failed. ${errors.join(' ')}`;
+        progress.appendChild(alert);
+    });
+});
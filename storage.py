@@ -0,0 +1,495 @@
+"""
+Content-addressed audio storage for Country Music Paradise
+
+Every ingest path (user uploads, admin uploads, bulk uploads and remote
+downloads) writes through this module:
+- The incoming bytes are hashed with SHA-256 while they are written to a
+  temporary file, so the content is only read once
+- One file is kept per hash; uploading the same track again under another
+  name re-uses the existing blob instead of storing a second copy
+- Songs point at their AudioBlob and the blob's ref_count tracks how many do,
+  so a file is only removed when the last song using it is deleted
+- Blobs are fanned out into two levels of subdirectories named after the
+  start of the hash (ab/cd/abcd....mp3) so no directory grows too large
+- A blob row is locked (SELECT ... FOR UPDATE) while it is re-used or
+  released, so a delete cannot free a blob an ingest is about to reference.
+  The duplicate's temp file is kept until the ingest commits and put back
+  in place if the blob's file went missing meanwhile, and remove_file()
+  leaves files alone that a row points at again
+"""
+
+import os
+import re
+import hashlib
+import uuid
+import logging
+import tempfile
+from collections import Counter, namedtuple
+from sqlalchemy import bindparam, delete, event, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app import app, db
+from models import AudioBlob, Song
+from audio_meta import apply_to_song, probe
+import seek_index
+
+logger = logging.getLogger(__name__)
+
+# Read/write size used while hashing incoming audio
+CHUNK_SIZE = 1024 * 1024
+
+AUDIO_EXTENSIONS = ('.mp3', '.m4a', '.wav', '.ogg')
+
+
+def _music_folder():
+    return app.config.get('MUSIC_FOLDER', 'static/music')
+
+
+def _incoming_folder():
+    """Temporary files live inside the music folder so the final rename is atomic"""
+    folder = resolve(os.path.join(_music_folder(), '.incoming'))
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def partial_path(url):
+    """Where an interrupted download of `url` is kept until it can be resumed"""
+    name = hashlib.sha1(url.encode('utf-8')).hexdigest()
+    return os.path.join(_incoming_folder(), f"download-{name}.part")
+
+
+def upload_path(session_id):
+    """Where the received chunks of an upload session are written"""
+    return os.path.join(_incoming_folder(), f"upload-{session_id}.part")
+
+
+def audio_extension(filename, default='.mp3'):
+    """Normalised extension for a stored blob, taken from the original filename"""
+    ext = os.path.splitext(filename or '')[1].lower()
+    return ext if ext in AUDIO_EXTENSIONS else default
+
+
+# Blob files are named after their SHA-256 hex digest
+BLOB_NAME = re.compile(r'^[0-9a-f]{64}$')
+
+
+def shard_dir(digest):
+    """Fan-out directory for a digest, e.g. static/music/ab/cd"""
+    return os.path.join(_music_folder(), digest[:2], digest[2:4])
+
+
+def blob_path(digest, ext):
+    """Location of the blob with the given SHA-256 hex digest"""
+    return os.path.join(shard_dir(digest), f"{digest}{ext}")
+
+
+def canonical_path(filename):
+    """Where a stored file with this basename belongs in the music folder.
+
+    Content-addressed blobs live in their shard; files from before content
+    addressing stay directly in the music folder.
+    """
+    name = os.path.basename(filename)
+    digest, ext = os.path.splitext(name)
+    if BLOB_NAME.match(digest):
+        return blob_path(digest, ext)
+    return os.path.join(_music_folder(), name)
+
+
+def resolve(file_path):
+    """Filesystem path for a stored Song/AudioBlob file_path.
+
+    Stored paths are relative to the application root so the site can be
+    moved between servers; readers should open files through this.
+    """
+    if os.path.isabs(file_path):
+        return file_path
+    return os.path.join(app.root_path, file_path)
+
+
+def _write_chunks(chunks):
+    """Write chunks to a temp file, hashing as we go. Returns (tmp_path, digest, size)"""
+    hasher = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=_incoming_folder(), suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                hasher.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return tmp_path, hasher.hexdigest(), size
+
+
+# Session.info key of the duplicate temp files kept until the session commits
+_DUPLICATES = 'storage_duplicates'
+
+
+@event.listens_for(Session, 'after_commit')
+def _settle_duplicates(session):
+    """Drop kept duplicates, restoring any blob file removed before the commit"""
+    for tmp_path, file_path in session.info.pop(_DUPLICATES, []):
+        target = resolve(file_path)
+        try:
+            if os.path.exists(target):
+                os.remove(tmp_path)
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(tmp_path, target)
+            seek_index.build(target)
+            logger.warning(f"Restored {file_path}, removed while a duplicate upload was committing")
+        except OSError as e:
+            logger.error(f"Could not settle duplicate {tmp_path}: {str(e)}")
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_duplicates(session):
+    for tmp_path, file_path in session.info.pop(_DUPLICATES, []):
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def _register_blob(tmp_path, digest, size, ext, seek_offsets=None):
+    """Move a hashed temp file into place, or re-use the blob if it already exists"""
+    # Locked until commit, so release() cannot free it in between (PostgreSQL)
+    blob = AudioBlob.query.filter_by(sha256=digest).with_for_update().first()
+    if blob and os.path.exists(resolve(blob.file_path)):
+        # Kept until the reference is committed, in case the file goes anyway
+        db.session.info.setdefault(_DUPLICATES, []).append((tmp_path, blob.file_path))
+        logger.info(f"Duplicate audio {digest[:12]} re-uses {blob.file_path}")
+        return blob
+
+    final_path = blob.file_path if blob else blob_path(digest, ext)
+    os.makedirs(os.path.dirname(resolve(final_path)), exist_ok=True)
+    os.replace(tmp_path, resolve(final_path))
+    if seek_offsets is None:
+        seek_index.build(resolve(final_path))
+    elif seek_offsets:
+        seek_index.write_table(resolve(final_path), seek_offsets)
+    if blob:
+        return blob
+
+    blob = AudioBlob(sha256=digest, file_path=final_path, size=size, ref_count=0)
+    try:
+        # A concurrent ingest of the same content may insert the row first
+        with db.session.begin_nested():
+            db.session.add(blob)
+    except IntegrityError:
+        blob = AudioBlob.query.filter_by(sha256=digest).one()
+    return blob
+
+
+def store_chunks(chunks, filename=None):
+    """Store an iterable of byte chunks and return its AudioBlob"""
+    tmp_path, digest, size = _write_chunks(chunks)
+    return _register_blob(tmp_path, digest, size, audio_extension(filename))
+
+
+def store_stream(stream, filename=None):
+    """Store a readable binary stream (e.g. an uploaded FileStorage.stream)"""
+    return store_chunks(iter(lambda: stream.read(CHUNK_SIZE), b''), filename)
+
+
+def _hash_file(path):
+    """SHA-256 digest and size of a file on disk"""
+    hasher = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            hasher.update(chunk)
+            size += len(chunk)
+    return hasher.hexdigest(), size
+
+
+def store_file(path, link=False):
+    """Store a file that is already on disk.
+
+    With link=True the blob is a hard link to the source rather than a copy,
+    when both are on the same filesystem.
+    """
+    if link:
+        digest, size = _hash_file(path)
+        tmp_path = os.path.join(_incoming_folder(), f"{uuid.uuid4().hex}.part")
+        try:
+            os.link(path, tmp_path)
+        except OSError:
+            pass
+        else:
+            return _register_blob(tmp_path, digest, size, audio_extension(path))
+
+    with open(path, 'rb') as f:
+        return store_stream(f, os.path.basename(path))
+
+
+class ChecksumMismatch(ValueError):
+    """The stored bytes do not hash to the digest the client announced"""
+
+
+def store_incoming(path, filename=None, expected_sha256=None):
+    """Store a complete file from the incoming folder by moving it into place.
+
+    The file is consumed: it becomes the blob, or is removed if the blob
+    already exists. With expected_sha256 the file is checked first and left
+    untouched on a mismatch.
+    """
+    digest, size = _hash_file(path)
+    if expected_sha256 and digest != expected_sha256.lower():
+        raise ChecksumMismatch(f"expected sha256 {expected_sha256}, got {digest}")
+    return _register_blob(path, digest, size, audio_extension(filename))
+
+
+# Result of prepare_file(): a hashed copy in the incoming folder plus what
+# was read from it, waiting for store_prepared()
+PreparedFile = namedtuple('PreparedFile', 'tmp_path digest size filename info seek_offsets')
+
+
+def prepare_file(path, link=False):
+    """The file work of store_file(), without touching the database.
+
+    Copies (or with link=True hard-links) the file into the incoming folder
+    while hashing it, and reads its audio metadata and seek table, so every
+    byte is read on the calling thread. Safe to run on worker threads; hand
+    the result to store_prepared() on the thread that owns the session.
+    """
+    tmp_path = None
+    if link:
+        digest, size = _hash_file(path)
+        tmp_path = os.path.join(_incoming_folder(), f"{uuid.uuid4().hex}.part")
+        try:
+            os.link(path, tmp_path)
+        except OSError:
+            tmp_path = None
+    if tmp_path is None:
+        with open(path, 'rb') as f:
+            tmp_path, digest, size = _write_chunks(iter(lambda: f.read(CHUNK_SIZE), b''))
+
+    info = probe(tmp_path)
+    try:
+        offsets = seek_index.scan_mp3(tmp_path)
+    except OSError as e:
+        logger.warning(f"Could not build seek table for {path}: {str(e)}")
+        offsets = None
+    return PreparedFile(tmp_path, digest, size, os.path.basename(path), info, offsets or [])
+
+
+def store_prepared(prepared):
+    """Register a file from prepare_file() and return its AudioBlob"""
+    return _register_blob(prepared.tmp_path, prepared.digest, prepared.size,
+                          audio_extension(prepared.filename), seek_offsets=prepared.seek_offsets)
+
+
+def attach(song, blob):
+    """Point a song at a blob, take a reference on it and record its audio metadata"""
+    song.blob = blob
+    song.file_path = blob.file_path
+    blob.ref_count = AudioBlob.ref_count + 1
+    apply_to_song(song, resolve(blob.file_path))
+
+
+def song_row(blob, info=None, **columns):
+    """Column values for a new song stored in `blob`, for insert_songs().
+
+    `info` is the blob's audio_meta.probe() result when already known.
+    """
+    info = info or probe(resolve(blob.file_path))
+    return dict(
+        columns,
+        blob_id=blob.id,
+        file_path=blob.file_path,
+        duration=info['duration'],
+        bitrate=info['bitrate'],
+        sample_rate=info['sample_rate'],
+        codec=info['codec'],
+        file_size=info['size'],
+    )
+
+
+def _insert_ignoring_conflicts(rows):
+    """INSERT ... ON CONFLICT DO NOTHING; returns (id, artist_id, name, blob_id) of inserted rows"""
+    table = Song.__table__
+    returning = (table.c.id, table.c.artist_id, table.c.name, table.c.blob_id)
+    dialect = db.engine.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        inserted = []
+        for start in range(0, len(rows), 500):
+            stmt = (dialect_insert(table).values(rows[start:start + 500])
+                    .on_conflict_do_nothing().returning(*returning))
+            inserted.extend(db.session.execute(stmt).all())
+        return inserted
+
+    # Other databases: one savepoint per row
+    inserted = []
+    for row in rows:
+        try:
+            with db.session.begin_nested():
+                inserted.append(db.session.execute(insert(table).values(row).returning(*returning)).one())
+        except IntegrityError:
+            pass
+    return inserted
+
+
+def insert_songs(rows):
+    """Insert songs built with song_row() in bulk, skipping existing ones.
+
+    A row whose (artist_id, name) already exists, e.g. because another upload
+    of the same song committed first, is silently dropped by the database.
+    The inserted rows take their blob references in one UPDATE per blob.
+
+    Returns (inserted, unused): the (id, artist_id, name, blob_id) rows that
+    were inserted, and file paths of blobs that ended up used by no song, to
+    pass to remove_file() once the transaction has committed.
+    """
+    if not rows:
+        return [], []
+    inserted = _insert_ignoring_conflicts(rows)
+
+    refs = Counter(row.blob_id for row in inserted)
+    if refs:
+        blobs = AudioBlob.__table__
+        db.session.execute(
+            update(blobs).where(blobs.c.id == bindparam('b_id'))
+            .values(ref_count=blobs.c.ref_count + bindparam('refs')),
+            [{'b_id': blob_id, 'refs': count} for blob_id, count in refs.items()]
+        )
+
+    unused = []
+    skipped = {row['blob_id'] for row in rows} - set(refs)
+    if skipped:
+        orphans = AudioBlob.query.filter(AudioBlob.id.in_(skipped), AudioBlob.ref_count <= 0).all()
+        for blob in orphans:
+            unused.append(blob.file_path)
+            db.session.delete(blob)
+    db.session.flush()
+    # Keep ORM objects loaded earlier in the session in step with the new rows
+    db.session.expire_all()
+    return inserted, unused
+
+
+def release(song):
+    """Drop a song's reference to its file.
+
+    Returns the path that is no longer used by any song (to be removed once
+    the transaction has committed), or None if the file is still shared.
+    """
+    if song.blob_id is None:
+        # Songs stored before content addressing own their file outright,
+        # unless another row happens to point at the same path
+        shared = Song.query.filter(Song.file_path == song.file_path, Song.id != song.id).first()
+        return None if shared else song.file_path
+
+    # Waits for an ingest that is re-using the blob to commit (PostgreSQL)
+    blob = (AudioBlob.query.filter_by(id=song.blob_id)
+            .with_for_update().populate_existing().one())
+    blob.ref_count = AudioBlob.ref_count - 1
+    db.session.flush()
+    if blob.ref_count > 0:
+        return None
+
+    path = blob.file_path
+    song.blob = None
+    db.session.delete(blob)
+    return path
+
+
+def delete_songs(song_ids):
+    """Delete songs with a fixed number of statements, however many there are.
+
+    The set-based counterpart of release() + db.session.delete(): playlist
+    entries go, download jobs forget the songs, blob references are dropped
+    in one UPDATE per blob and blobs left unused are deleted. Returns the
+    file paths no row uses any more, to be removed after the commit.
+    """
+    if not song_ids:
+        return []
+    from models import DownloadJob, playlist_songs
+
+    songs = Song.__table__
+    blobs = AudioBlob.__table__
+    batch = songs.c.id.in_(song_ids)
+
+    refs = dict(db.session.execute(
+        select(songs.c.blob_id, func.count()).where(batch, songs.c.blob_id.isnot(None))
+        .group_by(songs.c.blob_id)
+    ).all())
+    # Songs stored before content addressing own their file outright
+    legacy = set(db.session.execute(
+        select(songs.c.file_path).where(batch, songs.c.blob_id.is_(None))
+    ).scalars())
+
+    db.session.execute(delete(playlist_songs).where(playlist_songs.c.song_id.in_(song_ids)))
+    db.session.execute(
+        update(DownloadJob.__table__).where(DownloadJob.__table__.c.song_id.in_(song_ids)).values(song_id=None)
+    )
+    db.session.execute(delete(songs).where(batch))
+
+    unused = []
+    if refs:
+        db.session.execute(
+            update(blobs).where(blobs.c.id == bindparam('b_id'))
+            .values(ref_count=blobs.c.ref_count - bindparam('refs')),
+            [{'b_id': blob_id, 'refs': count} for blob_id, count in refs.items()]
+        )
+        released = blobs.c.id.in_(list(refs)) & (blobs.c.ref_count <= 0)
+        unused.extend(db.session.execute(select(blobs.c.file_path).where(released)).scalars())
+        db.session.execute(delete(blobs).where(released))
+    if legacy:
+        # Unless another row happens to point at the same path
+        legacy -= set(db.session.execute(
+            select(songs.c.file_path).where(songs.c.file_path.in_(legacy))
+        ).scalars())
+        unused.extend(legacy)
+
+    # Keep ORM objects loaded earlier in the session in step with the deletes
+    db.session.expire_all()
+    return unused
+
+
+def discard_uncommitted(paths):
+    """Blobs stored by a request whose transaction was rolled back.
+
+    The files were moved into place before their rows were committed. A
+    blob row that survived the rollback (on SQLite a savepoint may commit
+    it) but no song uses is deleted like in insert_songs(). Returns the
+    paths no row points at any more, to pass to remove_file() after the
+    commit; files of audio stored earlier or by another request are kept.
+    """
+    paths = set(paths)
+    if not paths:
+        return []
+    for blob in AudioBlob.query.filter(AudioBlob.file_path.in_(paths), AudioBlob.ref_count <= 0).all():
+        db.session.delete(blob)
+    db.session.flush()
+    used = set(db.session.execute(select(Song.file_path).where(Song.file_path.in_(paths))).scalars())
+    used.update(db.session.execute(select(AudioBlob.file_path).where(AudioBlob.file_path.in_(paths))).scalars())
+    return sorted(paths - used)
+
+
+def remove_file(path):
+    """Remove a file released by release(), logging instead of raising.
+
+    The file is kept if a song or blob points at it again, e.g. because an
+    upload of the same audio committed after it was released.
+    """
+    if not path:
+        return
+    try:
+        if (db.session.query(Song.id).filter(Song.file_path == path).first() is not None
+                or db.session.query(AudioBlob.id).filter(AudioBlob.file_path == path).first() is not None):
+            logger.info(f"Keeping {path}: it is in use again")
+            return
+        for stale in (resolve(path), seek_index.table_path(resolve(path))):
+            if os.path.exists(stale):
+                os.remove(stale)
+    except Exception as e:
+        logger.error(f"Error deleting song file {path}: {str(e)}")
@@ -0,0 +1,64 @@
+"""
+Shared test setup: a throwaway SQLite database and music folder, and a
+stub HTTP server for code that talks to remote services.
+
+Run with: python -m pytest tests
+"""
+
+import os
+import sys
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+# The app reads its configuration at import time
+_tmp_dir = tempfile.mkdtemp(prefix='countrymusic-test-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_tmp_dir, 'test.db')}"
+os.environ.pop('PAGE_CACHE_DIR', None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db, create_app  # noqa: E402
+import models  # noqa: E402
+
+# Stored files go to the temporary directory, never into static/music
+app.config['MUSIC_FOLDER'] = os.path.join(_tmp_dir, 'music')
+os.makedirs(app.config['MUSIC_FOLDER'], exist_ok=True)
+
+
+@pytest.fixture
+def database():
+    """Empty tables for one test"""
+    with app.app_context():
+        db.create_all()
+        models.upgrade_schema()
+    yield
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(database):
+    create_app()
+    with app.test_client() as client:
+        yield client
+
+
+@pytest.fixture
+def http_server():
+    """start(handler_class) serves on localhost and returns the base URL"""
+    servers = []
+
+    def start(handler_class):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), handler_class)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
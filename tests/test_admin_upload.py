@@ -0,0 +1,83 @@
+"""
+Admin song upload (/admin/upload) under a concurrent duplicate and failures
+"""
+
+import io
+import os
+
+from app import app, db
+from models import Admin, Artist, Song
+import admin
+
+AUDIO = b'\x00' * 4096 + b'admin audio' * 500
+
+
+def _login(client):
+    with app.app_context():
+        user = Admin(username='admin')
+        user.set_password('secret')
+        db.session.add(user)
+        artist = Artist(name='Test Artist')
+        db.session.add(artist)
+        db.session.commit()
+        user_id, artist_id = user.id, artist.id
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    return artist_id
+
+
+def _upload(client, artist_id):
+    return client.post('/admin/upload', data={
+        'artist_id': str(artist_id),
+        'song_name': 'Test Song',
+        'song_file': (io.BytesIO(AUDIO), 'test.mp3'),
+    })
+
+
+def _stored_files():
+    return sorted(
+        os.path.join(folder, name)
+        for folder, dirs, names in os.walk(app.config['MUSIC_FOLDER'])
+        for name in names if not folder.endswith('.incoming')
+    )
+
+
+def test_concurrent_duplicate_is_skipped_cleanly(client, monkeypatch):
+    artist_id = _login(client)
+    store_stream = admin.store_stream
+
+    def store_then_race(stream, filename):
+        # The same song is committed by someone else after the "exists?" check
+        blob = store_stream(stream, filename)
+        with app.app_context():
+            db.session.add(Song(name='Test Song', artist_id=artist_id, file_path='elsewhere.mp3'))
+            db.session.commit()
+        return blob
+
+    monkeypatch.setattr(admin, 'store_stream', store_then_race)
+    response = _upload(client, artist_id)
+
+    assert response.status_code == 302
+    with app.app_context():
+        assert Song.query.filter_by(name='Test Song').count() == 1
+    # The blob stored for the skipped song is gone again
+    assert _stored_files() == []
+    # The session is still usable
+    assert client.get('/admin/upload').status_code == 200
+
+
+def test_failed_upload_leaves_no_file(client, monkeypatch):
+    artist_id = _login(client)
+
+    def failing_insert(rows):
+        raise RuntimeError('database unavailable')
+
+    monkeypatch.setattr(admin, 'insert_songs', failing_insert)
+    response = _upload(client, artist_id)
+
+    assert response.status_code == 200
+    assert b'database unavailable' in response.data
+    assert _stored_files() == []
+    with app.app_context():
+        assert Song.query.count() == 0
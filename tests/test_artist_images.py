@@ -0,0 +1,82 @@
+"""
+MusicBrainz lookups (artist_images.py): every attempt, retries included,
+goes through the rate limiter, and the background pool is per process
+"""
+
+import os
+import threading
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+from app import app
+import artist_images
+import http_client
+
+
+@pytest.fixture
+def musicbrainz(monkeypatch, http_server):
+    """Point MusicBrainz at a stub and count every limiter wait"""
+    monkeypatch.setitem(app.config, 'HTTP_RETRIES', 3)
+    monkeypatch.setattr(http_client, '_session_pid', None)
+    waits = []
+    monkeypatch.setattr(artist_images.musicbrainz_limiter, 'wait', lambda: waits.append(1))
+
+    def start(handler):
+        monkeypatch.setattr(artist_images, 'MUSICBRAINZ_API', http_server(handler))
+        return waits
+    return start
+
+
+def busy_handler(failures):
+    """Answers 503 to the first `failures` requests, then a JSON search result"""
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        requests = 0
+        lock = threading.Lock()
+
+        def do_GET(self):
+            with Handler.lock:
+                Handler.requests += 1
+                failing = Handler.requests <= failures
+            body = b'busy' if failing else b'{"artists": [{"id": "mbid-1"}]}'
+            self.send_response(503 if failing else 200)
+            self.send_header('Content-Length', str(len(body)))
+            if failing:
+                self.send_header('Retry-After', '0')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def test_retries_wait_for_the_rate_limiter(musicbrainz):
+    handler = busy_handler(failures=2)
+    waits = musicbrainz(handler)
+
+    assert artist_images._find_mbid('Test Artist') == 'mbid-1'
+    # Two 503s and the success, each one paced by the limiter
+    assert handler.requests == 3
+    assert len(waits) == 3
+
+
+def test_gives_up_after_the_retries(musicbrainz):
+    handler = busy_handler(failures=100)
+    waits = musicbrainz(handler)
+
+    with pytest.raises(IOError, match='503'):
+        artist_images._find_mbid('Test Artist')
+    assert handler.requests == 1 + artist_images.MUSICBRAINZ_RETRIES
+    assert len(waits) == handler.requests
+
+
+def test_background_pool_is_recreated_after_fork(monkeypatch):
+    pool = artist_images._executor()
+    assert artist_images._executor() is pool
+
+    # What a forked worker sees: the pool was made by another pid
+    monkeypatch.setattr(artist_images, '_pool_pid', os.getpid() + 1)
+    assert artist_images._executor() is not pool
@@ -0,0 +1,209 @@
+"""
+Segmented, resumable downloads (http_client.download), the progress
+download jobs record while they run (against a stub server that supports
+Range requests) and the one-active-job-per-song rule of download_jobs.submit
+"""
+
+import os
+import re
+import time
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+from sqlalchemy import event, update
+
+from app import app, db
+from models import Artist, Song, DownloadJob
+import http_client
+import download_jobs
+
+MIB = 1024 * 1024
+DATA = bytes(range(256)) * (6 * MIB // 256)
+RANGE = re.compile(r'bytes=(\d+)-(\d*)')
+
+
+def range_handler(data, etag='"v1"', cut_after=None, delay=0.0):
+    """Handler class serving `data` with Range support.
+
+    With cut_after (a class attribute, so a test can change it between
+    downloads), a range response is closed after that many bytes, like a
+    connection dropping mid-transfer. Requested ranges are recorded.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        ranges = []
+
+        def do_GET(self):
+            match = RANGE.match(self.headers.get('Range', ''))
+            if not match:
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                return
+            start = int(match.group(1))
+            end = int(match.group(2) or len(data) - 1)
+            Handler.ranges.append((start, end))
+            body = data[start:end + 1]
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('ETag', etag)
+            self.end_headers()
+            if Handler.cut_after is not None and len(body) > 1:
+                body = body[:Handler.cut_after]
+            for offset in range(0, len(body), 256 * 1024):
+                self.wfile.write(body[offset:offset + 256 * 1024])
+                time.sleep(delay)
+
+        def log_message(self, format, *args):
+            pass
+
+    Handler.cut_after = cut_after
+    return Handler
+
+
+def _small_segments(monkeypatch):
+    monkeypatch.setitem(app.config, 'DOWNLOAD_SEGMENTS', 3)
+    monkeypatch.setitem(app.config, 'DOWNLOAD_SEGMENT_MIN', MIB)
+    monkeypatch.setitem(app.config, 'HTTP_RETRIES', 0)
+
+
+def test_interrupted_segments_resume_where_they_stopped(tmp_path, http_server, monkeypatch):
+    _small_segments(monkeypatch)
+    path = str(tmp_path / 'song.part')
+
+    handler = range_handler(DATA, cut_after=MIB + MIB // 2)
+    url = http_server(handler)
+    with pytest.raises(Exception):
+        http_client.download(url, path)
+    assert os.path.exists(f"{path}.state")
+
+    handler.cut_after = None
+    handler.ranges = []
+    calls = []
+    http_client.download(url, path, progress=lambda done, total: calls.append((done, total)))
+
+    with open(path, 'rb') as f:
+        assert f.read() == DATA
+    assert not os.path.exists(f"{path}.state")
+    # Every segment continued from the bytes already on disk
+    segment_starts = [start for start, end in handler.ranges if end > 0]
+    assert len(segment_starts) == 3
+    assert all(start % (2 * MIB) != 0 for start in segment_starts)
+    assert calls[-1] == (len(DATA), len(DATA))
+
+
+def test_progress_runs_on_the_calling_thread(tmp_path, http_server, monkeypatch):
+    _small_segments(monkeypatch)
+    monkeypatch.setattr(http_client, 'PROGRESS_POLL', 0.05)
+    url = http_server(range_handler(DATA, delay=0.02))
+    threads = set()
+
+    http_client.download(url, str(tmp_path / 'song.part'),
+                         progress=lambda done, total: threads.add(threading.get_ident()))
+
+    assert threads == {threading.get_ident()}
+
+
+def test_download_job_records_progress(database, http_server, monkeypatch, caplog):
+    _small_segments(monkeypatch)
+    monkeypatch.setattr(http_client, 'PROGRESS_POLL', 0.05)
+    monkeypatch.setattr(download_jobs, 'PROGRESS_INTERVAL', 0)
+    url = http_server(range_handler(DATA, delay=0.02))
+
+    with app.app_context():
+        artist = Artist(name='Test Artist')
+        db.session.add(artist)
+        db.session.flush()
+        job = DownloadJob(artist_id=artist.id, song_name='Test Song', source_url=url, source='test')
+        db.session.add(job)
+        db.session.commit()
+        job_id = job.id
+        engine = db.engine
+
+    written = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('UPDATE download_job') and 'bytes_done' in statement:
+            written.append(parameters)
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        with caplog.at_level(logging.WARNING, logger='download_jobs'):
+            download_jobs._run(job_id)
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+    assert 'Could not record progress' not in caplog.text
+    # Progress updates carry (bytes_done, bytes_total, updated_at, id)
+    partial = [params for params in written if 0 < params[0] < len(DATA)]
+    assert partial
+    assert all(params[1] == len(DATA) for params in partial)
+
+    with app.app_context():
+        job = db.session.get(DownloadJob, job_id)
+        assert job.status == DownloadJob.DONE
+        song = db.session.get(Song, job.song_id)
+        assert song.file_size == len(DATA)
+
+
+def test_concurrent_submits_create_one_job(database, monkeypatch):
+    scheduled = []
+    monkeypatch.setattr(download_jobs, 'schedule', scheduled.append)
+    # Every request misses the first lookup, as if they all arrived at once
+    active_job = download_jobs._active_job
+    first_lookup = threading.local()
+
+    def racing_active_job(artist_id, song_name):
+        if not getattr(first_lookup, 'done', False):
+            first_lookup.done = True
+            return None
+        return active_job(artist_id, song_name)
+
+    monkeypatch.setattr(download_jobs, '_active_job', racing_active_job)
+
+    with app.app_context():
+        artist = Artist(name='Test Artist')
+        db.session.add(artist)
+        db.session.commit()
+        artist_id = artist.id
+
+    results = []
+
+    def submit():
+        with app.app_context():
+            artist = db.session.get(Artist, artist_id)
+            job, created = download_jobs.submit(artist, 'Test Song', 'http://example.com/a.mp3', 'test')
+            results.append((job.id, created))
+
+    threads = [threading.Thread(target=submit) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 4
+    assert len({job_id for job_id, created in results}) == 1
+    assert sum(created for job_id, created in results) == 1
+    assert len(scheduled) == 1
+
+    # Once the job is over the song can be queued again
+    with app.app_context():
+        db.session.execute(update(DownloadJob).values(status=DownloadJob.FAILED))
+        db.session.commit()
+        job, created = download_jobs.submit(db.session.get(Artist, artist_id), 'Test Song', None, 'test')
+        assert created
+        assert DownloadJob.query.count() == 2
+
+
+def test_recovery_waits_for_bootstrap(caplog):
+    # No `database` fixture: the tables do not exist yet
+    with app.app_context():
+        db.drop_all()
+    with caplog.at_level(logging.WARNING, logger='download_jobs'):
+        download_jobs._recover_in_background()
+
+    assert 'run `python bootstrap.py` first' in caplog.text
+    assert 'Could not recover' not in caplog.text
@@ -0,0 +1,107 @@
+"""
+Shared outbound HTTP client (http_client.py) against a stub server:
+connections are kept alive and reused, 5xx answers are retried, and no
+more than HTTP_MAX_PER_HOST requests run against one host at a time
+"""
+
+import time
+import threading
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+from app import app
+import http_client
+
+
+@pytest.fixture
+def fresh_client(monkeypatch):
+    """Rebuild the session with fast retries for this test"""
+    monkeypatch.setitem(app.config, 'HTTP_RETRIES', 3)
+    monkeypatch.setitem(app.config, 'HTTP_BACKOFF', 0.01)
+    monkeypatch.setitem(app.config, 'HTTP_MAX_PER_HOST', 2)
+    monkeypatch.setattr(http_client, '_session_pid', None)
+
+
+def stub_handler(failures=0, delay=0.0):
+    """Answers 503 to the first `failures` requests, then 200 "ok".
+
+    Records the client port of every request and the highest number of
+    requests handled at the same time.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        ports = []
+        active = 0
+        peak = 0
+        lock = threading.Lock()
+
+        def do_GET(self):
+            with Handler.lock:
+                Handler.ports.append(self.client_address[1])
+                failing = len(Handler.ports) <= failures
+                Handler.active += 1
+                Handler.peak = max(Handler.peak, Handler.active)
+            time.sleep(delay)
+            with Handler.lock:
+                Handler.active -= 1
+            body = b'busy' if failing else b'ok'
+            self.send_response(503 if failing else 200)
+            self.send_header('Content-Length', str(len(body)))
+            if failing:
+                self.send_header('Retry-After', '0')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def test_connections_are_reused(fresh_client, http_server):
+    handler = stub_handler()
+    url = http_server(handler)
+
+    for _ in range(5):
+        response = http_client.get(f"{url}/search")
+        assert response.status_code == 200
+        assert response.content == b'ok'
+
+    # Five requests over one kept-alive connection
+    assert len(handler.ports) == 5
+    assert len(set(handler.ports)) == 1
+
+
+def test_server_errors_are_retried(fresh_client, http_server):
+    handler = stub_handler(failures=2)
+    url = http_server(handler)
+
+    response = http_client.get(url)
+
+    assert response.status_code == 200
+    assert len(handler.ports) == 3
+
+
+def test_gives_up_after_the_configured_retries(fresh_client, http_server):
+    handler = stub_handler(failures=100)
+    url = http_server(handler)
+
+    response = http_client.get(url)
+
+    assert response.status_code == 503
+    assert len(handler.ports) == 1 + app.config['HTTP_RETRIES']
+
+
+def test_requests_per_host_are_limited(fresh_client, http_server):
+    handler = stub_handler(delay=0.1)
+    url = http_server(handler)
+
+    threads = [threading.Thread(target=http_client.get, args=(url,)) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(handler.ports) == 6
+    assert handler.peak == 2
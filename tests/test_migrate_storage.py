@@ -0,0 +1,43 @@
+"""
+Moving flat blobs into their shard directories (migrate_storage.py)
+"""
+
+import os
+import hashlib
+
+from app import app, db
+from models import Artist, Song, AudioBlob
+from storage import canonical_path, resolve
+from migrate_storage import migrate_blobs
+import seek_index
+
+
+def test_migrated_blob_keeps_its_seek_table(database):
+    data = b'not really audio' * 1000
+    digest = hashlib.sha256(data).hexdigest()
+    flat_path = os.path.join(app.config['MUSIC_FOLDER'], f"{digest}.mp3")
+    with open(flat_path, 'wb') as f:
+        f.write(data)
+    seek_index.write_table(flat_path, [0, 4000, 8000])
+    with open(seek_index.table_path(flat_path), 'rb') as f:
+        table = f.read()
+
+    with app.app_context():
+        artist = Artist(name='Test Artist')
+        db.session.add(artist)
+        db.session.flush()
+        blob = AudioBlob(sha256=digest, file_path=flat_path, size=len(data), ref_count=1)
+        db.session.add(blob)
+        db.session.flush()
+        db.session.add(Song(name='Test Song', artist_id=artist.id, blob_id=blob.id, file_path=flat_path))
+        db.session.commit()
+
+        assert migrate_blobs(batch_size=10, pause=0) == 1
+        new_path = resolve(canonical_path(flat_path))
+        assert db.session.query(Song.file_path).scalar() == canonical_path(flat_path)
+
+    assert not os.path.exists(flat_path)
+    assert not os.path.exists(seek_index.table_path(flat_path))
+    with open(seek_index.table_path(new_path), 'rb') as f:
+        assert f.read() == table
+    assert seek_index.offset_for(new_path, 1) is not None
@@ -0,0 +1,75 @@
+"""
+Query counts of the artist list
+
+The home page used to load Artist.songs for every artist just to show how
+many songs it has (one query per artist). These tests count the statements
+sent to the database while the list is built and rendered, so the N+1
+cannot come back unnoticed.
+"""
+
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from app import app, db
+from models import Artist, Song, artists_with_song_counts, bump_catalog_version
+
+
+@contextmanager
+def count_queries():
+    """Count the statements executed on the engine inside the block"""
+    statements = []
+    with app.app_context():
+        engine = db.engine
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def add_artists(count, songs_each):
+    start = Artist.query.count()
+    for i in range(start, start + count):
+        artist = Artist(name=f"Artist {i:03d}")
+        db.session.add(artist)
+        db.session.flush()
+        for j in range(songs_each):
+            db.session.add(Song(name=f"Song {j}", artist_id=artist.id,
+                                file_path=f"static/music/test_{i}_{j}.mp3"))
+    bump_catalog_version()
+    db.session.commit()
+
+
+def test_artists_with_song_counts_is_one_query(client):
+    with app.app_context():
+        add_artists(5, 3)
+        db.session.expire_all()
+        with count_queries() as statements:
+            rows = artists_with_song_counts()
+            counts = [(artist.name, song_count) for artist, song_count in rows]
+
+    assert len(statements) == 1
+    assert counts == [(f"Artist {i:03d}", 3) for i in range(5)]
+
+
+def test_home_page_queries_do_not_grow_with_artists(client):
+    with app.app_context():
+        add_artists(3, 2)
+    with count_queries() as few:
+        response = client.get('/')
+    assert response.status_code == 200
+
+    with app.app_context():
+        add_artists(20, 4)
+    with count_queries() as many:
+        response = client.get('/')
+    assert response.status_code == 200
+    assert b"Artist 022" in response.data
+
+    assert len(many) == len(few)
+    assert len(many) <= 3
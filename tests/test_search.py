@@ -0,0 +1,148 @@
+"""
+Remote search fan-out (music_api.search_songs) with stub providers: they
+run concurrently, slow ones are cut off at their deadline or the total
+budget, and only successful results are cached
+"""
+
+import json
+import time
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+from app import app
+import music_api
+from music_api import search_songs, search_jamendo
+from search_cache import search_cache, MISS
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    search_cache.clear()
+    yield
+    search_cache.clear()
+
+
+def jamendo_handler(status, tracks=()):
+    class Handler(BaseHTTPRequestHandler):
+        calls = 0
+
+        def do_GET(self):
+            Handler.calls += 1
+            body = json.dumps({'results': list(tracks)}).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def test_provider_errors_are_not_cached():
+    calls = []
+
+    def failing(query, artist=None):
+        calls.append(query)
+        raise IOError('provider down')
+
+    providers = [('Broken', failing, 1.0)]
+    for _ in range(2):
+        result = search_songs('jolene', providers=providers)
+        assert result['results'] == []
+        assert result['providers']['Broken']['status'] == 'error'
+
+    # Both searches reached the provider; nothing was cached in between
+    assert len(calls) == 2
+    assert search_cache.get(search_cache.key('Broken', 'jolene'))[1] == MISS
+
+
+def test_jamendo_http_error_is_reported_and_not_cached(http_server, monkeypatch):
+    handler = jamendo_handler(503)
+    monkeypatch.setattr(music_api, 'JAMENDO_API_BASE', http_server(handler))
+    monkeypatch.setattr(music_api, 'JAMENDO_API_KEY', 'test')
+    monkeypatch.setitem(app.config, 'HTTP_RETRIES', 0)
+
+    with pytest.raises(IOError):
+        search_jamendo('jolene')
+
+    result = search_songs('jolene', providers=[('Jamendo', search_jamendo, 2.0)])
+    assert result['providers']['Jamendo']['status'] == 'error'
+    assert search_cache.get(search_cache.key('Jamendo', 'jolene'))[1] == MISS
+
+
+def test_jamendo_results_are_cached(http_server, monkeypatch):
+    track = {'id': 7, 'name': 'Jolene', 'artist_name': 'Dolly Parton', 'audio': 'http://example.com/7.mp3'}
+    handler = jamendo_handler(200, [track])
+    monkeypatch.setattr(music_api, 'JAMENDO_API_BASE', http_server(handler))
+    monkeypatch.setattr(music_api, 'JAMENDO_API_KEY', 'test')
+
+    providers = [('Jamendo', search_jamendo, 2.0)]
+    first = search_songs('jolene', providers=providers)
+    # The result is stored by a callback that may run just after the search returns
+    deadline = time.monotonic() + 2
+    while search_cache.get(search_cache.key('Jamendo', 'jolene'))[1] == MISS and time.monotonic() < deadline:
+        time.sleep(0.01)
+    second = search_songs('jolene', providers=providers)
+
+    assert [song['name'] for song in first['results']] == ['Jolene']
+    assert second['results'] == first['results']
+    assert second['providers']['Jamendo']['cache'] == 'hit'
+    assert handler.calls == 1
+
+
+def _sleeping(seconds, name):
+    def provider(query, artist=None):
+        time.sleep(seconds)
+        return [{'id': name, 'name': query, 'source': name}]
+    return provider
+
+
+def test_providers_are_queried_concurrently():
+    providers = [(f'P{i}', _sleeping(0.3, f'P{i}'), 2.0) for i in range(3)]
+
+    started = time.monotonic()
+    result = search_songs('jolene', providers=providers, budget=2.0)
+    elapsed = time.monotonic() - started
+
+    # Three 0.3s providers side by side, not one after another
+    assert elapsed < 0.8
+    assert [song['id'] for song in result['results']] == ['P0', 'P1', 'P2']
+    assert all(meta['status'] == 'ok' for meta in result['providers'].values())
+
+
+def test_slow_provider_is_left_out_at_its_deadline():
+    providers = [('Fast', _sleeping(0, 'Fast'), 1.0), ('Slow', _sleeping(1.0, 'Slow'), 0.2)]
+
+    started = time.monotonic()
+    result = search_songs('jolene', providers=providers, budget=2.0)
+
+    assert time.monotonic() - started < 0.6
+    assert [song['id'] for song in result['results']] == ['Fast']
+    assert result['providers']['Slow']['status'] == 'timeout'
+    assert result['providers']['Fast']['status'] == 'ok'
+
+
+def test_total_budget_caps_every_provider():
+    providers = [('Slow', _sleeping(1.0, 'Slow'), 5.0)]
+
+    started = time.monotonic()
+    result = search_songs('jolene', providers=providers, budget=0.2)
+
+    assert time.monotonic() - started < 0.6
+    assert result['providers']['Slow']['status'] == 'timeout'
+
+
+def test_late_results_are_cached_for_the_next_search():
+    providers = [('Slow', _sleeping(0.3, 'Slow'), 0.1)]
+
+    first = search_songs('jolene', providers=providers, budget=1.0)
+    assert first['providers']['Slow']['status'] == 'timeout'
+
+    time.sleep(0.5)
+    second = search_songs('jolene', providers=providers, budget=1.0)
+    assert second['providers']['Slow']['cache'] == 'hit'
+    assert [song['id'] for song in second['results']] == ['Slow']
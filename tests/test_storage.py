@@ -0,0 +1,88 @@
+"""
+Content-addressed storage (storage.py) under concurrent ingest and delete
+"""
+
+import io
+import os
+import threading
+
+from app import app, db
+from models import Artist, Song
+from storage import store_stream, song_row, insert_songs, release, remove_file, resolve
+
+AUDIO = b'\x00' * 4096 + b'test audio' * 100
+
+
+def _add_song(artist_id, name):
+    blob = store_stream(io.BytesIO(AUDIO), f"{name}.mp3")
+    inserted, unused = insert_songs([song_row(blob, name=name, artist_id=artist_id, source='test')])
+    db.session.commit()
+    return inserted[0].id, blob.file_path
+
+
+def _delete_song(song_id):
+    """Delete a song the way the admin dashboard does, in another session"""
+    with app.app_context():
+        song = db.session.get(Song, song_id)
+        unused = release(song)
+        db.session.delete(song)
+        db.session.commit()
+        remove_file(unused)
+
+
+def test_duplicate_ingest_survives_concurrent_delete(database):
+    with app.app_context():
+        artist = Artist(name='Test Artist')
+        db.session.add(artist)
+        db.session.commit()
+        artist_id = artist.id
+        first_id, path = _add_song(artist_id, 'First')
+
+        # A second upload of the same audio re-uses the blob...
+        blob = store_stream(io.BytesIO(AUDIO), 'Second.mp3')
+        assert blob.file_path == path
+        row = song_row(blob, name='Second', artist_id=artist_id, source='test')
+
+        # ...while the only song using it is deleted and its file removed
+        worker = threading.Thread(target=_delete_song, args=(first_id,))
+        worker.start()
+        worker.join()
+        assert not os.path.exists(resolve(path))
+
+        inserted, unused = insert_songs([row])
+        db.session.commit()
+        for stale in unused:
+            remove_file(stale)
+
+        song = db.session.get(Song, inserted[0].id)
+        with open(resolve(song.file_path), 'rb') as f:
+            assert f.read() == AUDIO
+        # No temp file is left behind
+        assert not [name for name in os.listdir(os.path.join(app.config['MUSIC_FOLDER'], '.incoming'))
+                    if name.endswith('.part')]
+
+
+def test_rolled_back_duplicate_leaves_no_temp_file(database):
+    with app.app_context():
+        artist = Artist(name='Test Artist')
+        db.session.add(artist)
+        db.session.commit()
+        _, path = _add_song(artist.id, 'First')
+
+        store_stream(io.BytesIO(AUDIO), 'Again.mp3')
+        db.session.rollback()
+
+        assert os.path.exists(resolve(path))
+        assert not [name for name in os.listdir(os.path.join(app.config['MUSIC_FOLDER'], '.incoming'))
+                    if name.endswith('.part')]
+
+
+def test_remove_file_keeps_files_in_use(database):
+    with app.app_context():
+        artist = Artist(name='Test Artist')
+        db.session.add(artist)
+        db.session.commit()
+        _, path = _add_song(artist.id, 'First')
+
+        remove_file(path)
+        assert os.path.exists(resolve(path))
@@ -0,0 +1,77 @@
+"""
+Chunked uploads (upload_routes.py)
+"""
+
+import time
+import hashlib
+import threading
+
+from app import app, db
+from models import Artist, Song, UploadSession
+import upload_routes
+
+AUDIO = b'\x00' * 4096 + b'test audio' * 1000
+
+
+def _start_upload(client):
+    with app.app_context():
+        artist = Artist(name='Test Artist')
+        db.session.add(artist)
+        db.session.commit()
+        artist_id = artist.id
+
+    response = client.post('/api/uploads', json={
+        'artist_id': artist_id, 'filename': 'Test Song.mp3', 'size': len(AUDIO),
+        'sha256': hashlib.sha256(AUDIO).hexdigest(),
+    })
+    assert response.status_code == 201
+    session = response.get_json()
+    response = client.put(f"{session['chunk_url']}?offset=0", data=AUDIO,
+                          headers={'Content-Type': 'application/octet-stream'})
+    assert response.status_code == 200
+    return session
+
+
+def test_concurrent_complete_stores_the_song_once(client, monkeypatch):
+    session = _start_upload(client)
+
+    # Hold the first /complete inside store_incoming while the second arrives
+    store_incoming = upload_routes.store_incoming
+
+    def slow_store_incoming(*args):
+        time.sleep(0.3)
+        return store_incoming(*args)
+
+    monkeypatch.setattr(upload_routes, 'store_incoming', slow_store_incoming)
+
+    statuses = []
+
+    def complete():
+        with app.test_client() as other:
+            statuses.append(other.post(session['complete_url']).status_code)
+
+    threads = [threading.Thread(target=complete) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.05)
+    for thread in threads:
+        thread.join()
+
+    assert sorted(statuses) == [201, 409]
+    with app.app_context():
+        assert Song.query.filter_by(name='Test Song').count() == 1
+        assert db.session.get(UploadSession, session['id']) is None
+
+
+def test_failed_complete_releases_the_claim(client, monkeypatch):
+    session = _start_upload(client)
+
+    def failing_insert(rows):
+        raise RuntimeError('database unavailable')
+
+    monkeypatch.setattr(upload_routes, 'insert_songs', failing_insert)
+    monkeypatch.setitem(app.config, 'PROPAGATE_EXCEPTIONS', False)
+    assert client.post(session['complete_url']).status_code == 500
+
+    with app.app_context():
+        assert db.session.get(UploadSession, session['id']).state == UploadSession.OPEN
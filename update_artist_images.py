@@ -1,16 +1,32 @@
+#!/usr/bin/env python
+"""
+Update Artist Images
 
-import os
+Fetches artist pictures from MusicBrainz for every artist that has not been
+checked recently (see artist_images.py). Lookups run concurrently under the
+MusicBrainz rate limit, and images that have not changed are not downloaded
+again.
+
+Usage:
+  python update_artist_images.py [--workers 4] [--force]
+
+--force checks every artist again and refreshes the cached image URLs.
+"""
+
+import argparse
 from app import app
-from models import Artist
-from routes import get_artist_image
+from artist_images import fetch_images
 
-def update_all_artist_images():
+def update_all_artist_images(workers=4, force=False):
     with app.app_context():
-        artists = Artist.query.all()
-        for artist in artists:
-            print(f"Downloading image for {artist.name}...")
-            get_artist_image(artist.name)
+        return fetch_images(workers=workers, force=force)
 
 if __name__ == "__main__":
-    update_all_artist_images()
-    print("Artist image update complete!")
+    parser = argparse.ArgumentParser(description="Download artist images from MusicBrainz")
+    parser.add_argument("--workers", type=int, default=4, help="artists processed at once")
+    parser.add_argument("--force", action="store_true", help="re-check artists checked recently")
+    args = parser.parse_args()
+
+    counts = update_all_artist_images(args.workers, args.force)
+    print(f"Artist image update complete! {counts['updated']} updated, {counts['unchanged']} unchanged, "
+          f"{counts['not_found']} without an image, {counts['error']} failed.")
@@ -0,0 +1,372 @@
+"""
+Chunked, resumable song uploads for Country Music Paradise
+
+Large files are sent in pieces instead of one multipart request, so a
+dropped connection only costs the chunk in flight and no worker is tied up
+for the length of the whole upload:
+
+  POST   /api/uploads                  {artist_id, filename, size, sha256?}
+                                       -> 201 with the session id and offset 0
+  GET    /api/uploads/<id>             current offset (also Upload-Offset header)
+  PUT    /api/uploads/<id>?offset=N    raw bytes of the next chunk
+  POST   /api/uploads/<id>/complete    store the file and create the Song
+  DELETE /api/uploads/<id>             abandon the upload
+
+- A chunk must start at the session's current offset (409 with the real
+  offset otherwise, so the client can resume from there), may not run past
+  the announced size and, if it carries X-Chunk-SHA256, must match it
+- Each request first receives its chunk into a temporary file of its own.
+  Only a complete, verified chunk is copied into
+  .incoming/upload-<id>.part, while holding a lock on that file, after
+  checking that the offset is still the one it was sent for; the offset is
+  advanced in the same critical section. A stalled or duplicate request
+  for the same offset therefore gets a 409 and never touches bytes another
+  request has committed, and nothing is ever cut off the partial file
+- The Song is only registered by /complete, which hashes the file once,
+  checks it against the sha256 given at creation and moves it into the
+  content-addressed store (storage.py). It first claims the session with a
+  conditional UPDATE (open -> completing), so a retried or double-clicked
+  /complete gets a 409 instead of racing for the partial file
+- Sessions idle for longer than UPLOAD_SESSION_TTL are removed with their
+  partial files whenever a new upload starts
+
+static/js/chunked-upload.js drives this from the artist page; the plain
+/user_upload_song form remains as the fallback.
+"""
+
+import os
+import uuid
+import fcntl
+import hashlib
+import tempfile
+import logging
+from datetime import datetime, timedelta
+from flask import request, jsonify, url_for, current_app
+from sqlalchemy import update
+from app import db
+from models import Artist, Song, UploadSession, bump_catalog_version
+from storage import (AUDIO_EXTENSIONS, CHUNK_SIZE, ChecksumMismatch, upload_path,
+                     store_incoming, song_row, insert_songs, remove_file)
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _error(message, status, upload=None):
+    body = {'error': message}
+    if upload is not None:
+        body['offset'] = upload.offset
+    return jsonify(body), status
+
+
+def _remove_part(session_id):
+    try:
+        os.remove(upload_path(session_id))
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.error(f"Error removing partial upload {session_id}: {str(e)}")
+
+
+def _expire_sessions(app):
+    """Drop upload sessions nobody has touched within UPLOAD_SESSION_TTL"""
+    cutoff = datetime.utcnow() - timedelta(seconds=app.config.get('UPLOAD_SESSION_TTL', 86400))
+    expired = [session_id for (session_id,) in
+               db.session.query(UploadSession.id).filter(UploadSession.updated_at < cutoff)]
+    if not expired:
+        return
+    UploadSession.query.filter(UploadSession.id.in_(expired)).delete(synchronize_session=False)
+    db.session.commit()
+    for session_id in expired:
+        _remove_part(session_id)
+    logger.info(f"Removed {len(expired)} expired upload sessions")
+
+
+def _session_response(upload, status=200):
+    body = upload.to_dict()
+    body['chunk_url'] = url_for('api_upload_chunk', session_id=upload.id)
+    body['complete_url'] = url_for('api_upload_complete', session_id=upload.id)
+    body['chunk_size'] = current_app.config['UPLOAD_CHUNK_SIZE']
+    response = jsonify(body)
+    response.status_code = status
+    response.headers['Upload-Offset'] = str(upload.offset)
+    response.headers['Upload-Length'] = str(upload.size)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+def _receive_chunk(session_id, length, expected_digest):
+    """Copy the request body into a temporary file of this request.
+
+    Returns (chunk_path, error); on error the temporary file is already gone.
+    """
+    hasher = hashlib.sha256()
+    received = 0
+    fd, chunk_path = tempfile.mkstemp(dir=os.path.dirname(upload_path(session_id)),
+                                      prefix=f"upload-{session_id}-", suffix='.chunk')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while received < length:
+                data = request.stream.read(min(CHUNK_SIZE, length - received))
+                if not data:
+                    break
+                f.write(data)
+                hasher.update(data)
+                received += len(data)
+    except Exception as e:
+        logger.warning(f"Upload chunk for {session_id} interrupted: {str(e)}")
+
+    error = None
+    if received != length:
+        error = f'Chunk incomplete: received {received} of {length} bytes'
+    elif expected_digest and hasher.hexdigest() != expected_digest.lower():
+        error = 'Chunk checksum mismatch'
+    if error:
+        os.remove(chunk_path)
+        return None, error
+    return chunk_path, None
+
+
+def _commit_chunk(upload_id, chunk_path, offset, length):
+    """Write a received chunk into the partial file and advance the offset.
+
+    Runs under an exclusive lock on the partial file so only one request per
+    session can be here; the offset is re-read inside the lock. Returns False
+    if another request committed this range first.
+    """
+    fd = os.open(upload_path(upload_id), os.O_WRONLY)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        current = db.session.query(UploadSession.offset).filter_by(id=upload_id).scalar()
+        if current != offset:
+            db.session.rollback()
+            return False
+
+        with open(chunk_path, 'rb') as chunk:
+            position = offset
+            for data in iter(lambda: chunk.read(CHUNK_SIZE), b''):
+                os.pwrite(fd, data, position)
+                position += len(data)
+        os.fsync(fd)
+
+        # Bytes past the committed offset are simply overwritten by the next
+        # chunk if this UPDATE never happens
+        result = db.session.execute(
+            update(UploadSession)
+            .where(UploadSession.id == upload_id, UploadSession.offset == offset)
+            .values(offset=offset + length, updated_at=datetime.utcnow())
+        )
+        db.session.commit()
+        return result.rowcount == 1
+    finally:
+        os.close(fd)  # Releases the lock
+
+
+def _complete_upload(session_id):
+    """Store the claimed upload and create its Song"""
+    upload = db.session.get(UploadSession, session_id)
+    artist = db.session.get(Artist, upload.artist_id)
+    existing = Song.query.filter_by(name=upload.song_name, artist_id=upload.artist_id).first()
+    if existing or not artist:
+        db.session.delete(upload)
+        db.session.commit()
+        _remove_part(session_id)
+        if not artist:
+            return _error('Artist not found', 404)
+        return _error(f"Song '{upload.song_name}' already exists for {artist.name}", 409)
+
+    path = upload_path(session_id)
+    if not os.path.exists(path) or os.path.getsize(path) != upload.size:
+        db.session.delete(upload)
+        db.session.commit()
+        _remove_part(session_id)
+        return _error('Upload data is missing, start a new upload', 410)
+
+    try:
+        blob = store_incoming(path, upload.filename, upload.sha256)
+    except ChecksumMismatch as e:
+        logger.warning(f"Upload {session_id} rejected: {str(e)}")
+        db.session.delete(upload)
+        db.session.commit()
+        _remove_part(session_id)
+        return _error('File checksum mismatch, please upload it again', 422)
+
+    # A concurrent upload of the same song may have won; the database decides
+    song_name, artist_name = upload.song_name, artist.name
+    inserted, unused = insert_songs([
+        song_row(blob, name=song_name, artist_id=upload.artist_id, source='user_upload')
+    ])
+    db.session.delete(upload)
+    if inserted:
+        bump_catalog_version()
+    db.session.commit()
+    for stale in unused:
+        remove_file(stale)
+    if not inserted:
+        return _error(f"Song '{song_name}' already exists for {artist_name}", 409)
+
+    song = db.session.get(Song, inserted[0].id)
+    logger.info(f"Successfully added song '{song_name}' for {artist_name} (upload {session_id})")
+
+    return jsonify({
+        'success': True,
+        'song': {
+            'id': song.id,
+            'name': song.name,
+            'artist': artist_name,
+            'duration': song.duration
+        },
+        'message': f"'{song.name}' uploaded successfully"
+    }), 201
+
+
+def register_upload_routes(app):
+    """Register the chunked upload API with the Flask app"""
+
+    @app.route('/api/uploads', methods=['POST'])
+    def api_upload_create():
+        """Start an upload session for one song file"""
+        data = request.get_json(silent=True) or {}
+        filename = os.path.basename(str(data.get('filename') or '').replace('\\', '/'))
+        try:
+            artist_id = int(data.get('artist_id'))
+            size = int(data.get('size'))
+        except (TypeError, ValueError):
+            return _error('artist_id and size are required', 400)
+
+        song_name = os.path.splitext(filename)[0]
+        if not song_name:
+            return _error('filename is required', 400)
+        if os.path.splitext(filename)[1].lower() not in AUDIO_EXTENSIONS:
+            return _error(f"Unsupported file type. Allowed: {', '.join(AUDIO_EXTENSIONS)}", 400)
+        max_size = app.config['UPLOAD_MAX_SIZE']
+        if size <= 0:
+            return _error('size must be positive', 400)
+        if size > max_size:
+            return _error(f'File is too large (maximum {max_size} bytes)', 413)
+
+        sha256 = data.get('sha256')
+        if sha256 and (len(sha256) != 64 or any(c not in '0123456789abcdefABCDEF' for c in sha256)):
+            return _error('sha256 must be a hex SHA-256 digest', 400)
+
+        artist = db.session.get(Artist, artist_id)
+        if not artist:
+            return _error('Artist not found', 404)
+        if Song.query.filter_by(name=song_name, artist_id=artist_id).first():
+            return _error(f"Song '{song_name}' already exists for {artist.name}", 409)
+
+        _expire_sessions(app)
+
+        upload = UploadSession(
+            id=uuid.uuid4().hex,
+            artist_id=artist_id,
+            song_name=song_name,
+            filename=filename,
+            size=size,
+            offset=0,
+            sha256=sha256.lower() if sha256 else None,
+        )
+        # Create the empty partial file now so chunks only ever write into it
+        open(upload_path(upload.id), 'wb').close()
+        db.session.add(upload)
+        db.session.commit()
+        logger.info(f"Upload {upload.id} started: '{song_name}' for {artist.name} ({size} bytes)")
+
+        response = _session_response(upload, 201)
+        response.headers['Location'] = url_for('api_upload_status', session_id=upload.id)
+        return response
+
+    @app.route('/api/uploads/<session_id>', methods=['GET'])
+    def api_upload_status(session_id):
+        """How much of the file has been received"""
+        upload = db.get_or_404(UploadSession, session_id)
+        return _session_response(upload)
+
+    @app.route('/api/uploads/<session_id>', methods=['PUT'])
+    def api_upload_chunk(session_id):
+        """Append one chunk at ?offset= (or the Upload-Offset header)"""
+        upload = db.get_or_404(UploadSession, session_id)
+
+        offset = request.args.get('offset', request.headers.get('Upload-Offset'))
+        try:
+            offset = int(offset)
+        except (TypeError, ValueError):
+            return _error('offset is required', 400, upload)
+        if offset != upload.offset:
+            return _error('Offset does not match the data received so far', 409, upload)
+
+        length = request.content_length
+        if length is None:
+            return _error('Content-Length is required', 411, upload)
+        if length <= 0 or length > app.config['UPLOAD_CHUNK_MAX']:
+            return _error(f"Chunks must be between 1 and {app.config['UPLOAD_CHUNK_MAX']} bytes", 413, upload)
+        if offset + length > upload.size:
+            return _error('Chunk runs past the end of the file', 400, upload)
+
+        path = upload_path(upload.id)
+        if not os.path.exists(path):
+            return _error('Upload data is missing, start a new upload', 410)
+
+        # Release the connection while the body streams in
+        db.session.rollback()
+
+        chunk_path, problem = _receive_chunk(session_id, length, request.headers.get('X-Chunk-SHA256'))
+        if problem:
+            db.session.refresh(upload)
+            return _error(problem, 400, upload)
+
+        try:
+            committed = _commit_chunk(session_id, chunk_path, offset, length)
+        except FileNotFoundError:
+            return _error('Upload data is missing, start a new upload', 410)
+        finally:
+            os.remove(chunk_path)
+
+        upload = db.session.get(UploadSession, session_id)
+        if upload is None:
+            return _error('Upload data is missing, start a new upload', 410)
+        if not committed:
+            return _error('Offset does not match the data received so far', 409, upload)
+        return _session_response(upload)
+
+    @app.route('/api/uploads/<session_id>/complete', methods=['POST'])
+    def api_upload_complete(session_id):
+        """Turn a fully received upload into a Song"""
+        upload = db.get_or_404(UploadSession, session_id)
+        if upload.offset != upload.size:
+            return _error('Upload is not complete yet', 409, upload)
+
+        # Only one request may take the partial file; the others are told so
+        claimed = db.session.execute(
+            update(UploadSession)
+            .where(UploadSession.id == session_id, UploadSession.state == UploadSession.OPEN,
+                   UploadSession.offset == UploadSession.size)
+            .values(state=UploadSession.COMPLETING, updated_at=datetime.utcnow())
+        ).rowcount
+        db.session.commit()
+        if not claimed:
+            return _error('Upload is already being completed', 409)
+
+        try:
+            return _complete_upload(session_id)
+        except Exception:
+            # Give the session back so the client can try again
+            db.session.rollback()
+            db.session.execute(
+                update(UploadSession).where(UploadSession.id == session_id)
+                .values(state=UploadSession.OPEN, updated_at=datetime.utcnow())
+            )
+            db.session.commit()
+            raise
+
+    @app.route('/api/uploads/<session_id>', methods=['DELETE'])
+    def api_upload_abort(session_id):
+        """Abandon an upload and discard what was received"""
+        upload = db.get_or_404(UploadSession, session_id)
+        if upload.state == UploadSession.COMPLETING:
+            return _error('Upload is being completed', 409, upload)
+        db.session.delete(upload)
+        db.session.commit()
+        _remove_part(session_id)
+        return '', 204